@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ghost Text予測（/ai/predict）のハンドラー時間ベンチマーク
+
+リクエストごとにリズム定義とスケール走査を行っていた旧実装と、
+起動時に構築した音楽理論テーブルを引く現在の実装の処理時間を比較し、
+4/4拍子での提案結果が一致することを確認します。
+また、1小節分（16分音符グリッド）の提案を単発APIで16回取得する場合と
+バッチAPI（/ai/predict/batch）で1回取得する場合をHTTP経由で比較します。
+目標: 1,000リクエスト/秒の負荷でハンドラー時間がサブミリ秒であること。
+
+使用方法:
+    python benchmark_ghost_text.py
+"""
+import sys
+import io
+import os
+import asyncio
+import random
+import statistics
+import time
+
+import httpx
+
+# Windows環境でUTF-8出力を強制
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ai_agent.main as agent  # noqa: E402
+
+REQUESTS = 1000
+TARGET_RPS = 1000
+GENRES = ["Lo-Fi Hip Hop", "Jazz", "Pop"]
+BAR_GRID_STEP = 0.25  # 16分音符
+HTTP_ROUNDS = 50
+CHORDS = [None, {"midi_notes": [60, 64, 67]}, {"midi_notes": [62, 65, 69]}, {"midi_notes": [67, 71, 74]}]
+
+
+def predict_legacy(request) -> dict:
+    """旧実装（リクエストごとにリズム定義・キャッシュキーを構築し、スケールを条件分岐で走査・4/4固定）"""
+    rhythm_definitions = {
+        "Lo-Fi Hip Hop": {"time_signature": "4/4", "strong_beats": [1, 3], "weak_beats": [2, 4],
+                          "off_beats_priority": [2, 4], "swing_ratio": 0.15,
+                          "drum_pattern_hint": "Kick on 1 & 3. Snare on 2 & 4 (Backbeat)."},
+        "Jazz": {"time_signature": "4/4", "strong_beats": [1, 3], "weak_beats": [2, 4],
+                 "off_beats_priority": [1, 2, 3, 4], "swing_ratio": 0.67,
+                 "drum_pattern_hint": "Swing feel, ride cymbal on swing 8ths"},
+        "Pop": {"time_signature": "4/4", "strong_beats": [1, 3], "weak_beats": [2, 4],
+                "off_beats_priority": [2, 4], "swing_ratio": 0.0,
+                "drum_pattern_hint": "Kick on 1, Snare on 2 & 4"}
+    }
+    genre = request.genre or "Lo-Fi Hip Hop"
+    rhythm_def = rhythm_definitions.get(genre, rhythm_definitions["Lo-Fi Hip Hop"])
+    current_beat = (request.cursor_position % 4) + 1
+    is_strong_beat = int(current_beat) in rhythm_def["strong_beats"]
+    is_weak_beat = int(current_beat) in rhythm_def["weak_beats"]
+    agent.make_cache_key("predict", {
+        "track_type": request.track_type,
+        "genre": genre,
+        "current_beat": round(current_beat, 6),
+        "scale_notes": request.scale_notes_midi,
+        "chord_notes": (request.current_chord or {}).get("midi_notes"),
+        "last_pitch": request.current_notes[-1]["pitch"] if request.current_notes else None
+    })
+
+    suggestions = []
+    if request.track_type in ("melody", "Melody"):
+        scale_notes = request.scale_notes_midi or [60, 62, 64, 65, 67, 69, 71]
+        chord_notes = []
+        if request.current_chord and request.current_chord.get("midi_notes"):
+            chord_notes = request.current_chord["midi_notes"]
+        for note in scale_notes:
+            confidence = 0.5
+            reasoning_tag = "Scale_Note"
+            if is_strong_beat and note in chord_notes:
+                confidence = 0.95
+                reasoning_tag = "Current_Chord_Root_Strong_Beat"
+            elif is_strong_beat:
+                confidence = 0.65
+                reasoning_tag = "Scale_Tone_Strong_Beat"
+            elif is_weak_beat:
+                confidence = 0.70
+                reasoning_tag = "Scale_Tone_Weak_Beat"
+                if note not in chord_notes:
+                    reasoning_tag = "Tension_Note_Weak_Beat"
+            if request.current_notes:
+                interval = abs(note - request.current_notes[-1]["pitch"])
+                if interval <= 2:
+                    confidence += 0.1
+                    reasoning_tag += "_Stepwise_Motion"
+                elif interval == 12:
+                    confidence += 0.05
+                    reasoning_tag += "_Octave_Jump"
+            suggestions.append({"midi_note": int(note), "confidence": min(confidence, 1.0),
+                                "reasoning_tag": reasoning_tag})
+    else:
+        if is_strong_beat:
+            suggestions.append({"midi_note": 36, "confidence": 0.98, "reasoning_tag": "Rhythm_Kick_on_Strong_Beat"})
+        if is_weak_beat:
+            suggestions.append({"midi_note": 38, "confidence": 0.95, "reasoning_tag": "Backbeat_Snare"})
+        suggestions.append({"midi_note": 42, "confidence": 0.85, "reasoning_tag": "Hi_Hat_8th_Note"})
+        if rhythm_def["swing_ratio"] > 0.3 and int(current_beat) in rhythm_def["off_beats_priority"]:
+            suggestions.append({"midi_note": 46, "confidence": 0.75, "reasoning_tag": "Swing_Open_Hat_Off_Beat"})
+
+    suggestions.sort(key=lambda x: x["confidence"], reverse=True)
+    return {"suggestions": suggestions[:5], "track_type": request.track_type, "current_beat": current_beat,
+            "is_strong_beat": is_strong_beat, "genre": genre, "rhythm_definition": rhythm_def}
+
+
+def make_requests(count: int) -> list:
+    """ランダムな4/4拍子のリクエストを生成（キーストロークごとの呼び出しを想定）"""
+    rng = random.Random(0)
+    requests = []
+    for _ in range(count):
+        notes = [{"pitch": rng.randint(55, 79), "start": i * 0.5, "duration": 0.5, "velocity": 0.8}
+                 for i in range(rng.randint(0, 8))]
+        requests.append(agent.GhostTextPredictRequest(
+            current_notes=notes,
+            cursor_position=rng.choice([0, 0.5, 1, 1.5, 2, 2.5, 3, 3.5]) + 4 * rng.randint(0, 16),
+            track_type=rng.choice(["melody", "melody", "rhythm"]),
+            genre=rng.choice(GENRES),
+            current_chord=rng.choice(CHORDS)
+        ))
+    return requests
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def measure_paced(requests: list) -> list:
+    """TARGET_RPSのペースでハンドラーを呼び出し、各リクエストの処理時間（秒）を返す"""
+    interval = 1.0 / TARGET_RPS
+    latencies = []
+    next_at = time.perf_counter()
+    for request in requests:
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        start = time.perf_counter()
+        await agent.ghost_text_predict(request)
+        latencies.append(time.perf_counter() - start)
+        next_at += interval
+    return latencies
+
+
+def measure_loop(func, requests: list) -> list:
+    latencies = []
+    for request in requests:
+        start = time.perf_counter()
+        func(request)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(name: str, latencies: list) -> None:
+    print(f"[BENCH] {name:>14s}: "
+          f"p50 {percentile(latencies, 50) * 1e6:7.1f} us | "
+          f"p99 {percentile(latencies, 99) * 1e6:7.1f} us | "
+          f"mean {statistics.mean(latencies) * 1e6:7.1f} us | "
+          f"capacity {1 / statistics.mean(latencies):9.0f} req/s")
+
+
+async def measure_bar_http() -> tuple:
+    """1小節分の提案取得にかかる時間（単発16回 vs バッチ1回）をASGI経由で計測"""
+    context = {"current_notes": [{"pitch": 64}], "track_type": "melody", "genre": "Lo-Fi Hip Hop",
+               "current_chord": {"midi_notes": [60, 64, 67]}}
+    positions = [i * BAR_GRID_STEP for i in range(int(4 / BAR_GRID_STEP))]
+    single_times, batch_times = [], []
+    transport = httpx.ASGITransport(app=agent.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(HTTP_ROUNDS):
+            start = time.perf_counter()
+            for position in positions:
+                response = await client.post("/ai/predict", json={**context, "cursor_position": position})
+                response.raise_for_status()
+            single_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            response = await client.post("/ai/predict/batch", json={
+                **context, "range_start": 0, "range_end": 4, "grid_step": BAR_GRID_STEP
+            })
+            response.raise_for_status()
+            batch_times.append(time.perf_counter() - start)
+    return single_times, batch_times
+
+
+def benchmark():
+    print("=" * 70)
+    print(f"Ghost Text predict handler time ({REQUESTS} requests)")
+    print(f"Theory index: {agent.ghost_text_index.stats()}")
+    print("=" * 70)
+
+    requests = make_requests(REQUESTS)
+    identical = all(predict_legacy(r) == agent.predict_ghost_text(r) for r in requests)
+
+    measure_loop(predict_legacy, requests)  # ウォームアップ
+    report("legacy", measure_loop(predict_legacy, requests))
+    measure_loop(agent.predict_ghost_text, requests)
+    report("theory index", measure_loop(agent.predict_ghost_text, requests))
+
+    paced = asyncio.run(measure_paced(requests))
+    report(f"@{TARGET_RPS} req/s", paced)
+    print(f"[BENCH] identical to legacy (4/4): {identical} | "
+          f"sub-millisecond p99 at {TARGET_RPS} req/s: {percentile(paced, 99) < 1e-3}")
+
+    single_times, batch_times = asyncio.run(measure_bar_http())
+    print(f"[BENCH] one bar ({int(4 / BAR_GRID_STEP)} positions) over HTTP: "
+          f"single x{int(4 / BAR_GRID_STEP)} {statistics.median(single_times) * 1000:6.2f} ms | "
+          f"batch {statistics.median(batch_times) * 1000:6.2f} ms | "
+          f"speedup {statistics.median(single_times) / statistics.median(batch_times):5.1f}x")
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DiffSinger音声合成プロキシのレイテンシベンチマーク
+
+ローカルに代替DiffSingerサーバー（固定レスポンスを返すaiohttpサーバー）を起動し、
+/ai/api/voice/synthesize プロキシのp50/p99レイテンシを比較します。
+- per-request: 従来方式（リクエストごとにClientSessionを作成）
+- shared: 共有セッション（http_sessions）を使う現在の実装
+
+使用方法:
+    python benchmark_voice_proxy.py
+"""
+import sys
+import io
+import os
+import asyncio
+import statistics
+import time
+
+import aiohttp
+from aiohttp import web
+
+# Windows環境でUTF-8出力を強制
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+STAND_IN_HOST = "127.0.0.1"
+STAND_IN_PORT = 18001
+REQUESTS = 300
+CONCURRENCY = 8
+
+# プロキシ先を代替サーバーに向けてからインポート
+os.environ["DIFFSINGER_BASE_URL"] = f"http://{STAND_IN_HOST}:{STAND_IN_PORT}"
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ai_agent.main as agent  # noqa: E402
+
+PAYLOAD = {
+    "lyrics": "あいうえお",
+    "notes": "C4|D4|E4|F4|G4",
+    "durations": "0.5|0.5|0.5|0.5|1.0",
+    "output_path": "outputs/synthesis.wav"
+}
+
+
+async def stand_in_synthesize(request: web.Request) -> web.Response:
+    """代替DiffSingerサーバーの /api/synthesize（合成は行わず固定レスポンス）"""
+    await request.json()
+    return web.json_response({
+        "status": "success",
+        "message": "stand-in synthesis",
+        "audio_path": "outputs/synthesis.wav",
+        "duration": 3.0
+    })
+
+
+async def start_stand_in_server() -> web.AppRunner:
+    server = web.Application()
+    server.router.add_post("/api/synthesize", stand_in_synthesize)
+    runner = web.AppRunner(server, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, STAND_IN_HOST, STAND_IN_PORT).start()
+    return runner
+
+
+async def proxy_per_request_session() -> None:
+    """従来実装相当（リクエストごとに新しいClientSession）"""
+    async with aiohttp.ClientSession() as session:
+        async with session.post(
+            f"{agent.DIFFSINGER_BASE_URL}/api/synthesize",
+            json=PAYLOAD,
+            timeout=aiohttp.ClientTimeout(total=120)
+        ) as response:
+            await response.json()
+
+
+async def proxy_shared_session() -> None:
+    """現在の実装（共有セッション経由のプロキシエンドポイント）"""
+    await agent.voice_synthesize(agent.DiffSingerSynthesisRequest(**PAYLOAD))
+
+
+async def measure(func) -> list:
+    """CONCURRENCY並列でREQUESTS回呼び出し、各リクエストのレイテンシ（秒）を返す"""
+    latencies = []
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await func()
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[one() for _ in range(REQUESTS)])
+    return latencies
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def benchmark():
+    print("=" * 70)
+    print(f"DiffSinger proxy latency ({REQUESTS} requests, concurrency {CONCURRENCY})")
+    print("=" * 70)
+
+    runner = await start_stand_in_server()
+    await agent.http_sessions.startup()
+
+    # プロキシ内のログ出力を抑制して計測
+    real_stdout = sys.stdout
+    try:
+        for name, func in [("per-request", proxy_per_request_session), ("shared", proxy_shared_session)]:
+            sys.stdout = io.StringIO()
+            await measure(func)  # ウォームアップ
+            latencies = await measure(func)
+            sys.stdout = real_stdout
+            print(f"[BENCH] {name:>12s}: "
+                  f"p50 {percentile(latencies, 50) * 1000:7.2f} ms | "
+                  f"p99 {percentile(latencies, 99) * 1000:7.2f} ms | "
+                  f"mean {statistics.mean(latencies) * 1000:7.2f} ms")
+    finally:
+        sys.stdout = real_stdout
+        await agent.http_sessions.close()
+        await runner.cleanup()
+
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    asyncio.run(benchmark())
@@ -1,16 +1,25 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import google.generativeai as genai
+from google.ai import generativelanguage as glm
 import os
 import json
-import requests
 from dotenv import load_dotenv
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 import time # Added for time.time()
 import asyncio
 import aiohttp
+import zlib
+import hashlib
+import unicodedata
+from collections import OrderedDict
+import functools
+import math
+import re
+import threading
+import secrets
+from concurrent.futures import ThreadPoolExecutor
 
 
 
@@ -55,6 +64,374 @@ DEFAULT_API_KEYS = {
     "google": os.getenv("GEMINI_API_KEY")
 }
 
+# DiffSingerサーバーのURL
+DIFFSINGER_BASE_URL = os.getenv("DIFFSINGER_BASE_URL", "http://localhost:8001")
+
+# 上流サーバーごとのHTTP接続設定（接続はアプリ起動中ずっと再利用する）
+UPSTREAM_HTTP_SETTINGS = {
+    "anthropic": {
+        "limit_per_host": 20,
+        # ストリーミング応答のため全体タイムアウトは設けず、無通信時間で打ち切る
+        "timeout": aiohttp.ClientTimeout(total=None, connect=10, sock_connect=10, sock_read=120)
+    },
+    "openai": {
+        "limit_per_host": 20,
+        "timeout": aiohttp.ClientTimeout(total=None, connect=10, sock_connect=10, sock_read=120)
+    },
+    "diffsinger": {
+        "limit_per_host": 10,
+        # 個々のリクエストでは用途に応じた total タイムアウトを指定する
+        "timeout": aiohttp.ClientTimeout(total=120, connect=5, sock_connect=5)
+    }
+}
+HTTP_KEEPALIVE_TIMEOUT = 30  # アイドル接続を保持する秒数
+HTTP_DNS_CACHE_TTL = 300     # DNS解決結果のキャッシュ秒数
+
+
+class UpstreamSessionPool:
+    """上流サーバーごとに共有するaiohttp.ClientSessionの管理（keep-alive・接続数上限・DNSキャッシュ付き）"""
+
+    def __init__(self, settings: Dict[str, Dict[str, Any]]):
+        self.settings = settings
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+
+    def _create_session(self, name: str) -> aiohttp.ClientSession:
+        setting = self.settings[name]
+        connector = aiohttp.TCPConnector(
+            limit_per_host=setting["limit_per_host"],
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT
+        )
+        return aiohttp.ClientSession(connector=connector, timeout=setting["timeout"])
+
+    def get(self, name: str) -> aiohttp.ClientSession:
+        """上流サーバー用のセッションを取得（未作成・クローズ済みなら作成）"""
+        session = self._sessions.get(name)
+        if session is None or session.closed:
+            session = self._create_session(name)
+            self._sessions[name] = session
+        return session
+
+    async def startup(self):
+        """全上流サーバーのセッションを作成"""
+        for name in self.settings:
+            self.get(name)
+        print(f"UpstreamSessionPool: Created sessions for {', '.join(self.settings)}")
+
+    async def close(self):
+        """全セッションをクローズ"""
+        sessions = list(self._sessions.values())
+        self._sessions = {}
+        for session in sessions:
+            if not session.closed:
+                await session.close()
+        print("UpstreamSessionPool: Closed all sessions")
+
+
+# 共有HTTPセッション（サブアプリとしてマウントされた場合は親アプリの起動・終了時にも呼ばれる）
+http_sessions = UpstreamSessionPool(UPSTREAM_HTTP_SETTINGS)
+
+
+@app.on_event("startup")
+async def startup_http_sessions():
+    await http_sessions.startup()
+
+
+@app.on_event("shutdown")
+async def shutdown_http_sessions():
+    await http_sessions.close()
+
+
+# プロバイダーごとの同時呼び出し数の上限（1つの遅いLLM応答が他のリクエストを巻き込まないようにする）
+PROVIDER_CONCURRENCY_LIMITS = {
+    "anthropic": 8,
+    "openai": 8,
+    "google": 8
+}
+LLM_REQUEST_TIMEOUT_SEC = 30          # 非ストリーミング呼び出しのタイムアウト
+LLM_THREAD_POOL_SIZE = 8              # 同期SDK（Gemini）を実行するスレッド数
+GEMINI_CLIENT_CACHE_SIZE = 32         # APIキーごとに保持するGeminiクライアント数
+DISCONNECT_POLL_INTERVAL_SEC = 0.5    # クライアント切断を確認する間隔
+
+# SSEフレーミング設定（小さなテキスト差分を1フレームにまとめて送信回数を減らす）
+SSE_FRAME_MAX_BYTES = 1024            # 1フレームにまとめるテキストの最大バイト数
+SSE_FRAME_MAX_WAIT_SEC = 0.03         # フレームを送出するまで待つ最大時間
+SSE_GZIP_ENABLED = os.getenv("SSE_GZIP_ENABLED", "false").lower() == "true"  # gzipを許可するプロキシ環境でのみ有効化
+STREAM_DEBUG_SAMPLE_EVERY = int(os.getenv("STREAM_DEBUG_SAMPLE_EVERY", "0"))  # Nチャンクに1回デバッグ出力（0で無効）
+SSE_DONE = "[DONE]"                   # ストリーム終了イベント
+
+provider_semaphores = {
+    provider: asyncio.Semaphore(limit) for provider, limit in PROVIDER_CONCURRENCY_LIMITS.items()
+}
+llm_thread_pool = ThreadPoolExecutor(max_workers=LLM_THREAD_POOL_SIZE, thread_name_prefix="llm")
+
+_gemini_clients: "OrderedDict[str, glm.GenerativeServiceClient]" = OrderedDict()
+_gemini_clients_lock = threading.Lock()
+
+
+class ClientDisconnectedError(Exception):
+    """LLM応答を待っている間にクライアントが切断した場合のエラー"""
+
+
+def get_gemini_client(api_key: str) -> glm.GenerativeServiceClient:
+    """APIキーごとのGeminiクライアントを取得（最近使われていないキーのクライアントから破棄）"""
+    with _gemini_clients_lock:
+        client = _gemini_clients.get(api_key)
+        if client is not None:
+            _gemini_clients.move_to_end(api_key)
+            return client
+        client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+        _gemini_clients[api_key] = client
+        if len(_gemini_clients) > GEMINI_CLIENT_CACHE_SIZE:
+            _gemini_clients.popitem(last=False)
+        return client
+
+
+def gemini_request(model_name: str, prompt: str,
+                   system_instruction: Optional[str] = None) -> glm.GenerateContentRequest:
+    """Gemini の generate_content リクエストを構築（1ターンのユーザープロンプト）"""
+    request = glm.GenerateContentRequest(
+        model=f"models/{model_name}",
+        contents=[glm.Content(role="user", parts=[glm.Part(text=prompt)])]
+    )
+    if system_instruction:
+        request.system_instruction = glm.Content(parts=[glm.Part(text=system_instruction)])
+    return request
+
+
+def gemini_response_text(response: glm.GenerateContentResponse) -> str:
+    """応答の最初の候補のテキストを連結（候補がない場合はブロックされたとみなして ValueError）"""
+    if not response.candidates:
+        raise ValueError(f"Gemini returned no candidates: {response.prompt_feedback}")
+    return "".join(part.text for part in response.candidates[0].content.parts)
+
+
+def gemini_generate(api_key: str, model_name: str, prompt: str, system_instruction: Optional[str] = None) -> str:
+    """
+    Gemini でテキストを生成（同期。スレッドプールから呼ぶ）
+
+    genai.GenerativeModel は generate_content の中でプロセス全体の既定クライアントを使うため、
+    APIキー専用の GenerativeServiceClient を直接呼び出し、並行する別キーのリクエストと課金が混ざらないようにする。
+    """
+    client = get_gemini_client(api_key)
+    return gemini_response_text(client.generate_content(gemini_request(model_name, prompt, system_instruction)))
+
+
+def gemini_stream(api_key: str, model_name: str, prompt: str, system_instruction: Optional[str] = None):
+    """Gemini のストリーミング応答のテキストを順に返す（同期ジェネレーター。テキストを含まないチャンクは飛ばす）"""
+    client = get_gemini_client(api_key)
+    for chunk in client.stream_generate_content(gemini_request(model_name, prompt, system_instruction)):
+        if not chunk.candidates:
+            continue
+        text = "".join(part.text for part in chunk.candidates[0].content.parts)
+        if text:
+            yield text
+
+
+def release_slot_when_done(future: asyncio.Future, semaphore: asyncio.Semaphore) -> None:
+    """スレッドの終了時にプロバイダーの枠を返す（待つ側がキャンセルされても、スレッドが動いている間は枠を保持する）"""
+    def done(f: asyncio.Future):
+        semaphore.release()
+        if not f.cancelled():
+            f.exception()  # 待つ側がいなくなった場合に未取得の例外として警告されないようにする
+
+    future.add_done_callback(done)
+
+
+async def run_in_llm_thread(provider: str, func, *args, **kwargs):
+    """同期SDK呼び出しをプロバイダーの同時実行数の範囲内でスレッドプール実行"""
+    semaphore = provider_semaphores[provider]
+    await semaphore.acquire()
+    loop = asyncio.get_running_loop()
+    try:
+        future = loop.run_in_executor(llm_thread_pool, functools.partial(func, *args, **kwargs))
+    except BaseException:
+        semaphore.release()
+        raise
+    release_slot_when_done(future, semaphore)
+    # 実行中のスレッドは止められないため、キャンセル時は待機だけを打ち切る（枠はスレッド終了まで保持）
+    return await asyncio.shield(future)
+
+
+async def run_until_disconnected(http_request: Request, coro):
+    """
+    LLM呼び出しを実行し、クライアントが切断したら呼び出しをキャンセルする
+
+    スレッドプールで実行中の同期SDK呼び出しは途中で止められないため、プロバイダーの枠はスレッドが終わるまで返さない
+    （run_in_llm_thread を参照）。
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL_SEC)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                print(f"Client disconnected, cancelling LLM call for {http_request.url.path}")
+                raise ClientDisconnectedError("Client disconnected")
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+
+async def iterate_in_llm_thread(provider: str, make_iterator):
+    """同期SDKのストリーミングイテレーターをスレッドプールで回し、要素を非同期に受け取る"""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def put(kind, value=None):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (kind, value))
+        except RuntimeError:
+            pass  # イベントループ終了後
+
+    def produce():
+        try:
+            for item in make_iterator():
+                if stop.is_set():
+                    break
+                put("item", item)
+        except Exception as e:
+            put("error", e)
+        finally:
+            put("end")
+
+    semaphore = provider_semaphores[provider]
+    await semaphore.acquire()
+    try:
+        future = loop.run_in_executor(llm_thread_pool, produce)
+    except BaseException:
+        semaphore.release()
+        raise
+    # スレッドは次の要素を受け取るまで停止フラグを確認できないため、枠はスレッドが終わるまで保持する
+    release_slot_when_done(future, semaphore)
+    try:
+        while True:
+            kind, value = await queue.get()
+            if kind == "end":
+                break
+            if kind == "error":
+                raise value
+            yield value
+    finally:
+        # クライアント切断などで途中終了した場合はスレッド側の読み出しも打ち切る
+        stop.set()
+
+
+class SampledDebugLog:
+    """チャンク単位のデバッグ出力をN回に1回に間引くロガー（ストリームごとに生成）"""
+
+    def __init__(self, every: int = STREAM_DEBUG_SAMPLE_EVERY):
+        self.every = every
+        self.count = 0
+
+    def __call__(self, message: str):
+        if self.every <= 0:
+            return
+        self.count += 1
+        if (self.count - 1) % self.every == 0:
+            print(f"{message} (sampled 1/{self.every}, #{self.count})")
+
+
+def encode_sse_event(event) -> bytes:
+    """イベント（dict または SSE_DONE）をSSEのバイト列に変換"""
+    if event == SSE_DONE:
+        return b"data: [DONE]\n\n"
+    return b"data: " + json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n\n"
+
+
+def accepts_gzip(http_request: Request) -> bool:
+    """SSEをgzip圧縮して返してよいか（設定で許可され、クライアントが対応している場合）"""
+    return SSE_GZIP_ENABLED and "gzip" in http_request.headers.get("accept-encoding", "").lower()
+
+
+async def sse_frames(events, use_gzip: bool = False, max_bytes: int = SSE_FRAME_MAX_BYTES, max_wait_sec: float = SSE_FRAME_MAX_WAIT_SEC):
+    """
+    イベント列をSSEフレーム（バイト列）に変換する
+
+    連続するテキスト差分は1つのtextイベントに結合し、max_bytes または max_wait_sec に達した時点で送出する。
+    最初のテキストは即座に送出し、text以外のイベント（error, done など）も順序を保ったまま即座に送出する。
+    """
+    loop = asyncio.get_running_loop()
+    iterator = events.__aiter__()
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if use_gzip else None
+    texts = []
+    text_bytes = 0
+    deadline = None
+    pending = None
+    first_text = True
+
+    def frame(data: bytes) -> bytes:
+        if compressor is None:
+            return data
+        # フレームごとにSYNC_FLUSHし、圧縮してもクライアントへ即座に届くようにする
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def take_text() -> bytes:
+        nonlocal texts, text_bytes, deadline
+        if not texts:
+            return b""
+        data = encode_sse_event({"type": "text", "content": "".join(texts)})
+        texts = []
+        text_bytes = 0
+        deadline = None
+        return data
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+
+            if not done:
+                # 時間窓が経過したのでまとめたテキストを送出
+                yield frame(take_text())
+                continue
+
+            try:
+                event = pending.result()
+            except StopAsyncIteration:
+                pending = None
+                break
+            pending = None
+
+            if isinstance(event, dict) and event.get("type") == "text" and isinstance(event.get("content"), str):
+                texts.append(event["content"])
+                text_bytes += len(event["content"].encode("utf-8"))
+                if deadline is None:
+                    deadline = loop.time() + max_wait_sec
+                if first_text or text_bytes >= max_bytes:
+                    first_text = False
+                    yield frame(take_text())
+                continue
+
+            # 制御イベントは保留中のテキストと同じフレームで順序通りに送る
+            yield frame(take_text() + encode_sse_event(event))
+
+        tail = take_text()
+        if compressor is not None:
+            yield compressor.compress(tail) + compressor.flush(zlib.Z_FINISH)
+        elif tail:
+            yield tail
+    finally:
+        if pending is not None:
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+
+
+def sse_response(events, http_request: Request) -> StreamingResponse:
+    """イベント列をSSEフレーミング付きのStreamingResponseとして返す"""
+    use_gzip = accepts_gzip(http_request)
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+    return StreamingResponse(content=sse_frames(events, use_gzip=use_gzip), media_type="text/event-stream", headers=headers)
+
+
 # リクエスト・レスポンスモデル
 class ChatRequest(BaseModel):
     message: str
@@ -75,12 +452,19 @@ class AgentRequest(BaseModel):
     model: str = "claude-3-sonnet"
     apiKey: str = ""
     stream: bool = False  # ストリーミングモード
+    sessionId: Optional[str] = None  # POST /api/agent/sessions で発行したID（指定時はサーバー側のコンテキストを使う）
+    contextDiff: Optional[Dict[str, Any]] = None  # セッションに適用する差分（AgentSession.apply_diff を参照）
 
 class StreamingAgentRequest(BaseModel):
     prompt: str
     context: Optional[Any] = {}
     model: str = "claude-3-sonnet"
     apiKey: str = ""
+    sessionId: Optional[str] = None
+    contextDiff: Optional[Dict[str, Any]] = None
+
+class AgentSessionCreateRequest(BaseModel):
+    context: Dict[str, Any]  # フルコンテキスト（以降のリクエストでは contextDiff だけ送る）
 
 class GenerateRequest(BaseModel):
     prompt: str
@@ -106,25 +490,8 @@ class GenerateResponse(BaseModel):
     suggestions: str = ""
 
 # AIモデル管理クラス（ストリーミング対応版）
-class StreamingAIModelManager:
-    def __init__(self):
-        self.default_api_keys = DEFAULT_API_KEYS
-    
-    def get_api_key(self, provider: str, custom_keys: Optional[Dict[str, str]] = None) -> Optional[str]:
-        """APIキーを取得（カスタムキー優先、デフォルトキーをフォールバック）"""
-        if custom_keys and provider in custom_keys and custom_keys[provider]:
-            return custom_keys[provider]
-        return self.default_api_keys.get(provider)
-    
-    async def stream_claude(self, message: str, context: Any = "", api_key: str = None):
-        """Claude APIをストリーミングで呼び出し"""
-        print(f"StreamingAIModelManager: Starting Claude streaming for message: {message[:50]}...")
-        
-        if not api_key:
-            raise ValueError("Claude API key is required")
-        
-        # 音楽制作に特化したプロンプト
-        system_prompt = """あなたは音楽制作のエキスパートアシスタントです。
+# 音楽制作に特化したシステムプロンプト（全プロバイダー共通の固定プレフィックス）
+MUSIC_ASSISTANT_SYSTEM_PROMPT = """あなたは音楽制作のエキスパートアシスタントです。
 ユーザーの音楽制作に関する質問や要求に対して、専門的で実用的なアドバイスを提供してください。
 以下の分野について詳しく回答できます：
 - 作曲・編曲のテクニック
@@ -136,47 +503,592 @@ class StreamingAIModelManager:
 - MIDI編集
 
 回答は日本語で、分かりやすく具体的に説明してください。"""
-        
-        # コンテキスト情報を処理
-        context_info = ""
+
+PROMPT_CONTEXT_CACHE_SIZE = 256  # キャッシュするコンテキストブロック数
+PLAYBACK_STATE_KEYS = ("currentTime", "totalDuration", "isPlaying")  # 頻繁に変わるプロジェクト情報
+
+
+class PromptContextBuilder:
+    """プロジェクト・トラック情報のコンテキストブロックを、辞書内容のハッシュをキーにメモ化して構築する"""
+
+    def __init__(self, max_entries: int = PROMPT_CONTEXT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._blocks = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _hash(kind: str, value: Any) -> str:
+        payload = json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+        return kind + ":" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _cached(self, kind: str, value: Any, render) -> str:
+        key = self._hash(kind, value)
+        block = self._blocks.get(key)
+        if block is not None:
+            self._blocks.move_to_end(key)
+            self.hits += 1
+            return block
+        self.misses += 1
+        block = render(value)
+        self._blocks[key] = block
+        if len(self._blocks) > self.max_entries:
+            self._blocks.popitem(last=False)
+        return block
+
+    @staticmethod
+    def _render_project(project: Dict[str, Any]) -> str:
+        block = f"\n\n【現在のプロジェクト情報】\n"
+        block += f"プロジェクト名: {project.get('name', 'Unknown')}\n"
+        block += f"テンポ: {project.get('tempo', 'Unknown')} BPM\n"
+        block += f"キー: {project.get('key', 'Unknown')}\n"
+        block += f"拍子: {project.get('timeSignature', 'Unknown')}\n"
+        block += f"トラック数: {project.get('tracksCount', 0)}\n"
+        return block
+
+    @staticmethod
+    def _render_current_track(track: Dict[str, Any]) -> str:
+        block = f"\n【現在選択中のトラック】\n"
+        block += f"トラック名: {track.get('name', 'Unknown')}\n"
+        block += f"タイプ: {track.get('type', 'Unknown')}\n"
+        block += f"ノート数: {track.get('notesCount', 0)}\n"
+        block += f"音量: {track.get('volume', 100)}%\n"
+        block += f"パン: {track.get('pan', 0)}\n"
+        block += f"ミュート: {'はい' if track.get('muted') else 'いいえ'}\n"
+        block += f"ソロ: {'はい' if track.get('solo') else 'いいえ'}\n"
+        return block
+
+    @staticmethod
+    def _render_tracks(tracks: List[Dict[str, Any]]) -> str:
+        block = f"\n【全トラック情報】\n"
+        for i, track in enumerate(tracks[:5]):  # 最初の5トラックのみ
+            block += f"{i+1}. {track.get('name', 'Unknown')} ({track.get('type', 'Unknown')}) - ノート数: {track.get('notesCount', 0)}\n"
+        if len(tracks) > 5:
+            block += f"... 他 {len(tracks) - 5} トラック\n"
+        return block
+
+    def build(self, context: Any) -> Tuple[str, str]:
+        """
+        コンテキストを (固定部分, 会話ごとに変わる部分) の文字列に変換
+
+        固定部分（プロジェクト・トラック情報）はシステムプロンプトの後ろに置き、プロバイダー側のプレフィックスキャッシュを効かせる。
+        会話履歴や文字列のコンテキストは毎回変わるためユーザーメッセージ側に置く。
+        """
+        if isinstance(context, AgentSessionContext):
+            # セッション側で変更時に一度だけ描画済み
+            return context.prompt_blocks
+
+        stable = ""
+        volatile = ""
         if isinstance(context, dict):
-            # 詳細なコンテキスト情報がある場合
             if context.get("projectInfo"):
                 project = context["projectInfo"]
-                context_info += f"\n\n【現在のプロジェクト情報】\n"
-                context_info += f"プロジェクト名: {project.get('name', 'Unknown')}\n"
-                context_info += f"テンポ: {project.get('tempo', 'Unknown')} BPM\n"
-                context_info += f"キー: {project.get('key', 'Unknown')}\n"
-                context_info += f"拍子: {project.get('timeSignature', 'Unknown')}\n"
-                context_info += f"再生時間: {project.get('currentTime', 0):.1f}s / {project.get('totalDuration', 0):.1f}s\n"
-                context_info += f"再生状態: {'再生中' if project.get('isPlaying') else '停止中'}\n"
-                context_info += f"トラック数: {project.get('tracksCount', 0)}\n"
-            
+                # 再生位置・再生状態はリクエストごとに変わるため、キャッシュ対象から外して会話側に置く
+                stable_project = {k: v for k, v in project.items() if k not in PLAYBACK_STATE_KEYS}
+                stable += self._cached("project", stable_project, self._render_project)
+                volatile += f"【再生状態】\n再生時間: {project.get('currentTime', 0):.1f}s / {project.get('totalDuration', 0):.1f}s\n"
+                volatile += f"再生状態: {'再生中' if project.get('isPlaying') else '停止中'}\n"
             if context.get("currentTrack"):
-                track = context["currentTrack"]
-                context_info += f"\n【現在選択中のトラック】\n"
-                context_info += f"トラック名: {track.get('name', 'Unknown')}\n"
-                context_info += f"タイプ: {track.get('type', 'Unknown')}\n"
-                context_info += f"ノート数: {track.get('notesCount', 0)}\n"
-                context_info += f"音量: {track.get('volume', 100)}%\n"
-                context_info += f"パン: {track.get('pan', 0)}\n"
-                context_info += f"ミュート: {'はい' if track.get('muted') else 'いいえ'}\n"
-                context_info += f"ソロ: {'はい' if track.get('solo') else 'いいえ'}\n"
-            
+                stable += self._cached("track", context["currentTrack"], self._render_current_track)
             if context.get("tracks"):
-                tracks = context["tracks"]
-                context_info += f"\n【全トラック情報】\n"
-                for i, track in enumerate(tracks[:5]):  # 最初の5トラックのみ
-                    context_info += f"{i+1}. {track.get('name', 'Unknown')} ({track.get('type', 'Unknown')}) - ノート数: {track.get('notesCount', 0)}\n"
-                if len(tracks) > 5:
-                    context_info += f"... 他 {len(tracks) - 5} トラック\n"
-            
+                stable += self._cached("tracks", context["tracks"], self._render_tracks)
             if context.get("chatHistory"):
-                context_info += f"\n【会話履歴】\n{context['chatHistory']}"
+                volatile += f"\n【会話履歴】\n{context['chatHistory']}"
         elif isinstance(context, str) and context:
-            context_info = f"\n\n前の会話の文脈: {context}"
+            volatile = f"前の会話の文脈: {context}"
+        return stable, volatile
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._blocks),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+prompt_context_builder = PromptContextBuilder()
+
+
+# レスポンスキャッシュ設定
+GENERATE_CACHE_TTL_SEC = 600         # /api/generate の結果を再利用する秒数
+GENERATE_CACHE_MAX_ENTRIES = 256
+
+
+class TTLLRUCache:
+    """TTL付きLRUキャッシュ（期限切れまたは上限超過の古いエントリから削除）"""
+
+    def __init__(self, max_entries: int, ttl_sec: float):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self._entries = OrderedDict()  # key -> (有効期限, 値)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+            self.expirations += 1
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl_sec, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_sec": self.ttl_sec,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+def make_cache_key(kind: str, fields: Dict[str, Any]) -> str:
+    """キャッシュキー（正規化したフィールドのSHA-256）"""
+    payload = json.dumps(fields, ensure_ascii=False, sort_keys=True, default=str)
+    return kind + ":" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def normalize_prompt(prompt: str) -> str:
+    """表記揺れ（全角半角・大文字小文字・空白）を吸収したプロンプト"""
+    return " ".join(unicodedata.normalize("NFKC", prompt).lower().split())
+
+
+generate_response_cache = TTLLRUCache(GENERATE_CACHE_MAX_ENTRIES, GENERATE_CACHE_TTL_SEC)
+
+
+def cache_stats() -> Dict[str, Any]:
+    """ヘルスチェック用のキャッシュ統計（generate のヒット数 = 節約できたプロバイダー呼び出し数）"""
+    return {
+        "prompt_context": prompt_context_builder.stats(),
+        "generate": {**generate_response_cache.stats(), "provider_calls_saved": generate_response_cache.hits},
+        "ghost_text_index": ghost_text_index.stats()
+    }
+
+
+def build_chat_prompt(message: str, context: Any = "") -> Tuple[str, str]:
+    """チャット用の (システムプロンプト, ユーザープロンプト) を構築"""
+    stable_context, volatile_context = prompt_context_builder.build(context)
+    system_prompt = MUSIC_ASSISTANT_SYSTEM_PROMPT + stable_context
+    user_prompt = f"ユーザーの質問: {message}"
+    if volatile_context:
+        user_prompt = volatile_context.strip() + "\n\n" + user_prompt
+    return system_prompt, user_prompt
+
+
+# Agentセッション設定（コンテキストをサーバー側に保持し、クライアントは差分だけ送る）
+AGENT_SESSION_MAX_SESSIONS = 256
+AGENT_SESSION_MAX_TOTAL_BYTES = 64 * 1024 * 1024   # 全セッションの推定サイズ上限（超過分は最も古いセッションから削除）
+AGENT_SESSION_MAX_BYTES = 8 * 1024 * 1024          # 1セッションの推定サイズ上限
+AGENT_SESSION_IDLE_TTL_SEC = 1800                  # 無操作のセッションを破棄するまでの秒数
+AGENT_SESSION_ID_MAX_LENGTH = 128
+AGENT_SESSION_ID_BYTES = 32                        # サーバーが発行するセッションIDの乱数バイト数
+
+
+class AgentSessionError(Exception):
+    """セッションが存在しない・上限超過など、差分を適用できない場合のエラー"""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class AgentSessionContext(dict):
+    """セッションから組み立てたコンテキスト（描画済みのプロンプト断片を保持する）"""
+    __slots__ = ("prompt_blocks", "agent_context_info")
+
+
+def estimate_size(value: Any) -> int:
+    """JSONにしたときのおおよそのバイト数"""
+    return len(json.dumps(value, ensure_ascii=False, default=str))
+
+
+class AgentSession:
+    """
+    1つのAgentセッションのコンテキスト
+
+    トラックはIDごと、ノートはトラック内でIDごとに保持し、差分を部分的に適用します。
+    組み立てたコンテキストとプロンプト断片は次に変更されるまで再利用します。
+    差分は clone() した複製に適用し、成功した場合だけストアの中身を差し替えます。
+    """
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.fields: Dict[str, Any] = {}                  # existingTracks 以外のトップレベル項目
+        self.tracks: Dict[str, Dict[str, Any]] = {}       # トラックID -> トラック（挿入順を保持）
+        self.note_positions: Dict[str, Dict[str, int]] = {}  # トラックID -> ノートID -> notes内の位置
+        self.field_sizes: Dict[str, int] = {}
+        self.track_sizes: Dict[str, int] = {}
+        self.version = 0
+        self.last_access = time.monotonic()
+        self._context: Optional[AgentSessionContext] = None
+        self._owned_tracks = set()  # 複製元と共有していない（書き換えてよい）トラックID
+
+    def clone(self) -> "AgentSession":
+        """差分適用用の複製（トラックは共有し、ノートを書き換える時にトラック単位で複製する）"""
+        session = AgentSession(self.session_id)
+        session.fields = dict(self.fields)
+        session.tracks = dict(self.tracks)
+        session.note_positions = dict(self.note_positions)
+        session.field_sizes = dict(self.field_sizes)
+        session.track_sizes = dict(self.track_sizes)
+        session.version = self.version
+        session.last_access = self.last_access
+        session._context = self._context
+        return session
+
+    @property
+    def size_bytes(self) -> int:
+        return sum(self.field_sizes.values()) + sum(self.track_sizes.values())
+
+    def replace(self, context: Dict[str, Any]) -> None:
+        """フルコンテキストで置き換え（初回同期・再同期）"""
+        self.fields = {}
+        self.tracks = {}
+        self.note_positions = {}
+        self.field_sizes = {}
+        self.track_sizes = {}
+        for key, value in context.items():
+            if key == "existingTracks":
+                for track in value or []:
+                    self._put_track(dict(track))
+            else:
+                self._set_field(key, value)
+
+    def apply_diff(self, diff: Dict[str, Any]) -> None:
+        """
+        差分を適用
+
+        diff の形式:
+            fields: {キー: 値} トップレベル項目の置き換え（currentTrack, projectInfo, chatHistory 等）
+            upsertTracks: [トラック] IDが一致するトラックに項目をマージ（midiData を含む場合はノートも置き換え）
+            removeTrackIds: [トラックID]
+            upsertNotes: {トラックID: [ノート]} ノートIDで追加または置き換え
+            removeNoteIds: {トラックID: [ノートID]}
+        """
+        for key, value in (diff.get("fields") or {}).items():
+            if key == "existingTracks":
+                raise AgentSessionError("existingTracks must be sent as upsertTracks/removeTrackIds", 400)
+            self._set_field(key, value)
+
+        for track in diff.get("upsertTracks") or []:
+            track_id = str(track.get("id", ""))
+            if not track_id:
+                raise AgentSessionError("upsertTracks entries require an id", 400)
+            existing = self.tracks.get(track_id)
+            self._put_track({**existing, **track} if existing is not None else dict(track))
+
+        for track_id in diff.get("removeTrackIds") or []:
+            track_id = str(track_id)
+            self.tracks.pop(track_id, None)
+            self.note_positions.pop(track_id, None)
+            self.track_sizes.pop(track_id, None)
+
+        # ノート差分はトラック全体を再計測せず、変わったノートの分だけサイズを増減する
+        for track_id, notes in (diff.get("upsertNotes") or {}).items():
+            track_id = str(track_id)
+            track_notes, positions = self._track_notes(track_id)
+            for note in notes:
+                note_id = str(note.get("id", ""))
+                position = positions.get(note_id) if note_id else None
+                if position is None:
+                    if note_id:
+                        positions[note_id] = len(track_notes)
+                    track_notes.append(note)
+                    self.track_sizes[track_id] += estimate_size(note) + 2
+                else:
+                    merged = {**track_notes[position], **note}
+                    self.track_sizes[track_id] += estimate_size(merged) - estimate_size(track_notes[position])
+                    track_notes[position] = merged
+
+        for track_id, note_ids in (diff.get("removeNoteIds") or {}).items():
+            track_id = str(track_id)
+            track_notes, positions = self._track_notes(track_id)
+            removed = {str(note_id) for note_id in note_ids}
+            kept = []
+            for note in track_notes:
+                if str(note.get("id", "")) in removed:
+                    self.track_sizes[track_id] -= estimate_size(note) + 2
+                else:
+                    kept.append(note)
+            track_notes[:] = kept
+            positions.clear()
+            positions.update(self._index_notes(track_notes))
+
+    def _set_field(self, key: str, value: Any) -> None:
+        self.fields[key] = value
+        self.field_sizes[key] = estimate_size(value)
+
+    @staticmethod
+    def _index_notes(notes: List[Dict[str, Any]]) -> Dict[str, int]:
+        return {str(note["id"]): i for i, note in enumerate(notes) if isinstance(note, dict) and note.get("id")}
+
+    def _put_track(self, track: Dict[str, Any]) -> None:
+        track_id = str(track.get("id", ""))
+        midi_data = track.get("midiData")
+        if isinstance(midi_data, dict):
+            # ノートは差分で書き換えるため、クライアントから受け取ったリストを複製して持つ
+            midi_data = {**midi_data, "notes": list(midi_data.get("notes") or [])}
+            track["midiData"] = midi_data
+            self.note_positions[track_id] = self._index_notes(midi_data["notes"])
+        self.tracks[track_id] = track
+        self.track_sizes[track_id] = estimate_size(track)
+        self._owned_tracks.add(track_id)
+
+    def _track_notes(self, track_id: str) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+        track = self.tracks.get(track_id)
+        if track is None:
+            raise AgentSessionError(f"Unknown track in note diff: {track_id}", 400)
+        if track_id not in self._owned_tracks:
+            # 複製元のセッションと共有しているトラックは、書き換える前にノートのリストごと複製する
+            track = dict(track)
+            if isinstance(track.get("midiData"), dict):
+                track["midiData"] = {**track["midiData"], "notes": list(track["midiData"].get("notes") or [])}
+            self.tracks[track_id] = track
+            self.note_positions[track_id] = dict(self.note_positions.get(track_id, {}))
+            self._owned_tracks.add(track_id)
+        midi_data = track.get("midiData")
+        if not isinstance(midi_data, dict):
+            midi_data = {"notes": []}
+            track["midiData"] = midi_data
+        elif "notes" not in midi_data:
+            midi_data["notes"] = []
+        return midi_data["notes"], self.note_positions.setdefault(track_id, {})
+
+    def context(self) -> AgentSessionContext:
+        """マージ済みコンテキスト（変更がなければ前回組み立てたものを返す）"""
+        if self._context is None:
+            plain = dict(self.fields)
+            if self.tracks:
+                plain["existingTracks"] = list(self.tracks.values())
+            stable, volatile = prompt_context_builder.build(plain)
+            context = AgentSessionContext(plain)
+            context.prompt_blocks = (stable, volatile)
+            context.agent_context_info = render_agent_context_info(plain)
+            self._context = context
+        return self._context
+
+    def touch(self, changed: bool) -> None:
+        self.last_access = time.monotonic()
+        if changed:
+            self.version += 1
+            self._context = None
+
+
+class AgentSessionStore:
+    """
+    Agentセッションの保持（件数・推定サイズの上限と無操作時間による破棄）
+
+    Attributes:
+        max_sessions (int): 保持するセッション数の上限
+        max_total_bytes (int): 全セッションの推定サイズの上限
+        max_session_bytes (int): 1セッションの推定サイズの上限
+        idle_ttl_sec (float): 無操作のセッションを破棄するまでの秒数
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = AGENT_SESSION_MAX_SESSIONS,
+        max_total_bytes: int = AGENT_SESSION_MAX_TOTAL_BYTES,
+        max_session_bytes: int = AGENT_SESSION_MAX_BYTES,
+        idle_ttl_sec: float = AGENT_SESSION_IDLE_TTL_SEC
+    ):
+        self.max_sessions = max_sessions
+        self.max_total_bytes = max_total_bytes
+        self.max_session_bytes = max_session_bytes
+        self.idle_ttl_sec = idle_ttl_sec
+        self._sessions: "OrderedDict[str, AgentSession]" = OrderedDict()  # 最終アクセス順
+        self.created = 0
+        self.evicted_idle = 0
+        self.evicted_capacity = 0
+        self.diffs_applied = 0
+        self.full_syncs = 0
+
+    def _evict_idle(self) -> None:
+        deadline = time.monotonic() - self.idle_ttl_sec
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.last_access > deadline:
+                break
+            self._sessions.popitem(last=False)
+            self.evicted_idle += 1
+
+    def _evict_capacity(self, keep: str) -> None:
+        total = sum(session.size_bytes for session in self._sessions.values())
+        while self._sessions and (len(self._sessions) > self.max_sessions or total > self.max_total_bytes):
+            session_id, session = next(iter(self._sessions.items()))
+            if session_id == keep:
+                break
+            self._sessions.popitem(last=False)
+            total -= session.size_bytes
+            self.evicted_capacity += 1
+            print(f"AgentSessionStore: Evicted session {session_id} ({session.size_bytes} bytes)")
+
+    def create(self, context: Any) -> Tuple[str, AgentSessionContext]:
+        """
+        フルコンテキストから新しいセッションを作成（セッションIDはサーバーが発行する）
+
+        Args:
+            context: フルコンテキスト
+
+        Returns:
+            Tuple[str, AgentSessionContext]: (セッションID, マージ済みコンテキスト)
+
+        Raises:
+            AgentSessionError: コンテキストが不正・サイズ上限超過の場合
+        """
+        if not isinstance(context, dict):
+            raise AgentSessionError("context must be an object", 400)
+        self._evict_idle()
+
+        session_id = secrets.token_urlsafe(AGENT_SESSION_ID_BYTES)
+        session = self._build(AgentSession(session_id), context, None)
+        self._sessions[session_id] = session
+        self.created += 1
+        self.full_syncs += 1
+        self._evict_capacity(keep=session_id)
+        return session_id, session.context()
+
+    def apply(self, session_id: str, context: Any, diff: Optional[Dict[str, Any]]) -> AgentSessionContext:
+        """
+        セッションにフルコンテキストまたは差分を反映し、マージ済みコンテキストを返す
+
+        反映は複製したセッションに行い、すべて成功した場合だけ差し替える（途中で失敗しても元のセッションは変わらない）。
+
+        Args:
+            session_id: create で発行したセッションID
+            context: フルコンテキスト（空でなければセッションを置き換える）
+            diff: 差分（フルコンテキストの後に適用）
+
+        Returns:
+            AgentSessionContext: マージ済みコンテキスト
+
+        Raises:
+            AgentSessionError: セッションが存在しない（破棄済み）・差分が不正・サイズ上限超過の場合
+        """
+        if len(session_id) > AGENT_SESSION_ID_MAX_LENGTH:
+            raise AgentSessionError("sessionId is too long", 400)
+        self._evict_idle()
+
+        session = self._sessions.get(session_id)
+        if session is None:
+            # 破棄済み・未発行のセッションは使えないため、セッションの作成からやり直してもらう
+            raise AgentSessionError(
+                f"Agent session {session_id} not found; create a new session with the full context", 404
+            )
+
+        full_sync = isinstance(context, dict) and bool(context)
+        if full_sync or diff:
+            updated = AgentSession(session_id) if full_sync else session.clone()
+            updated.version = session.version
+            session = self._build(updated, context if full_sync else None, diff)
+            self._sessions[session_id] = session
+            if full_sync:
+                self.full_syncs += 1
+            if diff:
+                self.diffs_applied += 1
+        else:
+            session.touch(changed=False)
+        self._sessions.move_to_end(session_id)
+        self._evict_capacity(keep=session_id)
+        return session.context()
+
+    def _build(self, session: AgentSession, context: Optional[Dict[str, Any]], diff: Optional[Dict[str, Any]]) -> AgentSession:
+        """ストアに入れる前のセッションにフルコンテキスト・差分を反映し、サイズ上限を確認"""
+        try:
+            if context is not None:
+                session.replace(context)
+            if diff:
+                session.apply_diff(diff)
+        except AgentSessionError:
+            raise
+        except (TypeError, ValueError, AttributeError, KeyError) as e:
+            raise AgentSessionError(f"Invalid agent context: {e}", 400)
+
+        if session.size_bytes > self.max_session_bytes:
+            raise AgentSessionError(
+                f"Agent session context exceeds {self.max_session_bytes} bytes", 413
+            )
+        session.touch(changed=True)
+        return session
+
+    def drop(self, session_id: str) -> bool:
+        """セッションを削除"""
+        return self._sessions.pop(session_id, None) is not None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "total_bytes": sum(session.size_bytes for session in self._sessions.values()),
+            "max_total_bytes": self.max_total_bytes,
+            "idle_ttl_sec": self.idle_ttl_sec,
+            "created": self.created,
+            "full_syncs": self.full_syncs,
+            "diffs_applied": self.diffs_applied,
+            "evicted_idle": self.evicted_idle,
+            "evicted_capacity": self.evicted_capacity
+        }
+
+
+agent_sessions = AgentSessionStore()
+
+
+def resolve_agent_context(session_id: Optional[str], context: Any, diff: Optional[Dict[str, Any]]) -> Any:
+    """
+    Agentリクエストのコンテキストを解決（セッションIDがなければ送られたコンテキストをそのまま使う）
+
+    Raises:
+        HTTPException: セッションに反映できない場合（404ならクライアントはフルコンテキストでセッションを作り直す）
+    """
+    if not session_id:
+        return context
+    try:
+        return agent_sessions.apply(session_id, context, diff)
+    except AgentSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+class StreamingAIModelManager:
+    def __init__(self):
+        self.default_api_keys = DEFAULT_API_KEYS
+    
+    def get_api_key(self, provider: str, custom_keys: Optional[Dict[str, str]] = None) -> Optional[str]:
+        """APIキーを取得（カスタムキー優先、デフォルトキーをフォールバック）"""
+        if custom_keys and provider in custom_keys and custom_keys[provider]:
+            return custom_keys[provider]
+        return self.default_api_keys.get(provider)
+    
+    async def stream_claude(self, message: str, context: Any = "", api_key: str = None):
+        """Claude APIをストリーミングで呼び出し"""
+        print(f"StreamingAIModelManager: Starting Claude streaming for message: {message[:50]}...")
+        debug_log = SampledDebugLog()
         
-        full_prompt = system_prompt + context_info + f"\n\nユーザーの質問: {message}"
+        if not api_key:
+            raise ValueError("Claude API key is required")
+        
+        # システムプロンプト（固定部分）とユーザープロンプト（会話ごとに変わる部分）を分けて構築
+        system_prompt, user_prompt = build_chat_prompt(message, context)
         
         headers = {
             "Content-Type": "application/json",
@@ -187,115 +1099,65 @@ class StreamingAIModelManager:
         data = {
             "model": "claude-3-sonnet-20240229",
             "max_tokens": 1000,
+            "system": system_prompt,
             "messages": [
-                {"role": "user", "content": full_prompt}
+                {"role": "user", "content": user_prompt}
             ],
             "stream": True
         }
         
         print(f"StreamingAIModelManager: Making request to Claude API with data: {data}")
         
-        async with aiohttp.ClientSession() as session:
+        async with provider_semaphores["anthropic"]:
+            session = http_sessions.get("anthropic")
             async with session.post(
                 "https://api.anthropic.com/v1/messages",
                 headers=headers,
                 json=data
             ) as response:
                 print(f"StreamingAIModelManager: Claude API response status: {response.status}")
-                
+            
                 if response.status == 200:
                     print("StreamingAIModelManager: Starting to process streaming response...")
                     async for line in response.content:
                         if line:
                             line_str = line.decode('utf-8').strip()
-                            print(f"StreamingAIModelManager: Raw line: {line_str[:100]}...")
-                            
+                            debug_log(f"StreamingAIModelManager: Raw line: {line_str[:100]}...")
+                        
                             if line_str.startswith('data: '):
                                 data_str = line_str[6:]  # 'data: ' を除去
-                                print(f"StreamingAIModelManager: Data string: {data_str[:100]}...")
-                                
+                                debug_log(f"StreamingAIModelManager: Data string: {data_str[:100]}...")
+                            
                                 if data_str == '[DONE]':
                                     print("StreamingAIModelManager: Received [DONE] signal")
-                                    yield f"data: [DONE]\n\n"
+                                    yield SSE_DONE
                                     break
                                 try:
                                     json_data = json.loads(data_str)
-                                    print(f"StreamingAIModelManager: Parsed JSON: {json_data}")
-                                    
+                                    debug_log(f"StreamingAIModelManager: Parsed JSON: {json_data}")
+                                
                                     if 'content' in json_data and json_data['content']:
                                         for content in json_data['content']:
                                             if content.get('type') == 'text':
                                                 text = content.get('text', '')
                                                 if text:
-                                                    print(f"StreamingAIModelManager: Yielding text chunk: {text[:50]}...")
-                                                    yield f"data: {json.dumps({'type': 'text', 'content': text})}\n\n"
+                                                    debug_log(f"StreamingAIModelManager: Yielding text chunk: {text[:50]}...")
+                                                    yield {'type': 'text', 'content': text}
                                 except json.JSONDecodeError as e:
                                     print(f"StreamingAIModelManager: JSON decode error: {e}")
                                     continue
                 else:
                     error_text = await response.text()
                     print(f"StreamingAIModelManager: Claude API error: {response.status} - {error_text}")
-                    yield f"data: {json.dumps({'type': 'error', 'content': f'Claude API error: {response.status} - {error_text}'})}\n\n"
+                    yield {'type': 'error', 'content': f'Claude API error: {response.status} - {error_text}'}
     
     async def stream_openai(self, message: str, context: Any = "", api_key: str = None):
         """OpenAI APIをストリーミングで呼び出し"""
         if not api_key:
             raise ValueError("OpenAI API key is required")
         
-        # 音楽制作に特化したプロンプト
-        system_prompt = """あなたは音楽制作のエキスパートアシスタントです。
-ユーザーの音楽制作に関する質問や要求に対して、専門的で実用的なアドバイスを提供してください。
-以下の分野について詳しく回答できます：
-- 作曲・編曲のテクニック
-- 楽器の演奏方法
-- 音楽理論
-- DAWの使い方
-- ミキシング・マスタリング
-- 音楽ジャンルの特徴
-- MIDI編集
-
-回答は日本語で、分かりやすく具体的に説明してください。"""
-        
-        # コンテキスト情報を処理
-        context_info = ""
-        if isinstance(context, dict):
-            # 詳細なコンテキスト情報がある場合
-            if context.get("projectInfo"):
-                project = context["projectInfo"]
-                context_info += f"\n\n【現在のプロジェクト情報】\n"
-                context_info += f"プロジェクト名: {project.get('name', 'Unknown')}\n"
-                context_info += f"テンポ: {project.get('tempo', 'Unknown')} BPM\n"
-                context_info += f"キー: {project.get('key', 'Unknown')}\n"
-                context_info += f"拍子: {project.get('timeSignature', 'Unknown')}\n"
-                context_info += f"再生時間: {project.get('currentTime', 0):.1f}s / {project.get('totalDuration', 0):.1f}s\n"
-                context_info += f"再生状態: {'再生中' if project.get('isPlaying') else '停止中'}\n"
-                context_info += f"トラック数: {project.get('tracksCount', 0)}\n"
-            
-            if context.get("currentTrack"):
-                track = context["currentTrack"]
-                context_info += f"\n【現在選択中のトラック】\n"
-                context_info += f"トラック名: {track.get('name', 'Unknown')}\n"
-                context_info += f"タイプ: {track.get('type', 'Unknown')}\n"
-                context_info += f"ノート数: {track.get('notesCount', 0)}\n"
-                context_info += f"音量: {track.get('volume', 100)}%\n"
-                context_info += f"パン: {track.get('pan', 0)}\n"
-                context_info += f"ミュート: {'はい' if track.get('muted') else 'いいえ'}\n"
-                context_info += f"ソロ: {'はい' if track.get('solo') else 'いいえ'}\n"
-            
-            if context.get("tracks"):
-                tracks = context["tracks"]
-                context_info += f"\n【全トラック情報】\n"
-                for i, track in enumerate(tracks[:5]):  # 最初の5トラックのみ
-                    context_info += f"{i+1}. {track.get('name', 'Unknown')} ({track.get('type', 'Unknown')}) - ノート数: {track.get('notesCount', 0)}\n"
-                if len(tracks) > 5:
-                    context_info += f"... 他 {len(tracks) - 5} トラック\n"
-            
-            if context.get("chatHistory"):
-                context_info += f"\n【会話履歴】\n{context['chatHistory']}"
-        elif isinstance(context, str) and context:
-            context_info = f"\n\n前の会話の文脈: {context}"
-        
-        full_prompt = system_prompt + context_info + f"\n\nユーザーの質問: {message}"
+        # システムプロンプト（固定部分）とユーザープロンプト（会話ごとに変わる部分）を分けて構築
+        system_prompt, user_prompt = build_chat_prompt(message, context)
         
         headers = {
             "Content-Type": "application/json",
@@ -306,13 +1168,14 @@ class StreamingAIModelManager:
             "model": "gpt-4",
             "messages": [
                 {"role": "system", "content": system_prompt},
-                {"role": "user", "content": full_prompt}
+                {"role": "user", "content": user_prompt}
             ],
             "stream": True,
             "max_tokens": 1000
         }
         
-        async with aiohttp.ClientSession() as session:
+        async with provider_semaphores["openai"]:
+            session = http_sessions.get("openai")
             async with session.post(
                 "https://api.openai.com/v1/chat/completions",
                 headers=headers,
@@ -325,7 +1188,7 @@ class StreamingAIModelManager:
                             if line_str.startswith('data: '):
                                 data_str = line_str[6:]  # 'data: ' を除去
                                 if data_str == '[DONE]':
-                                    yield f"data: [DONE]\n\n"
+                                    yield SSE_DONE
                                     break
                                 try:
                                     json_data = json.loads(data_str)
@@ -334,12 +1197,12 @@ class StreamingAIModelManager:
                                         if 'delta' in choice and 'content' in choice['delta']:
                                             content = choice['delta']['content']
                                             if content:
-                                                yield f"data: {json.dumps({'type': 'text', 'content': content})}\n\n"
+                                                yield {'type': 'text', 'content': content}
                                 except json.JSONDecodeError:
                                     continue
                 else:
                     error_text = await response.text()
-                    yield f"data: {json.dumps({'type': 'error', 'content': f'OpenAI API error: {response.status} - {error_text}'})}\n\n"
+                    yield {'type': 'error', 'content': f'OpenAI API error: {response.status} - {error_text}'}
     
     async def stream_gemini(self, message: str, context: Any = "", api_key: str = None):
         """Gemini APIをストリーミングで呼び出し"""
@@ -348,86 +1211,37 @@ class StreamingAIModelManager:
         if not api_key:
             raise ValueError("Gemini API key is required")
         
-        # 音楽制作に特化したプロンプト
-        system_prompt = """あなたは音楽制作のエキスパートアシスタントです。
-ユーザーの音楽制作に関する質問や要求に対して、専門的で実用的なアドバイスを提供してください。
-以下の分野について詳しく回答できます：
-- 作曲・編曲のテクニック
-- 楽器の演奏方法
-- 音楽理論
-- DAWの使い方
-- ミキシング・マスタリング
-- 音楽ジャンルの特徴
-- MIDI編集
-
-回答は日本語で、分かりやすく具体的に説明してください。"""
-        
-        # コンテキスト情報を処理
-        context_info = ""
-        if isinstance(context, dict):
-            # 詳細なコンテキスト情報がある場合
-            if context.get("projectInfo"):
-                project = context["projectInfo"]
-                context_info += f"\n\n【現在のプロジェクト情報】\n"
-                context_info += f"プロジェクト名: {project.get('name', 'Unknown')}\n"
-                context_info += f"テンポ: {project.get('tempo', 'Unknown')} BPM\n"
-                context_info += f"キー: {project.get('key', 'Unknown')}\n"
-                context_info += f"拍子: {project.get('timeSignature', 'Unknown')}\n"
-                context_info += f"再生時間: {project.get('currentTime', 0):.1f}s / {project.get('totalDuration', 0):.1f}s\n"
-                context_info += f"再生状態: {'再生中' if project.get('isPlaying') else '停止中'}\n"
-                context_info += f"トラック数: {project.get('tracksCount', 0)}\n"
-            
-            if context.get("currentTrack"):
-                track = context["currentTrack"]
-                context_info += f"\n【現在選択中のトラック】\n"
-                context_info += f"トラック名: {track.get('name', 'Unknown')}\n"
-                context_info += f"タイプ: {track.get('type', 'Unknown')}\n"
-                context_info += f"ノート数: {track.get('notesCount', 0)}\n"
-                context_info += f"音量: {track.get('volume', 100)}%\n"
-                context_info += f"パン: {track.get('pan', 0)}\n"
-                context_info += f"ミュート: {'はい' if track.get('muted') else 'いいえ'}\n"
-                context_info += f"ソロ: {'はい' if track.get('solo') else 'いいえ'}\n"
-            
-            if context.get("tracks"):
-                tracks = context["tracks"]
-                context_info += f"\n【全トラック情報】\n"
-                for i, track in enumerate(tracks[:5]):  # 最初の5トラックのみ
-                    context_info += f"{i+1}. {track.get('name', 'Unknown')} ({track.get('type', 'Unknown')}) - ノート数: {track.get('notesCount', 0)}\n"
-                if len(tracks) > 5:
-                    context_info += f"... 他 {len(tracks) - 5} トラック\n"
-            
-            if context.get("chatHistory"):
-                context_info += f"\n【会話履歴】\n{context['chatHistory']}"
-        elif isinstance(context, str) and context:
-            context_info = f"\n\n前の会話の文脈: {context}"
+        # システムプロンプト（固定部分）とユーザープロンプト（会話ごとに変わる部分）を分けて構築
+        system_prompt, user_prompt = build_chat_prompt(message, context)
         
-        full_prompt = system_prompt + context_info + f"\n\nユーザーの質問: {message}"
+        print(f"StreamingAIModelManager: Making request to Gemini API with prompt: {user_prompt[:100]}...")
         
-        # Gemini APIの設定
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.5-pro')
+        def gemini_text_chunks():
+            return gemini_stream(api_key, 'gemini-2.5-pro', user_prompt, system_instruction=system_prompt)
         
-        print(f"StreamingAIModelManager: Making request to Gemini API with prompt: {full_prompt[:100]}...")
+        start_time = time.perf_counter()
+        time_to_first_token = None
+        total_chars = 0
+        event_count = 0
         
         try:
-            # Gemini APIはストリーミングを直接サポートしていないため、
-            # 通常のレスポンスを取得して、文字単位でストリーミング風に返す
-            response = model.generate_content(full_prompt)
-            response_text = response.text
+            # SDKのストリーミング応答を受け取り次第送る（細かいチャンクは sse_frames で1フレームにまとめる）
+            async for text in iterate_in_llm_thread("google", gemini_text_chunks):
+                if time_to_first_token is None:
+                    time_to_first_token = time.perf_counter() - start_time
+                total_chars += len(text)
+                event_count += 1
+                yield {'type': 'text', 'content': text}
             
-            print(f"StreamingAIModelManager: Gemini response received: {response_text[:100]}...")
+            yield SSE_DONE
             
-            # 文字単位でストリーミング風に返す
-            for i, char in enumerate(response_text):
-                yield f"data: {json.dumps({'type': 'text', 'content': char})}\n\n"
-                # 少し遅延を入れてストリーミング感を演出
-                await asyncio.sleep(0.01)
-            
-            yield f"data: [DONE]\n\n"
+            ttft_ms = time_to_first_token * 1000 if time_to_first_token is not None else 0.0
+            total_ms = (time.perf_counter() - start_time) * 1000
+            print(f"StreamingAIModelManager: Gemini stream completed - TTFT {ttft_ms:.0f} ms, total {total_ms:.0f} ms, {total_chars} chars in {event_count} chunks")
             
         except Exception as e:
             print(f"StreamingAIModelManager: Gemini API error: {e}")
-            yield f"data: {json.dumps({'type': 'error', 'content': f'Gemini API error: {str(e)}'})}\n\n"
+            yield {'type': 'error', 'content': f'Gemini API error: {str(e)}'}
 
 # 既存のAIModelManagerクラス（後方互換性のため保持）
 class AIModelManager:
@@ -445,60 +1259,8 @@ class AIModelManager:
         if not api_key:
             raise ValueError("Claude API key is required")
         
-        # 音楽制作に特化したプロンプト
-        system_prompt = """あなたは音楽制作のエキスパートアシスタントです。
-ユーザーの音楽制作に関する質問や要求に対して、専門的で実用的なアドバイスを提供してください。
-以下の分野について詳しく回答できます：
-- 作曲・編曲のテクニック
-- 楽器の演奏方法
-- 音楽理論
-- DAWの使い方
-- ミキシング・マスタリング
-- 音楽ジャンルの特徴
-- MIDI編集
-
-回答は日本語で、分かりやすく具体的に説明してください。"""
-        
-        # コンテキスト情報を処理
-        context_info = ""
-        if isinstance(context, dict):
-            # 詳細なコンテキスト情報がある場合
-            if context.get("projectInfo"):
-                project = context["projectInfo"]
-                context_info += f"\n\n【現在のプロジェクト情報】\n"
-                context_info += f"プロジェクト名: {project.get('name', 'Unknown')}\n"
-                context_info += f"テンポ: {project.get('tempo', 'Unknown')} BPM\n"
-                context_info += f"キー: {project.get('key', 'Unknown')}\n"
-                context_info += f"拍子: {project.get('timeSignature', 'Unknown')}\n"
-                context_info += f"再生時間: {project.get('currentTime', 0):.1f}s / {project.get('totalDuration', 0):.1f}s\n"
-                context_info += f"再生状態: {'再生中' if project.get('isPlaying') else '停止中'}\n"
-                context_info += f"トラック数: {project.get('tracksCount', 0)}\n"
-            
-            if context.get("currentTrack"):
-                track = context["currentTrack"]
-                context_info += f"\n【現在選択中のトラック】\n"
-                context_info += f"トラック名: {track.get('name', 'Unknown')}\n"
-                context_info += f"タイプ: {track.get('type', 'Unknown')}\n"
-                context_info += f"ノート数: {track.get('notesCount', 0)}\n"
-                context_info += f"音量: {track.get('volume', 100)}%\n"
-                context_info += f"パン: {track.get('pan', 0)}\n"
-                context_info += f"ミュート: {'はい' if track.get('muted') else 'いいえ'}\n"
-                context_info += f"ソロ: {'はい' if track.get('solo') else 'いいえ'}\n"
-            
-            if context.get("tracks"):
-                tracks = context["tracks"]
-                context_info += f"\n【全トラック情報】\n"
-                for i, track in enumerate(tracks[:5]):  # 最初の5トラックのみ
-                    context_info += f"{i+1}. {track.get('name', 'Unknown')} ({track.get('type', 'Unknown')}) - ノート数: {track.get('notesCount', 0)}\n"
-                if len(tracks) > 5:
-                    context_info += f"... 他 {len(tracks) - 5} トラック\n"
-            
-            if context.get("chatHistory"):
-                context_info += f"\n【会話履歴】\n{context['chatHistory']}"
-        elif isinstance(context, str) and context:
-            context_info = f"\n\n前の会話の文脈: {context}"
-        
-        full_prompt = system_prompt + context_info + f"\n\nユーザーの質問: {message}"
+        # システムプロンプト（固定部分）とユーザープロンプト（会話ごとに変わる部分）を分けて構築
+        system_prompt, user_prompt = build_chat_prompt(message, context)
         
         headers = {
             "Content-Type": "application/json",
@@ -509,83 +1271,34 @@ class AIModelManager:
         data = {
             "model": "claude-3-sonnet-20240229",
             "max_tokens": 1000,
+            "system": system_prompt,
             "messages": [
-                {"role": "user", "content": full_prompt}
+                {"role": "user", "content": user_prompt}
             ]
         }
         
-        response = requests.post(
-            "https://api.anthropic.com/v1/messages",
-            headers=headers,
-            json=data,
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result["content"][0]["text"]
-        else:
-            raise Exception(f"Claude API error: {response.status_code} - {response.text}")
+        async with provider_semaphores["anthropic"]:
+            session = http_sessions.get("anthropic")
+            async with session.post(
+                "https://api.anthropic.com/v1/messages",
+                headers=headers,
+                json=data,
+                timeout=aiohttp.ClientTimeout(total=LLM_REQUEST_TIMEOUT_SEC)
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    return result["content"][0]["text"]
+                else:
+                    error_text = await response.text()
+                    raise Exception(f"Claude API error: {response.status} - {error_text}")
     
     async def call_openai(self, message: str, context: Any = "", api_key: str = None) -> str:
         """OpenAI APIを呼び出し"""
         if not api_key:
             raise ValueError("OpenAI API key is required")
         
-        # 音楽制作に特化したプロンプト
-        system_prompt = """あなたは音楽制作のエキスパートアシスタントです。
-ユーザーの音楽制作に関する質問や要求に対して、専門的で実用的なアドバイスを提供してください。
-以下の分野について詳しく回答できます：
-- 作曲・編曲のテクニック
-- 楽器の演奏方法
-- 音楽理論
-- DAWの使い方
-- ミキシング・マスタリング
-- 音楽ジャンルの特徴
-- MIDI編集
-
-回答は日本語で、分かりやすく具体的に説明してください。"""
-        
-        # コンテキスト情報を処理
-        context_info = ""
-        if isinstance(context, dict):
-            # 詳細なコンテキスト情報がある場合
-            if context.get("projectInfo"):
-                project = context["projectInfo"]
-                context_info += f"\n\n【現在のプロジェクト情報】\n"
-                context_info += f"プロジェクト名: {project.get('name', 'Unknown')}\n"
-                context_info += f"テンポ: {project.get('tempo', 'Unknown')} BPM\n"
-                context_info += f"キー: {project.get('key', 'Unknown')}\n"
-                context_info += f"拍子: {project.get('timeSignature', 'Unknown')}\n"
-                context_info += f"再生時間: {project.get('currentTime', 0):.1f}s / {project.get('totalDuration', 0):.1f}s\n"
-                context_info += f"再生状態: {'再生中' if project.get('isPlaying') else '停止中'}\n"
-                context_info += f"トラック数: {project.get('tracksCount', 0)}\n"
-            
-            if context.get("currentTrack"):
-                track = context["currentTrack"]
-                context_info += f"\n【現在選択中のトラック】\n"
-                context_info += f"トラック名: {track.get('name', 'Unknown')}\n"
-                context_info += f"タイプ: {track.get('type', 'Unknown')}\n"
-                context_info += f"ノート数: {track.get('notesCount', 0)}\n"
-                context_info += f"音量: {track.get('volume', 100)}%\n"
-                context_info += f"パン: {track.get('pan', 0)}\n"
-                context_info += f"ミュート: {'はい' if track.get('muted') else 'いいえ'}\n"
-                context_info += f"ソロ: {'はい' if track.get('solo') else 'いいえ'}\n"
-            
-            if context.get("tracks"):
-                tracks = context["tracks"]
-                context_info += f"\n【全トラック情報】\n"
-                for i, track in enumerate(tracks[:5]):  # 最初の5トラックのみ
-                    context_info += f"{i+1}. {track.get('name', 'Unknown')} ({track.get('type', 'Unknown')}) - ノート数: {track.get('notesCount', 0)}\n"
-                if len(tracks) > 5:
-                    context_info += f"... 他 {len(tracks) - 5} トラック\n"
-            
-            if context.get("chatHistory"):
-                context_info += f"\n【会話履歴】\n{context['chatHistory']}"
-        elif isinstance(context, str) and context:
-            context_info = f"\n\n前の会話の文脈: {context}"
-        
-        full_prompt = system_prompt + context_info + f"\n\nユーザーの質問: {message}"
+        # システムプロンプト（固定部分）とユーザープロンプト（会話ごとに変わる部分）を分けて構築
+        system_prompt, user_prompt = build_chat_prompt(message, context)
         
         headers = {
             "Content-Type": "application/json",
@@ -596,90 +1309,37 @@ class AIModelManager:
             "model": "gpt-4",
             "messages": [
                 {"role": "system", "content": system_prompt},
-                {"role": "user", "content": full_prompt}
+                {"role": "user", "content": user_prompt}
             ],
             "max_tokens": 1000
         }
         
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=data,
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result["choices"][0]["message"]["content"]
-        else:
-            raise Exception(f"OpenAI API error: {response.status_code} - {response.text}")
+        async with provider_semaphores["openai"]:
+            session = http_sessions.get("openai")
+            async with session.post(
+                "https://api.openai.com/v1/chat/completions",
+                headers=headers,
+                json=data,
+                timeout=aiohttp.ClientTimeout(total=LLM_REQUEST_TIMEOUT_SEC)
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    return result["choices"][0]["message"]["content"]
+                else:
+                    error_text = await response.text()
+                    raise Exception(f"OpenAI API error: {response.status} - {error_text}")
     
     async def call_gemini(self, message: str, context: Any = "", api_key: str = None) -> str:
         """Gemini APIを呼び出し"""
         if not api_key:
             raise ValueError("Gemini API key is required")
         
-        # 音楽制作に特化したプロンプト
-        music_context = """あなたは音楽制作のエキスパートアシスタントです。
-ユーザーの音楽制作に関する質問や要求に対して、専門的で実用的なアドバイスを提供してください。
-以下の分野について詳しく回答できます：
-- 作曲・編曲のテクニック
-- 楽器の演奏方法
-- 音楽理論
-- DAWの使い方
-- ミキシング・マスタリング
-- 音楽ジャンルの特徴
-- MIDI編集
-
-回答は日本語で、分かりやすく具体的に説明してください。"""
-        
-        # コンテキスト情報を処理
-        context_info = ""
-        if isinstance(context, dict):
-            # 詳細なコンテキスト情報がある場合
-            if context.get("projectInfo"):
-                project = context["projectInfo"]
-                context_info += f"\n\n【現在のプロジェクト情報】\n"
-                context_info += f"プロジェクト名: {project.get('name', 'Unknown')}\n"
-                context_info += f"テンポ: {project.get('tempo', 'Unknown')} BPM\n"
-                context_info += f"キー: {project.get('key', 'Unknown')}\n"
-                context_info += f"拍子: {project.get('timeSignature', 'Unknown')}\n"
-                context_info += f"再生時間: {project.get('currentTime', 0):.1f}s / {project.get('totalDuration', 0):.1f}s\n"
-                context_info += f"再生状態: {'再生中' if project.get('isPlaying') else '停止中'}\n"
-                context_info += f"トラック数: {project.get('tracksCount', 0)}\n"
-            
-            if context.get("currentTrack"):
-                track = context["currentTrack"]
-                context_info += f"\n【現在選択中のトラック】\n"
-                context_info += f"トラック名: {track.get('name', 'Unknown')}\n"
-                context_info += f"タイプ: {track.get('type', 'Unknown')}\n"
-                context_info += f"ノート数: {track.get('notesCount', 0)}\n"
-                context_info += f"音量: {track.get('volume', 100)}%\n"
-                context_info += f"パン: {track.get('pan', 0)}\n"
-                context_info += f"ミュート: {'はい' if track.get('muted') else 'いいえ'}\n"
-                context_info += f"ソロ: {'はい' if track.get('solo') else 'いいえ'}\n"
-            
-            if context.get("tracks"):
-                tracks = context["tracks"]
-                context_info += f"\n【全トラック情報】\n"
-                for i, track in enumerate(tracks[:5]):  # 最初の5トラックのみ
-                    context_info += f"{i+1}. {track.get('name', 'Unknown')} ({track.get('type', 'Unknown')}) - ノート数: {track.get('notesCount', 0)}\n"
-                if len(tracks) > 5:
-                    context_info += f"... 他 {len(tracks) - 5} トラック\n"
-            
-            if context.get("chatHistory"):
-                context_info += f"\n【会話履歴】\n{context['chatHistory']}"
-        elif isinstance(context, str) and context:
-            context_info = f"\n\n前の会話の文脈: {context}"
-        
-        full_prompt = music_context + context_info + f"\n\nユーザーの質問: {message}"
+        # システムプロンプト（固定部分）とユーザープロンプト（会話ごとに変わる部分）を分けて構築
+        system_prompt, user_prompt = build_chat_prompt(message, context)
         
-        # Gemini APIを設定
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.5-pro')
-        
-        response = model.generate_content(full_prompt)
-        return response.text
+        # Gemini APIを呼び出し（同期SDKのためスレッドプールで実行）
+        return await run_in_llm_thread("google", gemini_generate, api_key, 'gemini-2.5-pro', user_prompt,
+                                       system_instruction=system_prompt)
 
 # AIモデルマネージャーのインスタンス
 ai_manager = AIModelManager()
@@ -697,29 +1357,50 @@ async def root():
 async def health():
     return {
         "status": "healthy",
-        "supported_models": ["claude-3-sonnet", "claude-3-opus", "gpt-4", "gpt-3.5-turbo", "gemini-2.5-pro", "gemini-2.5-flash", "gemini-1.5-pro", "gemini-1.5-flash"]
+        "supported_models": ["claude-3-sonnet", "claude-3-opus", "gpt-4", "gpt-3.5-turbo", "gemini-2.5-pro", "gemini-2.5-flash", "gemini-1.5-pro", "gemini-1.5-flash"],
+        "caches": cache_stats(),
+        "agent_sessions": agent_sessions.stats()
     }
 
 # フロントエンド互換性のために /ai/api/ パスも追加
 @app.get("/ai/api/health")
 async def health_ai():
-    return {
-        "status": "healthy",
-        "supported_models": ["claude-3-sonnet", "claude-3-opus", "gpt-4", "gpt-3.5-turbo", "gemini-2.5-pro", "gemini-2.5-flash", "gemini-1.5-pro", "gemini-1.5-flash"]
-    }
+    return await health()
+
+def with_fresh_note_ids(response: GenerateResponse) -> GenerateResponse:
+    """キャッシュした生成結果のコピーを、ノートIDを振り直して返す（同じ結果を複数回挿入してもIDが衝突しない）"""
+    timestamp = int(time.time() * 1000)
+    notes = [
+        {**note, "id": f"note-{timestamp}-{i + 1}"} if isinstance(note, dict) else note
+        for i, note in enumerate(response.notes)
+    ]
+    return GenerateResponse(
+        type=response.type,
+        notes=notes,
+        description=response.description,
+        suggestions=response.suggestions
+    )
 
 # 音楽生成エンドポイント
 @app.post("/api/generate", response_model=GenerateResponse)
-async def generate_music(request: GenerateRequest):
+async def generate_music(request: GenerateRequest, http_request: Request):
     try:
         # APIキーが提供されている場合は使用
         api_key = request.apiKey or DEFAULT_API_KEYS.get("google")
         if not api_key:
             raise HTTPException(status_code=400, detail="API key is required")
         
-        # Gemini APIを設定
-        genai.configure(api_key=api_key)
-        temp_model = genai.GenerativeModel('gemini-2.5-flash')
+        generate_model_name = 'gemini-2.5-flash'
+        
+        # 同じプロンプト・モデルの解析済み結果があれば再利用
+        cache_key = make_cache_key("generate", {
+            "prompt": normalize_prompt(request.prompt),
+            "model": generate_model_name
+        })
+        cached = generate_response_cache.get(cache_key)
+        if cached is not None:
+            print(f"generate_music: Cache hit for prompt: {request.prompt[:50]}...")
+            return with_fresh_note_ids(cached)
         
         # 音楽生成に特化したプロンプトを作成
         music_prompt = f"""
@@ -750,24 +1431,30 @@ async def generate_music(request: GenerateRequest):
 音楽理論的に正しく、指定されたコンテキストに合った音楽要素を生成してください。
 """
         
-        # Gemini APIを呼び出し
-        response = temp_model.generate_content(music_prompt)
+        # Gemini APIを呼び出し（スレッドプールで実行し、クライアント切断時は待機を打ち切る）
+        response_text = await run_until_disconnected(
+            http_request,
+            run_in_llm_thread("google", gemini_generate, api_key, generate_model_name, music_prompt)
+        )
         
         # JSONレスポンスを解析
         import re
         
         # JSONの抽出を試行
-        json_match = re.search(r'\{[\s\S]*\}', response.text)
+        json_match = re.search(r'\{[\s\S]*\}', response_text)
         if json_match:
             json_str = json_match.group(0)
             try:
                 parsed = json.loads(json_str)
-                return GenerateResponse(
+                generated = GenerateResponse(
                     type=parsed.get("type", "melody"),
                     notes=parsed.get("notes", []),
                     description=parsed.get("description", "Generated music pattern"),
                     suggestions=parsed.get("suggestions", "")
                 )
+                # 解析に成功した結果のみキャッシュ（フォールバックは再試行の余地を残す）
+                generate_response_cache.put(cache_key, generated)
+                return with_fresh_note_ids(generated)
             except json.JSONDecodeError:
                 pass
         
@@ -791,7 +1478,7 @@ async def generate_music(request: GenerateRequest):
 
 # チャットエンドポイント（複数モデル対応）
 @app.post("/api/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     try:
         # モデルに応じてAPIキーとプロバイダーを決定
         model_config = {
@@ -821,11 +1508,11 @@ async def chat(request: ChatRequest):
         
         # モデルに応じてAPIを呼び出し
         if config["provider"] == "anthropic":
-            response_text = await ai_manager.call_claude(request.message, request.context, api_key)
+            response_text = await run_until_disconnected(http_request, ai_manager.call_claude(request.message, request.context, api_key))
         elif config["provider"] == "openai":
-            response_text = await ai_manager.call_openai(request.message, request.context, api_key)
+            response_text = await run_until_disconnected(http_request, ai_manager.call_openai(request.message, request.context, api_key))
         elif config["provider"] == "google":
-            response_text = await ai_manager.call_gemini(request.message, request.context, api_key)
+            response_text = await run_until_disconnected(http_request, ai_manager.call_gemini(request.message, request.context, api_key))
         else:
             raise ValueError(f"Unknown provider: {config['provider']}")
         
@@ -843,7 +1530,9 @@ async def chat(request: ChatRequest):
 
 # Agent modeエンドポイント（実際のプロジェクト操作を実行）
 @app.post("/api/agent", response_model=AgentResponse)
-async def agent_action(request: AgentRequest):
+async def agent_action(request: AgentRequest, http_request: Request):
+    # セッション指定時はサーバー側に保持したコンテキストへ差分を反映して使う
+    context = resolve_agent_context(request.sessionId, request.context, request.contextDiff)
     try:
         # モデルに応じてAPIキーとプロバイダーを決定
         model_config = {
@@ -876,15 +1565,15 @@ async def agent_action(request: AgentRequest):
             )
         
         # Agent mode用のプロンプトを生成
-        agent_prompt = generate_agent_prompt(request.prompt, request.context)
+        agent_prompt = generate_agent_prompt(request.prompt, context)
         
         # モデルに応じてAPIを呼び出し
         if config["provider"] == "anthropic":
-            response_text = await ai_manager.call_claude(agent_prompt, request.context, api_key)
+            response_text = await run_until_disconnected(http_request, ai_manager.call_claude(agent_prompt, context, api_key))
         elif config["provider"] == "openai":
-            response_text = await ai_manager.call_openai(agent_prompt, request.context, api_key)
+            response_text = await run_until_disconnected(http_request, ai_manager.call_openai(agent_prompt, context, api_key))
         elif config["provider"] == "google":
-            response_text = await ai_manager.call_gemini(agent_prompt, request.context, api_key)
+            response_text = await run_until_disconnected(http_request, ai_manager.call_gemini(agent_prompt, context, api_key))
         else:
             raise ValueError(f"Unknown provider: {config['provider']}")
         
@@ -893,7 +1582,7 @@ async def agent_action(request: AgentRequest):
         print(f"Full agent response: {response_text}")
         
         # レスポンスを解析してアクションを抽出
-        parsed_response = parse_agent_response(response_text, request.context)
+        parsed_response = parse_agent_response(response_text, context)
         print(f"Parsed response: {parsed_response}")
         
         return AgentResponse(
@@ -914,7 +1603,7 @@ async def agent_action(request: AgentRequest):
 
 # ストリーミングチャットエンドポイント
 @app.post("/api/stream/chat")
-async def stream_chat(request: StreamingChatRequest):
+async def stream_chat(request: StreamingChatRequest, http_request: Request):
     try:
         print(f"Streaming chat request received: {request.message[:50]}...")
         print(f"Chat Debug Info: model={request.model}, apiKeys={request.apiKeys}")
@@ -951,6 +1640,7 @@ async def stream_chat(request: StreamingChatRequest):
         print(f"Starting streaming response for model: {request.model}")
 
         async def event_generator():
+            debug_log = SampledDebugLog()
             try:
                 print(f"stream_chat: Starting event generator for model: {request.model}")
                 print(f"stream_chat: Model starts with 'claude': {request.model.startswith('claude')}")
@@ -961,28 +1651,28 @@ async def stream_chat(request: StreamingChatRequest):
                 if request.model.startswith("claude"):
                     print(f"stream_chat: Using Claude streaming for model: {request.model}")
                     async for chunk in StreamingAIModelManager().stream_claude(request.message, request.context, api_key):
-                        print(f"stream_chat: Yielding Claude chunk: {chunk[:100]}...")
+                        debug_log(f"stream_chat: Yielding Claude chunk: {chunk}")
                         yield chunk
                 elif request.model.startswith("gpt"):
                     print(f"stream_chat: Using OpenAI streaming for model: {request.model}")
                     async for chunk in StreamingAIModelManager().stream_openai(request.message, request.context, api_key):
-                        print(f"stream_chat: Yielding OpenAI chunk: {chunk[:100]}...")
+                        debug_log(f"stream_chat: Yielding OpenAI chunk: {chunk}")
                         yield chunk
                 elif request.model.startswith("gemini"):
                     print(f"stream_chat: Using Gemini streaming for model: {request.model}")
                     async for chunk in StreamingAIModelManager().stream_gemini(request.message, request.context, api_key):
-                        print(f"stream_chat: Yielding Gemini chunk: {chunk[:100]}...")
+                        debug_log(f"stream_chat: Yielding Gemini chunk: {chunk}")
                         yield chunk
                 else:
                     print(f"stream_chat: Unsupported model: {request.model}")
-                    yield f"data: {json.dumps({'type': 'error', 'content': f'Unsupported model: {request.model}'})}\n\n"
+                    yield {'type': 'error', 'content': f'Unsupported model: {request.model}'}
 
                 print("stream_chat: Event generator completed successfully")
             except Exception as e:
                 print(f"stream_chat: Error in streaming: {e}")
-                yield f"data: {json.dumps({'type': 'error', 'content': str(e)})}\n\n"
+                yield {'type': 'error', 'content': str(e)}
 
-        return StreamingResponse(content=event_generator(), media_type="text/event-stream")
+        return sse_response(event_generator(), http_request)
 
     except Exception as e:
         print(f"Error in stream_chat: {e}")
@@ -993,12 +1683,13 @@ async def stream_chat(request: StreamingChatRequest):
 
 # フロントエンド互換性のために /ai/api/ パスも追加
 @app.post("/ai/api/stream/chat")
-async def stream_chat_ai(request: StreamingChatRequest):
-    return await stream_chat(request)
+async def stream_chat_ai(request: StreamingChatRequest, http_request: Request):
+    return await stream_chat(request, http_request)
 
 # ストリーミングAgent modeエンドポイント
 @app.post("/api/stream/agent")
-async def stream_agent_action(request: StreamingAgentRequest):
+async def stream_agent_action(request: StreamingAgentRequest, http_request: Request):
+    context = resolve_agent_context(request.sessionId, request.context, request.contextDiff)
     try:
         model_config = {
             "claude-3-sonnet": {"provider": "anthropic", "api_key_name": "anthropic"},
@@ -1025,15 +1716,15 @@ async def stream_agent_action(request: StreamingAgentRequest):
             # 開発環境用のフォールバック対応
             async def dev_fallback_generator():
                 provider_name = config["provider"].title()
-                yield f"data: {json.dumps({'type': 'error', 'content': f'{provider_name} APIキーが設定されていません。'})}\n\n"
-                yield f"data: {json.dumps({'type': 'info', 'content': '開発環境では.envファイルにAPIキーを設定してください。'})}\n\n"
-                yield f"data: {json.dumps({'type': 'info', 'content': 'サンプル: ANTHROPIC_API_KEY=your_key_here'})}\n\n"
-                yield f"data: {json.dumps({'type': 'done'})}\n\n"
+                yield {'type': 'error', 'content': f'{provider_name} APIキーが設定されていません。'}
+                yield {'type': 'info', 'content': '開発環境では.envファイルにAPIキーを設定してください。'}
+                yield {'type': 'info', 'content': 'サンプル: ANTHROPIC_API_KEY=your_key_here'}
+                yield {'type': 'done'}
 
-            return StreamingResponse(
-                content=dev_fallback_generator(),
-                media_type="text/event-stream"
-            )
+            return sse_response(dev_fallback_generator(), http_request)
+
+        # agent_action と同じAgent mode用のプロンプト（{"actions": [...]} 形式の応答を指示する）
+        agent_prompt = generate_agent_prompt(request.prompt, context)
 
         async def event_generator():
             try:
@@ -1045,26 +1736,54 @@ async def stream_agent_action(request: StreamingAgentRequest):
                 # モデルごとに適切なストリーミング関数を呼び分け
                 if request.model.startswith("claude"):
                     print(f"stream_agent: Using Claude streaming for model: {request.model}")
-                    async for chunk in StreamingAIModelManager().stream_claude(request.prompt, request.context, api_key):
-                        yield chunk
+                    chunks = StreamingAIModelManager().stream_claude(agent_prompt, context, api_key)
                 elif request.model.startswith("gpt"):
                     print(f"stream_agent: Using OpenAI streaming for model: {request.model}")
-                    async for chunk in StreamingAIModelManager().stream_openai(request.prompt, request.context, api_key):
-                        yield chunk
+                    chunks = StreamingAIModelManager().stream_openai(agent_prompt, context, api_key)
                 elif request.model.startswith("gemini"):
                     print(f"stream_agent: Using Gemini streaming for model: {request.model}")
-                    async for chunk in StreamingAIModelManager().stream_gemini(request.prompt, request.context, api_key):
-                        yield chunk
+                    chunks = StreamingAIModelManager().stream_gemini(agent_prompt, context, api_key)
                 else:
                     print(f"stream_agent: Unsupported model: {request.model}")
-                    yield f"data: {json.dumps({'type': 'error', 'content': f'Unsupported model: {request.model}'})}\n\n"
+                    yield {'type': 'error', 'content': f'Unsupported model: {request.model}'}
+                    return
+
+                # 生成中のテキストからアクションを逐次取り出し、閉じた順にactionイベントとして送る
+                parser = AgentResponseStreamParser()
+
+                def actions_complete_event():
+                    return {
+                        'type': 'actions_complete',
+                        'count': len(parser.actions),
+                        'summary': str(parser.document.get("summary", "")),
+                        'nextSteps': str(parser.document.get("nextSteps", ""))
+                    }
+
+                done_sent = False
+                async for chunk in chunks:
+                    if chunk == SSE_DONE:
+                        if parser.document is not None:
+                            yield actions_complete_event()
+                        done_sent = True
+                    yield chunk
+                    if isinstance(chunk, dict) and chunk.get('type') == 'text':
+                        completed = parser.feed(chunk.get('content') or "")
+                        first_index = len(parser.actions) - len(completed)
+                        for offset, action in enumerate(completed):
+                            yield {'type': 'action', 'index': first_index + offset, 'content': action}
+
+                # プロバイダーによっては終了マーカー（[DONE]）を送らずにストリームを閉じるため、ここで完了を通知する
+                if not done_sent:
+                    if parser.document is not None:
+                        yield actions_complete_event()
+                    yield SSE_DONE
                 
                 print("stream_agent: Event generator completed successfully")
             except Exception as e:
                 print(f"stream_agent: Error in streaming: {e}")
-                yield f"data: {json.dumps({'type': 'error', 'content': str(e)})}\n\n"
+                yield {'type': 'error', 'content': str(e)}
 
-        return StreamingResponse(content=event_generator(), media_type="text/event-stream")
+        return sse_response(event_generator(), http_request)
 
     except Exception as e:
         return StreamingResponse(
@@ -1074,21 +1793,45 @@ async def stream_agent_action(request: StreamingAgentRequest):
 
 # フロントエンド互換性のために /ai/api/ パスも追加
 @app.post("/ai/api/stream/agent")
-async def stream_agent_action_ai(request: StreamingAgentRequest):
-    return await stream_agent_action(request)
+async def stream_agent_action_ai(request: StreamingAgentRequest, http_request: Request):
+    return await stream_agent_action(request, http_request)
 
 # 追加のフロントエンド互換エンドポイント
 @app.post("/ai/api/agent")
-async def agent_action_ai(request: AgentRequest):
-    return await agent_action(request)
+async def agent_action_ai(request: AgentRequest, http_request: Request):
+    return await agent_action(request, http_request)
+
+# Agentセッションの作成（セッションIDはサーバーが発行し、推測されたIDで他のクライアントのコンテキストを読み書きできないようにする）
+@app.post("/api/agent/sessions")
+async def create_agent_session(request: AgentSessionCreateRequest):
+    try:
+        session_id, _ = agent_sessions.create(request.context)
+    except AgentSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return {"status": "created", "session_id": session_id}
+
+@app.post("/ai/api/agent/sessions")
+async def create_agent_session_ai(request: AgentSessionCreateRequest):
+    return await create_agent_session(request)
+
+# Agentセッションの削除（クライアントがプロジェクトを閉じたとき等）
+@app.delete("/api/agent/sessions/{session_id}")
+async def delete_agent_session(session_id: str):
+    if not agent_sessions.drop(session_id):
+        raise HTTPException(status_code=404, detail=f"Agent session {session_id} not found")
+    return {"status": "deleted", "session_id": session_id}
+
+@app.delete("/ai/api/agent/sessions/{session_id}")
+async def delete_agent_session_ai(session_id: str):
+    return await delete_agent_session(session_id)
 
 @app.post("/ai/api/generate")
-async def generate_music_ai(request: GenerateRequest):
-    return await generate_music(request)
+async def generate_music_ai(request: GenerateRequest, http_request: Request):
+    return await generate_music(request, http_request)
 
 @app.post("/ai/api/chat")
-async def chat_ai(request: ChatRequest):
-    return await chat(request)
+async def chat_ai(request: ChatRequest, http_request: Request):
+    return await chat(request, http_request)
 
 # MIDI更新概要エンドポイント（仮実装）
 @app.post("/ai/api/update-summary")
@@ -1107,36 +1850,36 @@ async def voice_synthesize(request: DiffSingerSynthesisRequest):
     """DiffSingerサーバー（ポート8001）への音声合成リクエストプロキシ"""
     try:
         # DiffSingerサーバーへのプロキシリクエスト
-        async with aiohttp.ClientSession() as session:
-            diffsinger_url = "http://localhost:8001/api/synthesize"
-
-            # リクエストデータの準備
-            payload = {
-                "lyrics": request.lyrics,
-                "notes": request.notes,
-                "durations": request.durations,
-                "output_path": request.output_path
-            }
-
-            print(f"DiffSinger Proxy: Forwarding request to {diffsinger_url}")
-            print(f"DiffSinger Proxy: Payload = {payload}")
-
-            async with session.post(
-                diffsinger_url,
-                json=payload,
-                timeout=aiohttp.ClientTimeout(total=120)  # 2分タイムアウト
-            ) as response:
-                response_data = await response.json()
+        session = http_sessions.get("diffsinger")
+        diffsinger_url = f"{DIFFSINGER_BASE_URL}/api/synthesize"
+
+        # リクエストデータの準備
+        payload = {
+            "lyrics": request.lyrics,
+            "notes": request.notes,
+            "durations": request.durations,
+            "output_path": request.output_path
+        }
 
-                if response.status == 200:
-                    print(f"DiffSinger Proxy: Success response = {response_data}")
-                    return response_data
-                else:
-                    print(f"DiffSinger Proxy: Error {response.status} = {response_data}")
-                    raise HTTPException(
-                        status_code=response.status,
-                        detail=f"DiffSinger server error: {response_data}"
-                    )
+        print(f"DiffSinger Proxy: Forwarding request to {diffsinger_url}")
+        print(f"DiffSinger Proxy: Payload = {payload}")
+
+        async with session.post(
+            diffsinger_url,
+            json=payload,
+            timeout=aiohttp.ClientTimeout(total=120)  # 2分タイムアウト
+        ) as response:
+            response_data = await response.json()
+
+            if response.status == 200:
+                print(f"DiffSinger Proxy: Success response = {response_data}")
+                return response_data
+            else:
+                print(f"DiffSinger Proxy: Error {response.status} = {response_data}")
+                raise HTTPException(
+                    status_code=response.status,
+                    detail=f"DiffSinger server error: {response_data}"
+                )
 
     except aiohttp.ClientError as e:
         print(f"DiffSinger Proxy: Connection error = {e}")
@@ -1155,24 +1898,24 @@ async def voice_synthesize(request: DiffSingerSynthesisRequest):
 async def voice_health():
     """DiffSingerサーバーのヘルスチェック"""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                "http://localhost:8001/health",
-                timeout=aiohttp.ClientTimeout(total=5)
-            ) as response:
-                if response.status == 200:
-                    diffsinger_status = await response.json()
-                    return {
-                        "status": "healthy",
-                        "service": "DiffSinger Voice API Proxy",
-                        "diffsinger_server": diffsinger_status
-                    }
-                else:
-                    return {
-                        "status": "degraded",
-                        "service": "DiffSinger Voice API Proxy",
-                        "error": f"DiffSinger server returned {response.status}"
-                    }
+        session = http_sessions.get("diffsinger")
+        async with session.get(
+            f"{DIFFSINGER_BASE_URL}/health",
+            timeout=aiohttp.ClientTimeout(total=5)
+        ) as response:
+            if response.status == 200:
+                diffsinger_status = await response.json()
+                return {
+                    "status": "healthy",
+                    "service": "DiffSinger Voice API Proxy",
+                    "diffsinger_server": diffsinger_status
+                }
+            else:
+                return {
+                    "status": "degraded",
+                    "service": "DiffSinger Voice API Proxy",
+                    "error": f"DiffSinger server returned {response.status}"
+                }
     except Exception as e:
         return {
             "status": "unhealthy",
@@ -1185,19 +1928,19 @@ async def voice_health():
 async def get_voice_models():
     """利用可能な音声モデル一覧"""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                "http://localhost:8001/api/models",
-                timeout=aiohttp.ClientTimeout(total=10)
-            ) as response:
-                if response.status == 200:
-                    return await response.json()
-                else:
-                    return {
-                        "models": [],
-                        "current": None,
-                        "error": f"DiffSinger server returned {response.status}"
-                    }
+        session = http_sessions.get("diffsinger")
+        async with session.get(
+            f"{DIFFSINGER_BASE_URL}/api/models",
+            timeout=aiohttp.ClientTimeout(total=10)
+        ) as response:
+            if response.status == 200:
+                return await response.json()
+            else:
+                return {
+                    "models": [],
+                    "current": None,
+                    "error": f"DiffSinger server returned {response.status}"
+                }
     except Exception as e:
         return {
             "models": [
@@ -1212,12 +1955,12 @@ async def get_voice_models():
 async def load_voice_model(model_id: str):
     """指定された音声モデルをロード"""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"http://localhost:8001/api/models/{model_id}/load",
-                timeout=aiohttp.ClientTimeout(total=30)
-            ) as response:
-                return await response.json()
+        session = http_sessions.get("diffsinger")
+        async with session.post(
+            f"{DIFFSINGER_BASE_URL}/api/models/{model_id}/load",
+            timeout=aiohttp.ClientTimeout(total=30)
+        ) as response:
+            return await response.json()
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -1237,168 +1980,486 @@ class GhostTextPredictRequest(BaseModel):
     scale_notes_midi: Optional[List[int]] = None
     current_chord: Optional[Dict[str, Any]] = None
 
-@app.post("/ai/predict")
-async def ghost_text_predict(request: GhostTextPredictRequest):
+
+# Ghost Text複数位置予測リクエストモデル（cursor_positions か range_start/range_end/grid_step のどちらかを指定）
+class GhostTextBatchPredictRequest(BaseModel):
+    track_summary: Optional[str] = ""
+    current_notes: List[Dict[str, Any]]
+    cursor_positions: Optional[List[float]] = None
+    range_start: Optional[float] = None
+    range_end: Optional[float] = None  # 終端は含まない
+    grid_step: Optional[float] = None
+    track_type: str = "melody"  # "melody" or "rhythm"
+    key_signature: str = "C"
+    time_signature: str = "4/4"
+    tempo: int = 120
+    genre: Optional[str] = "Lo-Fi Hip Hop"
+    scale_notes_midi: Optional[List[int]] = None
+    current_chord: Optional[Dict[str, Any]] = None
+
+# Ghost Text予測用の音楽理論テーブル設定
+GHOST_TEXT_DEFAULT_GENRE = "Lo-Fi Hip Hop"
+GHOST_TEXT_DEFAULT_KEY = "C"
+GHOST_TEXT_DEFAULT_TIME_SIGNATURE = "4/4"
+GHOST_TEXT_MAX_SUGGESTIONS = 5
+GHOST_TEXT_MAX_BEATS_PER_MEASURE = 32
+GHOST_TEXT_MAX_LAZY_ENTRIES = 4096   # 起動時テーブルにない組み合わせ（独自スケール・転回形コード等）の保持上限
+GHOST_TEXT_MAX_BATCH_POSITIONS = 256  # /ai/predict/batch で1回に受け付けるカーソル位置の上限
+
+# ジャンル別のリズム感（拍の強弱は拍子から決まる）
+# ドラムパターンのヒントは拍子ごと（ヒントのない拍子では None）
+GHOST_TEXT_GENRE_FEELS = {
+    "Lo-Fi Hip Hop": {
+        "swing_all_off_beats": False,  # 弱拍の裏拍を強調
+        "swing_ratio": 0.15,
+        "drum_pattern_hints": {
+            "2/4": "Kick on 1. Snare on 2 (Backbeat).",
+            "3/4": "Kick on 1. Snare on 2 & 3.",
+            "4/4": "Kick on 1 & 3. Snare on 2 & 4 (Backbeat).",
+            "6/8": "Kick on 1. Snare on 4 (Half-time feel).",
+            "12/8": "Kick on 1 & 7. Snare on 4 & 10."
+        }
+    },
+    "Jazz": {
+        "swing_all_off_beats": True,   # すべての裏拍
+        "swing_ratio": 0.67,
+        "drum_pattern_hints": {
+            "3/4": "Jazz waltz, ride cymbal on swing 8ths, kick on 1",
+            "4/4": "Swing feel, ride cymbal on swing 8ths"
+        }
+    },
+    "Pop": {
+        "swing_all_off_beats": False,
+        "swing_ratio": 0.0,
+        "drum_pattern_hints": {
+            "2/4": "Kick on 1, Snare on 2",
+            "3/4": "Kick on 1, Snare on 2 & 3",
+            "4/4": "Kick on 1, Snare on 2 & 4",
+            "6/8": "Kick on 1, Snare on 4",
+            "12/8": "Kick on 1 & 7, Snare on 4 & 10"
+        }
+    }
+}
+
+# 起動時にテーブルを作る拍子
+GHOST_TEXT_TIME_SIGNATURES = ["2/4", "3/4", "4/4", "5/4", "6/8", "12/8"]
+
+NOTE_PITCH_CLASSES = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
+MAJOR_SCALE_INTERVALS = (0, 2, 4, 5, 7, 9, 11)
+MINOR_SCALE_INTERVALS = (0, 2, 3, 5, 7, 8, 10)  # ナチュラルマイナー
+
+# ドラムMIDIマッピング（General MIDI準拠）
+DRUM_KICK = 36
+DRUM_SNARE = 38
+DRUM_CLOSED_HAT = 42
+DRUM_OPEN_HAT = 46
+
+
+@functools.lru_cache(maxsize=256)
+def parse_time_signature(time_signature: str) -> Tuple[int, int]:
+    """拍子記号を (1小節の拍数, 拍の単位) に変換（解釈できなければ4/4）"""
+    try:
+        numerator, denominator = (int(part) for part in time_signature.split("/"))
+    except (AttributeError, ValueError):
+        return 4, 4
+    if not 1 <= numerator <= GHOST_TEXT_MAX_BEATS_PER_MEASURE or denominator not in (1, 2, 4, 8, 16, 32):
+        return 4, 4
+    return numerator, denominator
+
+
+@functools.lru_cache(maxsize=256)
+def parse_key_signature(key_signature: str) -> Tuple[int, ...]:
     """
-    Ghost Text補完機能：トラックタイプ別の音符提案
-    ジャンル固有の音楽理論とリズム定義に基づいた補完を提供
+    調号（"C", "F#", "Bb", "Am", "D minor" 等）をC4オクターブ内のスケール構成音に変換
+
+    解釈できない場合はCメジャースケールを返す
     """
-    try:
-        # リズム定義（ジャンル別）
-        rhythm_definitions = {
-            "Lo-Fi Hip Hop": {
-                "time_signature": "4/4",
-                "strong_beats": [1, 3],  # 1拍目、3拍目
-                "weak_beats": [2, 4],
-                "off_beats_priority": [2, 4],  # 裏拍強調
-                "swing_ratio": 0.15,
-                "drum_pattern_hint": "Kick on 1 & 3. Snare on 2 & 4 (Backbeat)."
-            },
-            "Jazz": {
-                "time_signature": "4/4",
-                "strong_beats": [1, 3],
-                "weak_beats": [2, 4],
-                "off_beats_priority": [1, 2, 3, 4],  # すべての裏拍
-                "swing_ratio": 0.67,
-                "drum_pattern_hint": "Swing feel, ride cymbal on swing 8ths"
-            },
-            "Pop": {
-                "time_signature": "4/4",
-                "strong_beats": [1, 3],
-                "weak_beats": [2, 4],
-                "off_beats_priority": [2, 4],
-                "swing_ratio": 0.0,
-                "drum_pattern_hint": "Kick on 1, Snare on 2 & 4"
-            }
-        }
+    key = (key_signature or "").strip()
+    root = NOTE_PITCH_CLASSES.get(key[:1].upper())
+    if root is None:
+        return tuple(60 + interval for interval in MAJOR_SCALE_INTERVALS)
+
+    rest = key[1:]
+    if rest[:1] in ("#", "♯"):
+        root, rest = root + 1, rest[1:]
+    elif rest[:1] in ("b", "♭"):
+        root, rest = root - 1, rest[1:]
+    mode = rest.strip().lower()
+    is_minor = mode in ("m", "min", "minor") or (mode.startswith("m") and not mode.startswith("maj"))
+    intervals = MINOR_SCALE_INTERVALS if is_minor else MAJOR_SCALE_INTERVALS
+    return tuple(sorted(60 + (root + interval) % 12 for interval in intervals))
+
+
+def build_rhythm_definition(genre: str, time_signature: str) -> Dict[str, Any]:
+    """ジャンルと拍子からリズム定義（強拍・弱拍・裏拍強調・スイング）を作る"""
+    feel = GHOST_TEXT_GENRE_FEELS[genre]
+    beats_per_measure, beat_unit = parse_time_signature(time_signature)
+
+    if beat_unit == 8 and beats_per_measure % 3 == 0 and beats_per_measure > 3:
+        # 複合拍子（6/8, 12/8）は3つずつのまとまりの頭が強拍
+        strong_beats = list(range(1, beats_per_measure + 1, 3))
+    elif beats_per_measure >= 4 and beats_per_measure % 2 == 0:
+        # 偶数拍子は小節の頭と中間が強拍（4/4なら1拍目と3拍目）
+        strong_beats = [1, beats_per_measure // 2 + 1]
+    else:
+        strong_beats = [1]
+    weak_beats = [beat for beat in range(1, beats_per_measure + 1) if beat not in strong_beats]
+
+    normalized_time_signature = f"{beats_per_measure}/{beat_unit}"
+    return {
+        "time_signature": normalized_time_signature,
+        "strong_beats": strong_beats,
+        "weak_beats": weak_beats,
+        "off_beats_priority": list(range(1, beats_per_measure + 1)) if feel["swing_all_off_beats"] else weak_beats,
+        "swing_ratio": feel["swing_ratio"],
+        "drum_pattern_hint": feel["drum_pattern_hints"].get(normalized_time_signature)
+    }
 
-        # 現在のジャンル設定を取得
-        genre = request.genre or "Lo-Fi Hip Hop"
-        rhythm_def = rhythm_definitions.get(genre, rhythm_definitions["Lo-Fi Hip Hop"])
 
-        # 現在の拍位置を計算（4/4拍子を想定）
-        beats_per_measure = 4
-        current_beat = (request.cursor_position % beats_per_measure) + 1
-        is_strong_beat = int(current_beat) in rhythm_def["strong_beats"]
-        is_weak_beat = int(current_beat) in rhythm_def["weak_beats"]
+class GhostTextTheoryIndex:
+    """
+    Ghost Text予測用の事前計算テーブル
 
-        suggestions = []
+    (ジャンル, スケール, 拍子, コード構成音) ごとに、小節内の各拍の候補ノートを
+    確信度順に並べて保持します。起動時に全ジャンル・全調・主要拍子・ダイアトニックコードの
+    組み合わせを構築し、それ以外の組み合わせは初回に構築して上限付きで保持します。
+    """
 
-        if request.track_type == "melody" or request.track_type == "Melody":
-            # メロディトラックの提案ロジック
-            scale_notes = request.scale_notes_midi or [60, 62, 64, 65, 67, 69, 71]  # Cメジャースケール
-
-            # 現在のコード構成音
-            chord_notes = []
-            if request.current_chord and request.current_chord.get("midi_notes"):
-                chord_notes = request.current_chord["midi_notes"]
-
-            # 提案候補を生成
-            for note in scale_notes:
-                confidence = 0.5  # ベース確信度
-                reasoning_tag = "Scale_Note"
-
-                # 強拍の場合、コード構成音を優先
-                if is_strong_beat and note in chord_notes:
-                    confidence = 0.95
-                    reasoning_tag = "Current_Chord_Root_Strong_Beat"
-                elif is_strong_beat:
-                    # 強拍でコード構成音
+    def __init__(self, max_lazy_entries: int = GHOST_TEXT_MAX_LAZY_ENTRIES):
+        self.max_lazy_entries = max_lazy_entries
+        self._rhythm_definitions: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._melody: Dict[Tuple, Tuple] = {}
+        self._drums: Dict[Tuple[str, str], Tuple] = {}
+        self._lazy_melody = OrderedDict()
+        self.hits = 0
+        self.lazy_builds = 0
+        self.build_time_sec = 0.0
+
+    def build(self) -> None:
+        """全ジャンル・全調・主要拍子の組み合わせを構築"""
+        start_time = time.perf_counter()
+        scales = {
+            parse_key_signature(f"{name}{accidental}{mode}")
+            for name in NOTE_PITCH_CLASSES for accidental in ("", "#") for mode in ("", "m")
+        }
+        for genre in GHOST_TEXT_GENRE_FEELS:
+            for time_signature in GHOST_TEXT_TIME_SIGNATURES:
+                self.rhythm_definition(genre, time_signature)
+                self.drum_candidates(genre, time_signature)
+                for scale in scales:
+                    for chord in ((),) + self._diatonic_triads(scale):
+                        index_key = (genre, scale, time_signature, chord)
+                        self._melody[index_key] = self._build_melody(*index_key)
+        self.build_time_sec = time.perf_counter() - start_time
+        print(f"GhostTextTheoryIndex: Built {len(self._melody)} melody tables "
+              f"in {self.build_time_sec * 1000:.1f}ms")
+
+    @staticmethod
+    def _diatonic_triads(scale: Tuple[int, ...]) -> Tuple[Tuple[int, ...], ...]:
+        """スケール上のダイアトニック三和音（基本形）"""
+        extended = scale + tuple(note + 12 for note in scale)
+        return tuple(
+            (extended[degree], extended[degree + 2], extended[degree + 4])
+            for degree in range(len(scale))
+        )
+
+    def rhythm_definition(self, genre: str, time_signature: str) -> Dict[str, Any]:
+        """リズム定義（表記揺れは正規化した拍子でまとめる）"""
+        beats_per_measure, beat_unit = parse_time_signature(time_signature)
+        definition_key = (genre, f"{beats_per_measure}/{beat_unit}")
+        definition = self._rhythm_definitions.get(definition_key)
+        if definition is None:
+            definition = build_rhythm_definition(genre, time_signature)
+            self._rhythm_definitions[definition_key] = definition
+        return definition
+
+    def _build_melody(self, genre: str, scale: Tuple[int, ...], time_signature: str,
+                      chord: Tuple[int, ...]) -> Tuple:
+        """拍ごとの (MIDIノート, 基本確信度, 理由タグ) を確信度順に並べたテーブル"""
+        rhythm_def = self.rhythm_definition(genre, time_signature)
+        chord_notes = set(chord)
+        beats_per_measure, _ = parse_time_signature(time_signature)
+        table = []
+        for beat in range(1, beats_per_measure + 1):
+            candidates = []
+            for note in scale:
+                if beat in rhythm_def["strong_beats"]:
+                    # 強拍ではコード構成音を優先
                     if note in chord_notes:
-                        confidence = 0.90
-                        reasoning_tag = "Chord_Tone_Strong_Beat"
+                        candidates.append((note, 0.95, "Current_Chord_Root_Strong_Beat"))
                     else:
-                        confidence = 0.65
-                        reasoning_tag = "Scale_Tone_Strong_Beat"
-                elif is_weak_beat:
-                    # 弱拍でテンションやパッシングトーン
-                    confidence = 0.70
-                    reasoning_tag = "Scale_Tone_Weak_Beat"
-                    if note not in chord_notes:
-                        reasoning_tag = "Tension_Note_Weak_Beat"
-
-                # 直前のノートとの関連性を考慮
-                if request.current_notes:
-                    last_note = request.current_notes[-1]["pitch"]
-                    interval = abs(note - last_note)
-                    if interval <= 2:  # 半音または全音の動き
-                        confidence += 0.1
-                        reasoning_tag += "_Stepwise_Motion"
-                    elif interval == 12:  # オクターブ
-                        confidence += 0.05
-                        reasoning_tag += "_Octave_Jump"
-
-                suggestions.append({
-                    "midi_note": int(note),
-                    "confidence": min(confidence, 1.0),
-                    "reasoning_tag": reasoning_tag
-                })
-
-        elif request.track_type == "rhythm" or request.track_type == "Rhythm" or request.track_type == "Drum":
-            # リズムトラック（ドラム）の提案ロジック
-
-            # ドラムMIDIマッピング（General MIDI準拠）
-            KICK = 36
-            SNARE = 38
-            CLOSED_HAT = 42
-            OPEN_HAT = 46
-
-            # Kick提案（強拍）
-            if is_strong_beat:
-                suggestions.append({
-                    "midi_note": KICK,
-                    "confidence": 0.98,
-                    "reasoning_tag": "Rhythm_Kick_on_Strong_Beat"
-                })
-
-            # Snare提案（弱拍 - バックビート）
-            if is_weak_beat:
-                suggestions.append({
-                    "midi_note": SNARE,
-                    "confidence": 0.95,
-                    "reasoning_tag": "Backbeat_Snare"
-                })
-
-            # Hi-Hat提案（常時）
+                        candidates.append((note, 0.65, "Scale_Tone_Strong_Beat"))
+                elif beat in rhythm_def["weak_beats"]:
+                    # 弱拍ではテンションやパッシングトーン
+                    tag = "Scale_Tone_Weak_Beat" if note in chord_notes else "Tension_Note_Weak_Beat"
+                    candidates.append((note, 0.70, tag))
+                else:
+                    candidates.append((note, 0.5, "Scale_Note"))
+            # 同じ確信度ではスケール順を保つ（安定ソート）
+            candidates.sort(key=lambda candidate: candidate[1], reverse=True)
+            table.append(tuple(candidates))
+        return tuple(table)
+
+    def melody_candidates(self, genre: str, scale: Tuple[int, ...], time_signature: str,
+                          chord: Tuple[int, ...], beat_index: int) -> Tuple:
+        """指定拍（0始まり）のメロディ候補"""
+        index_key = (genre, scale, time_signature, chord)
+        table = self._melody.get(index_key)
+        if table is not None:
+            self.hits += 1
+            return table[beat_index]
+
+        table = self._lazy_melody.get(index_key)
+        if table is not None:
+            self._lazy_melody.move_to_end(index_key)
+            self.hits += 1
+            return table[beat_index]
+
+        table = self._build_melody(*index_key)
+        self.lazy_builds += 1
+        self._lazy_melody[index_key] = table
+        while len(self._lazy_melody) > self.max_lazy_entries:
+            self._lazy_melody.popitem(last=False)
+        return table[beat_index]
+
+    def drum_candidates(self, genre: str, time_signature: str) -> Tuple:
+        """拍ごとのドラム提案（確信度順・上位のみ）"""
+        drums_key = (genre, time_signature)
+        table = self._drums.get(drums_key)
+        if table is not None:
+            return table
+
+        rhythm_def = self.rhythm_definition(genre, time_signature)
+        beats_per_measure, _ = parse_time_signature(time_signature)
+        table = []
+        for beat in range(1, beats_per_measure + 1):
+            suggestions = []
+            if beat in rhythm_def["strong_beats"]:
+                suggestions.append({"midi_note": DRUM_KICK, "confidence": 0.98,
+                                    "reasoning_tag": "Rhythm_Kick_on_Strong_Beat"})
+            if beat in rhythm_def["weak_beats"]:
+                # バックビート
+                suggestions.append({"midi_note": DRUM_SNARE, "confidence": 0.95,
+                                    "reasoning_tag": "Backbeat_Snare"})
+            suggestions.append({"midi_note": DRUM_CLOSED_HAT, "confidence": 0.85,
+                                "reasoning_tag": "Hi_Hat_8th_Note"})
+            # スイング時は裏拍にオープンハットも提案
+            if rhythm_def["swing_ratio"] > 0.3 and beat in rhythm_def["off_beats_priority"]:
+                suggestions.append({"midi_note": DRUM_OPEN_HAT, "confidence": 0.75,
+                                    "reasoning_tag": "Swing_Open_Hat_Off_Beat"})
+            suggestions.sort(key=lambda x: x["confidence"], reverse=True)
+            table.append(tuple(suggestions[:GHOST_TEXT_MAX_SUGGESTIONS]))
+        table = tuple(table)
+        self._drums[drums_key] = table
+        return table
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "melody_tables": len(self._melody),
+            "lazy_tables": len(self._lazy_melody),
+            "max_lazy_entries": self.max_lazy_entries,
+            "hits": self.hits,
+            "lazy_builds": self.lazy_builds,
+            "build_time_ms": round(self.build_time_sec * 1000, 1)
+        }
+
+
+ghost_text_index = GhostTextTheoryIndex()
+ghost_text_index.build()
+
+
+def resolve_ghost_text_context(request) -> Dict[str, Any]:
+    """リクエストのトラック文脈（ジャンル・拍子・スケール・コード・直前ノート）を一度だけ解決"""
+    genre = request.genre or GHOST_TEXT_DEFAULT_GENRE
+    feel_genre = genre if genre in GHOST_TEXT_GENRE_FEELS else GHOST_TEXT_DEFAULT_GENRE
+    rhythm_def = ghost_text_index.rhythm_definition(
+        feel_genre, request.time_signature or GHOST_TEXT_DEFAULT_TIME_SIGNATURE
+    )
+    # 表記揺れ（" 3/4" 等）は正規化した拍子でテーブルを引く
+    time_signature = rhythm_def["time_signature"]
+    beats_per_measure, _ = parse_time_signature(time_signature)
+
+    if request.scale_notes_midi:
+        scale = tuple(request.scale_notes_midi)
+    else:
+        scale = parse_key_signature(request.key_signature or GHOST_TEXT_DEFAULT_KEY)
+    chord_notes = (request.current_chord or {}).get("midi_notes") or ()
+
+    return {
+        "genre": genre,
+        "feel_genre": feel_genre,
+        "rhythm_definition": rhythm_def,
+        "time_signature": time_signature,
+        "beats_per_measure": beats_per_measure,
+        "scale": scale,
+        "chord": tuple(sorted(set(chord_notes))),
+        "last_note": request.current_notes[-1]["pitch"] if request.current_notes else None
+    }
+
+
+def ghost_text_beat_suggestions(track_type: str, context: Dict[str, Any], beat_index: int) -> List[Dict[str, Any]]:
+    """小節内の拍（0始まり）に対する提案（テーブル引きと直前ノートとの音程補正）"""
+    if track_type in ("melody", "Melody"):
+        candidates = ghost_text_index.melody_candidates(
+            context["feel_genre"], context["scale"], context["time_signature"], context["chord"], beat_index
+        )
+        last_note = context["last_note"]
+        if last_note is None:
+            return [
+                {"midi_note": int(note), "confidence": confidence, "reasoning_tag": reasoning_tag}
+                for note, confidence, reasoning_tag in candidates[:GHOST_TEXT_MAX_SUGGESTIONS]
+            ]
+
+        # 半音・全音の順次進行とオクターブ跳躍を優遇
+        suggestions = []
+        for note, confidence, reasoning_tag in candidates:
+            interval = abs(note - last_note)
+            if interval <= 2:
+                confidence += 0.1
+                reasoning_tag += "_Stepwise_Motion"
+            elif interval == 12:
+                confidence += 0.05
+                reasoning_tag += "_Octave_Jump"
             suggestions.append({
-                "midi_note": CLOSED_HAT,
-                "confidence": 0.85,
-                "reasoning_tag": "Hi_Hat_8th_Note"
+                "midi_note": int(note),
+                "confidence": min(confidence, 1.0),
+                "reasoning_tag": reasoning_tag
             })
-
-            # スイング考慮
-            if rhythm_def["swing_ratio"] > 0.3:
-                # スイング時はオープンハットも提案
-                if int(current_beat) in rhythm_def["off_beats_priority"]:
-                    suggestions.append({
-                        "midi_note": OPEN_HAT,
-                        "confidence": 0.75,
-                        "reasoning_tag": "Swing_Open_Hat_Off_Beat"
-                    })
-
-        # 確信度順にソート
         suggestions.sort(key=lambda x: x["confidence"], reverse=True)
+        return suggestions[:GHOST_TEXT_MAX_SUGGESTIONS]
 
-        # 上位5つの提案を返す
-        return {
-            "suggestions": suggestions[:5],
-            "track_type": request.track_type,
+    if track_type in ("rhythm", "Rhythm", "Drum"):
+        return list(ghost_text_index.drum_candidates(context["feel_genre"], context["time_signature"])[beat_index])
+    return []
+
+
+def predict_ghost_text(request: "GhostTextPredictRequest") -> Dict[str, Any]:
+    """テーブル引きと直前ノートとの音程補正でGhost Text提案を作る"""
+    context = resolve_ghost_text_context(request)
+    rhythm_def = context["rhythm_definition"]
+
+    # 現在の拍位置（1始まり、小数部は拍内の位置）
+    current_beat = (request.cursor_position % context["beats_per_measure"]) + 1
+    beat_index = int(current_beat) - 1
+
+    return {
+        "suggestions": ghost_text_beat_suggestions(request.track_type, context, beat_index),
+        "track_type": request.track_type,
+        "current_beat": current_beat,
+        "is_strong_beat": beat_index + 1 in rhythm_def["strong_beats"],
+        "genre": context["genre"],
+        "rhythm_definition": rhythm_def
+    }
+
+
+def expand_cursor_positions(request: "GhostTextBatchPredictRequest") -> List[float]:
+    """
+    バッチリクエストのカーソル位置一覧（明示リスト、または範囲とグリッド幅から展開）
+
+    Raises:
+        ValueError: 位置の指定がない・不正・上限超過の場合
+    """
+    if request.cursor_positions is not None:
+        positions = list(request.cursor_positions)
+    elif request.range_start is not None and request.range_end is not None and request.grid_step is not None:
+        if request.grid_step <= 0:
+            raise ValueError("grid_step must be positive")
+        count = max(0, math.ceil((request.range_end - request.range_start) / request.grid_step - 1e-9))
+        if count > GHOST_TEXT_MAX_BATCH_POSITIONS:
+            raise ValueError(f"Too many cursor positions (max {GHOST_TEXT_MAX_BATCH_POSITIONS})")
+        # 累積誤差を避けるため開始位置からの倍数で計算（終端は含まない）
+        positions = [request.range_start + i * request.grid_step for i in range(count)]
+    else:
+        raise ValueError("Specify cursor_positions, or range_start, range_end and grid_step")
+
+    if len(positions) > GHOST_TEXT_MAX_BATCH_POSITIONS:
+        raise ValueError(f"Too many cursor positions (max {GHOST_TEXT_MAX_BATCH_POSITIONS})")
+    return positions
+
+
+def predict_ghost_text_batch(request: "GhostTextBatchPredictRequest", positions: List[float]) -> Dict[str, Any]:
+    """
+    1つのトラック文脈で複数のカーソル位置の提案をまとめて作る
+
+    文脈の解決は1回だけ行い、提案は小節内の拍ごとに1回だけ計算して同じ拍の位置で共有します。
+    """
+    context = resolve_ghost_text_context(request)
+    rhythm_def = context["rhythm_definition"]
+    beats_per_measure = context["beats_per_measure"]
+    strong_beats = rhythm_def["strong_beats"]
+
+    suggestions_by_beat: Dict[int, List[Dict[str, Any]]] = {}
+    predictions = []
+    for cursor_position in positions:
+        current_beat = (cursor_position % beats_per_measure) + 1
+        beat_index = int(current_beat) - 1
+        suggestions = suggestions_by_beat.get(beat_index)
+        if suggestions is None:
+            suggestions = ghost_text_beat_suggestions(request.track_type, context, beat_index)
+            suggestions_by_beat[beat_index] = suggestions
+        predictions.append({
+            "cursor_position": cursor_position,
             "current_beat": current_beat,
-            "is_strong_beat": is_strong_beat,
-            "genre": genre,
-            "rhythm_definition": rhythm_def
-        }
+            "is_strong_beat": beat_index + 1 in strong_beats,
+            "suggestions": suggestions
+        })
 
+    return {
+        "predictions": predictions,
+        "track_type": request.track_type,
+        "genre": context["genre"],
+        "rhythm_definition": rhythm_def
+    }
+
+
+@app.post("/ai/predict")
+async def ghost_text_predict(request: GhostTextPredictRequest):
+    """
+    Ghost Text補完機能：トラックタイプ別の音符提案
+    ジャンル固有の音楽理論とリズム定義に基づいた補完を提供（起動時に構築したテーブルを参照）
+    """
+    try:
+        return predict_ghost_text(request)
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Ghost Text prediction failed: {str(e)}"
         )
 
-def generate_agent_prompt(user_prompt: str, context: dict) -> str:
-    """Sense-Plan-Actアーキテクチャに基づくAgent mode用プロンプトを生成（簡潔版）"""
 
-    # コンテキスト情報の構築（最小限）
+def has_non_finite_positions(request: "GhostTextBatchPredictRequest") -> bool:
+    """位置の指定に NaN・Infinity が含まれるか"""
+    values = list(request.cursor_positions or [])
+    values += [v for v in (request.range_start, request.range_end, request.grid_step) if v is not None]
+    return not all(math.isfinite(v) for v in values)
+
+
+@app.post("/ai/predict/batch")
+async def ghost_text_predict_batch(request: GhostTextBatchPredictRequest):
+    """
+    Ghost Text補完機能（複数位置版）：1つのトラック文脈と複数のカーソル位置を受け取り、
+    小節分などの提案を1回のリクエストで返す
+    """
+    # pydantic の allow_inf_nan=False では検証エラーに入力値（NaN）がそのまま入り、
+    # FastAPI の422応答がJSONにできず500になるため、ここで検査する
+    if has_non_finite_positions(request):
+        raise HTTPException(status_code=422, detail="cursor_positions, range_start, range_end and grid_step must be finite numbers")
+
+    try:
+        positions = expand_cursor_positions(request)
+    except (ValueError, OverflowError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        return predict_ghost_text_batch(request, positions)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Ghost Text batch prediction failed: {str(e)}"
+        )
+
+def render_agent_context_info(context: dict) -> str:
+    """Agent mode用プロンプトのコンテキスト情報部分（最小限）"""
     context_info = ""
     if context:
         if context.get('currentTrack'):
@@ -1416,6 +2477,17 @@ def generate_agent_prompt(user_prompt: str, context: dict) -> str:
             settings = context['projectSettings']
             context_info += f"\n設定: {settings.get('tempo', 120)}BPM, {settings.get('key', 'C')}, {settings.get('timeSignature', '4/4')}"
 
+    return context_info
+
+def generate_agent_prompt(user_prompt: str, context: dict) -> str:
+    """Sense-Plan-Actアーキテクチャに基づくAgent mode用プロンプトを生成（簡潔版）"""
+
+    # コンテキスト情報の構築（セッションのコンテキストは描画済みの断片を使う）
+    if isinstance(context, AgentSessionContext):
+        context_info = context.agent_context_info
+    else:
+        context_info = render_agent_context_info(context)
+
     # 簡潔なプロンプト（トークン数削減）
     prompt = f"""音楽制作AIアシスタント。ユーザーの要求を理解し、JSONで応答してください。
 
@@ -1442,22 +2514,193 @@ updateTrack, deleteTrack, updateMidiNotes, deleteMidiNotes, updateProjectSetting
 
     return prompt
 
+class AgentResponseStreamParser:
+    """
+    Agent modeの応答（JSON）を逐次読み進めるパーサー
+
+    文字列・エスケープ・//コメントを考慮して括弧の対応を追跡し、
+    トップレベルのオブジェクト直下の "actions" 配列の要素が閉じた時点でその要素を返します。
+    入力は一度しか走査しない（記号の間は正規表現でまとめて読み飛ばす）ため、応答が長くなっても処理時間は線形です。
+    JSONの前後にある説明文やコードフェンス（```json）は読み飛ばします。
+    """
+
+    _STRUCTURAL = re.compile(r'[{}\[\]":,/]')
+    _NESTED_STRUCTURAL = re.compile(r'[{}\[\]"/]')  # 深い階層ではキー区切りを追う必要がない
+    _STRING_SPECIAL = re.compile(r'["\\]')
+
+    def __init__(self):
+        self._stack: List[str] = []        # 開いている括弧（"{" または "["）
+        self._in_string = False
+        self._escape = False
+        self._pending_slash = False
+        self._in_comment = False
+        self._key_chars: Optional[List[str]] = None  # 読み取り中のキー候補の文字列
+        self._last_key: Optional[str] = None
+        self._awaiting_array = False       # "actions": の直後で "[" を待っている
+        self._actions_level: Optional[int] = None  # actions配列が開いている時のスタックの深さ
+        self._document_parts: List[str] = []
+        self._action_parts: Optional[List[str]] = None
+        self.actions: List[Dict[str, Any]] = []
+        self.document: Optional[Dict[str, Any]] = None  # actionsを含む最初のトップレベルオブジェクト
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """
+        テキスト片を読み進める
+
+        Returns:
+            List[Dict[str, Any]]: このテキスト片で閉じたアクション
+        """
+        completed = []
+        position = 0
+        length = len(text)
+        while position < length and self.document is None:
+            if not self._stack:
+                # オブジェクトの外は説明文なので次の "{" まで読み飛ばす
+                position = text.find("{", position)
+                if position < 0:
+                    break
+
+            if self._in_comment:
+                end = text.find("\n", position)
+                if end < 0:
+                    break
+                self._in_comment = False
+                position = end
+                continue
+
+            if self._in_string:
+                position = self._read_string(text, position)
+                continue
+
+            if self._pending_slash:
+                self._pending_slash = False
+                if text[position] == "/":
+                    self._in_comment = True
+                    position += 1
+                    continue
+                self._emit("/")
+
+            pattern = self._STRUCTURAL if len(self._stack) == 1 else self._NESTED_STRUCTURAL
+            match = pattern.search(text, position)
+            end = match.start() if match else length
+            if end > position:
+                segment = text[position:end]
+                self._emit(segment)
+                if len(self._stack) == 1 and not segment.isspace():
+                    self._awaiting_array = False
+            if match is None:
+                break
+            char = text[end]
+            position = end + 1
+
+            if char == "/":
+                self._pending_slash = True
+            elif char == '"':
+                self._in_string = True
+                self._emit(char)
+                # トップレベルのオブジェクトのキーだけを "actions" と比較する
+                self._key_chars = [] if len(self._stack) == 1 else None
+            elif char in "{[":
+                is_actions = char == "[" and self._awaiting_array
+                self._awaiting_array = False
+                if char == "{" and self._actions_level is not None and len(self._stack) == self._actions_level:
+                    self._action_parts = []
+                self._stack.append(char)
+                self._emit(char)
+                if is_actions:
+                    self._actions_level = len(self._stack)
+            elif char in "}]":
+                self._emit(char)
+                self._stack.pop()
+                depth = len(self._stack)
+                if char == "}" and self._action_parts is not None and depth == self._actions_level:
+                    action = self._decode("".join(self._action_parts))
+                    self._action_parts = None
+                    if isinstance(action, dict):
+                        self.actions.append(action)
+                        completed.append(action)
+                elif char == "]" and self._actions_level is not None and depth == self._actions_level - 1:
+                    self._actions_level = -1  # actions配列は閉じた
+                if depth == 0:
+                    self._close_document()
+            else:
+                self._emit(char)
+                if len(self._stack) == 1:
+                    if char == ":":
+                        self._awaiting_array = self._last_key == "actions"
+                    else:
+                        self._last_key = None
+                        self._awaiting_array = False
+
+        return completed
+
+    def _read_string(self, text: str, position: int) -> int:
+        """文字列の中身を読み進め、次の読み取り位置を返す"""
+        if self._escape:
+            self._escape = False
+            self._emit(text[position])
+            if self._key_chars is not None:
+                self._key_chars.append(text[position])
+            return position + 1
+
+        match = self._STRING_SPECIAL.search(text, position)
+        end = match.start() + 1 if match else len(text)
+        segment = text[position:end]
+        self._emit(segment)
+        if match is None:
+            if self._key_chars is not None:
+                self._key_chars.append(segment)
+            return end
+
+        if match.group() == "\\":
+            self._escape = True
+            if self._key_chars is not None:
+                self._key_chars.append(segment)
+        else:
+            self._in_string = False
+            if self._key_chars is not None:
+                self._key_chars.append(segment[:-1])
+                self._last_key = "".join(self._key_chars)
+                self._key_chars = None
+        return end
+
+    def _emit(self, segment: str) -> None:
+        self._document_parts.append(segment)
+        if self._action_parts is not None:
+            self._action_parts.append(segment)
+
+    @staticmethod
+    def _decode(text: str) -> Any:
+        try:
+            return json.loads(text)
+        except ValueError:
+            return None
+
+    def _close_document(self) -> None:
+        """トップレベルのオブジェクトが閉じた（actionsを含まなければ次のオブジェクトを探す）"""
+        document = self._decode("".join(self._document_parts))
+        self._document_parts = []
+        if isinstance(document, dict) and "actions" in document:
+            self.document = document
+            return
+        if self.actions:
+            # 全体は壊れていても、送出済みのアクションはそのまま結果として扱う
+            self.document = {"actions": self.actions}
+            return
+        self._last_key = None
+        self._awaiting_array = False
+        self._actions_level = None
+
+
 def parse_agent_response(response_text: str, context: dict) -> dict:
     """Agent modeのレスポンスを解析（簡潔版）"""
-    import re
-
     try:
-        # JSONブロックを抽出（```json ... ```またはJSONオブジェクトのみ）
-        json_match = re.search(r'```json\s*(\{[\s\S]*?\})\s*```', response_text)
-        if not json_match:
-            json_match = re.search(r'(\{[\s\S]*?"actions"[\s\S]*?\})', response_text)
-
-        if json_match:
-            json_str = json_match.group(1) if len(json_match.groups()) > 0 else json_match.group(0)
-            # コメント除去（//で始まる行）
-            json_str = re.sub(r'//.*', '', json_str)
-            parsed = json.loads(json_str)
+        # actionsを含むJSONオブジェクトを抽出（コードフェンス・前後の説明文・//コメントは読み飛ばす）
+        parser = AgentResponseStreamParser()
+        parser.feed(response_text)
+        parsed = parser.document
 
+        if parsed is not None:
             return {
                 "actions": parsed.get("actions", []),
                 "summary": str(parsed.get("summary", "操作が完了しました")),
@@ -6,18 +6,38 @@ FastAPI Routes for DiffSinger API
 このモジュールはDiffSinger APIのエンドポイントを定義します。
 """
 
+import os
+import shutil
 import time
+import uuid
 import asyncio
 from pathlib import Path
-from typing import List
+from typing import Iterator, List, Optional, Tuple
 
+import numpy as np
 from fastapi import HTTPException
-from fastapi.responses import FileResponse
-
-from models import SynthesisRequest, SynthesisResponse, ModelInfo
-from config import MOCK_MODELS
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
+
+from models import SynthesisRequest, SynthesisResponse, SynthesisJobResponse, ModelInfo, DEFAULT_OUTPUT_PATH
+from config import (
+    MOCK_MODELS,
+    SAMPLE_RATE,
+    SYNTHESIS_JOB_WORKERS,
+    SYNTHESIS_JOB_QUEUE_SIZE,
+    SYNTHESIS_JOB_MAX_PER_CLIENT,
+    SYNTHESIS_JOB_RETENTION_SEC,
+    SYNTHESIS_JOB_RETRY_AFTER_SEC
+)
 from audio_synthesis import synthesize_audio
+from audio_processing import create_wav_header
+from musical_synthesis import iter_musical_vocal_segments, musical_vocals_sample_count
+from ssml_generator import convert_lyrics_to_japanese_phonetics
 from edge_tts_handler import EDGE_TTS_AVAILABLE
+from synthesis_cache import synthesis_cache, make_synthesis_cache_key
+from synthesis_executor import synthesis_executor
+from single_flight import synthesis_flights
+from synthesis_jobs import SynthesisJobManager, JobQueueFullError, ProgressCallback
 
 # グローバル状態（将来的には状態管理クラスに移行予定）
 # Note: この変数はconfig.pyから参照されていますが、APIルートで更新されるためここに配置
@@ -69,65 +89,184 @@ async def load_model_route(model_id: str):
     }
 
 
-async def synthesize_route(request: SynthesisRequest) -> SynthesisResponse:
+def parse_synthesis_request(request: SynthesisRequest) -> Tuple[List[str], List[float]]:
     """
-    音声合成エンドポイント
+    合成リクエストのノート・デュレーション文字列を分解して検証
 
     Args:
         request: 合成リクエスト
 
     Returns:
-        SynthesisResponse: 合成結果
+        Tuple[List[str], List[float]]: (ノート名リスト, デュレーションリスト)
 
     Raises:
-        HTTPException: 入力が不正な場合、または合成に失敗した場合
+        ValueError: デュレーションが数値でない場合
+        HTTPException: ノート数とデュレーション数が一致しない場合
+    """
+    notes_list = [note.strip() for note in request.notes.split('|')]
+    durations_list = [float(dur.strip()) for dur in request.durations.split('|')]
+
+    if len(notes_list) != len(durations_list):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Notes count ({len(notes_list)}) must match durations count ({len(durations_list)})"
+        )
+
+    return notes_list, durations_list
+
+
+def deliver_to_output_path(audio_path: str, request: SynthesisRequest) -> str:
+    """
+    合成結果をリクエストの出力パスに置く
+
+    出力パスを省略したリクエストにはキャッシュファイルのパスをそのまま返す（LRUで削除されうる）。
+    出力パスを指定したリクエストには、キャッシュファイルをハードリンク（不可ならコピー）して、
+    キャッシュから削除されても残るファイルを指定のパスに置く。
+
+    Args:
+        audio_path: 合成結果（キャッシュファイルまたは別リクエストの出力）のパス
+        request: 合成リクエスト
+
+    Returns:
+        str: レスポンスで返す音声ファイルのパス
     """
+    if request.output_path == DEFAULT_OUTPUT_PATH:
+        return audio_path
+
+    output_path = Path(request.output_path)
+    source_path = Path(audio_path)
+    if not source_path.exists() or source_path.resolve() == output_path.resolve():
+        return audio_path
+
+    # 一時ファイルを経由して置き換え、既存の出力（別のキャッシュファイルへのリンクを含む）に書き込まないようにする
+    temp_path = output_path.with_name(f".{output_path.name}.{uuid.uuid4().hex[:8]}.tmp")
     try:
-        print(f"[API Route] Synthesis request received:")
-        print(f"  Lyrics: {request.lyrics}")
-        print(f"  Notes: {request.notes}")
-        print(f"  Durations: {request.durations}")
-        print(f"  Current model: {config.current_model}")
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(source_path, temp_path)
+        except OSError:
+            shutil.copyfile(source_path, temp_path)
+        os.replace(temp_path, output_path)
+    except OSError as e:
+        print(f"[API Route] Failed to place result at {output_path}: {e}")
+        temp_path.unlink(missing_ok=True)
+        return audio_path
+    return str(output_path)
+
+
+async def run_synthesis(
+    request: SynthesisRequest,
+    model_id: str,
+    progress_callback: Optional[ProgressCallback] = None
+) -> SynthesisResponse:
+    """
+    合成処理本体（同期エンドポイントと非同期ジョブで共有）
 
-        # 入力検証
-        notes_list = [note.strip() for note in request.notes.split('|')]
-        durations_list = [float(dur.strip()) for dur in request.durations.split('|')]
+    Args:
+        request: 合成リクエスト
+        model_id: 使用するモデルID
+        progress_callback: 進捗通知関数（進捗 0.0〜1.0, メッセージ）
 
-        if len(notes_list) != len(durations_list):
-            raise HTTPException(
-                status_code=400,
-                detail=f"Notes count ({len(notes_list)}) must match durations count ({len(durations_list)})"
-            )
+    Returns:
+        SynthesisResponse: 合成結果
 
-        # 総再生時間計算
-        total_duration = sum(durations_list)
+    Raises:
+        ValueError: デュレーションが数値でない場合
+        HTTPException: ノート数とデュレーション数が一致しない場合
+    """
+    print(f"[API Route] Synthesis request received:")
+    print(f"  Lyrics: {request.lyrics}")
+    print(f"  Notes: {request.notes}")
+    print(f"  Durations: {request.durations}")
+    print(f"  Current model: {model_id}")
+
+    # 入力検証
+    notes_list, durations_list = parse_synthesis_request(request)
+
+    # 総再生時間計算
+    total_duration = sum(durations_list)
+
+    # キャッシュ確認（同一リクエスト・同一モデルなら合成をスキップ）
+    cache_key = make_synthesis_cache_key(
+        request.lyrics,
+        notes_list,
+        durations_list,
+        model_id
+    )
+    cached_path = synthesis_cache.get(cache_key)
+    if cached_path:
+        print(f"[API Route] Cache hit: {cached_path}")
+        return SynthesisResponse(
+            status="success",
+            message=f"Enhanced synthesis served from cache for '{request.lyrics}' ({len(notes_list)} notes)",
+            audio_path=deliver_to_output_path(cached_path, request),
+            duration=total_duration
+        )
 
+    async def render(report_progress: Optional[ProgressCallback]) -> SynthesisResponse:
         # 出力ディレクトリ作成
         output_path = Path(request.output_path)
         output_path.parent.mkdir(parents=True, exist_ok=True)
 
+        # キャッシュ有効時はキャッシュディレクトリに直接合成し、登録時に移動する（同じWAVを2つ持たない）
+        render_path = synthesis_cache.render_path(cache_key)
+
         # 音声合成を実行
         synthesis_success, engine_info = await synthesize_audio(
             request.lyrics,
             notes_list,
             durations_list,
-            str(output_path),
-            config.current_model
+            render_path or str(output_path),
+            model_id,
+            progress_callback=report_progress
         )
 
+        audio_path = str(output_path)
+        if render_path is not None:
+            # 正常に合成できた結果のみキャッシュ（フォールバック結果は固定化しない）
+            cached_path = synthesis_cache.put(cache_key, render_path, move=True) if synthesis_success else None
+            if cached_path:
+                audio_path = cached_path
+            elif Path(render_path).exists():
+                # キャッシュしない結果は従来どおりリクエストの出力パスに置く
+                Path(render_path).replace(output_path)
+
         return SynthesisResponse(
             status="success",
             message=f"Enhanced synthesis completed using {engine_info} for '{request.lyrics}' ({len(notes_list)} notes)",
-            audio_path=str(output_path),
+            audio_path=audio_path,
             duration=total_duration
         )
 
+    # 同じリクエストが合成中であれば、その結果を待って共有する（出力パスを指定したリクエストにはそこへ置く）
+    response = await synthesis_flights.run(cache_key, render, progress_callback)
+    return response.model_copy(update={"audio_path": deliver_to_output_path(response.audio_path, request)})
+
+
+async def synthesize_route(request: SynthesisRequest) -> SynthesisResponse:
+    """
+    音声合成エンドポイント
+
+    Args:
+        request: 合成リクエスト
+
+    Returns:
+        SynthesisResponse: 合成結果
+
+    Raises:
+        HTTPException: 入力が不正な場合、または合成に失敗した場合
+    """
+    try:
+        return await run_synthesis(request, config.current_model)
+
     except ValueError as e:
         print(f"[API Route] Input error: {e}")
         raise HTTPException(
             status_code=400,
             detail=f"Invalid input: {str(e)}"
         )
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"[API Route] Synthesis error: {e}")
         raise HTTPException(
@@ -136,23 +275,154 @@ async def synthesize_route(request: SynthesisRequest) -> SynthesisResponse:
         )
 
 
+# 非同期合成ジョブ管理（ワーカーはアプリ起動時に開始）
+synthesis_job_manager = SynthesisJobManager(
+    run_synthesis,
+    num_workers=SYNTHESIS_JOB_WORKERS,
+    max_queue_size=SYNTHESIS_JOB_QUEUE_SIZE,
+    max_jobs_per_client=SYNTHESIS_JOB_MAX_PER_CLIENT,
+    retention_sec=SYNTHESIS_JOB_RETENTION_SEC,
+    retry_after_sec=SYNTHESIS_JOB_RETRY_AFTER_SEC
+)
+
+
+async def submit_synthesis_job_route(request: SynthesisRequest, client_id: str) -> SynthesisJobResponse:
+    """
+    非同期音声合成ジョブ投入エンドポイント
+
+    合成の完了を待たずにrequest_idを返します。進捗は GET /api/synthesize/{request_id} で取得します。
+
+    Args:
+        request: 合成リクエスト
+        client_id: クライアント識別子（クライアントごとの上限判定に使用）
+
+    Returns:
+        SynthesisJobResponse: 投入されたジョブの情報
+
+    Raises:
+        HTTPException: 入力が不正な場合、またはキューが満杯の場合（429/503）
+    """
+    try:
+        # 入力エラーはキュー投入前に即時返す
+        parse_synthesis_request(request)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid input: {str(e)}"
+        )
+
+    try:
+        job = await synthesis_job_manager.submit(request, client_id, config.current_model)
+    except JobQueueFullError as e:
+        print(f"[API Route] Synthesis job rejected for {client_id}: {e}")
+        raise HTTPException(
+            status_code=429 if e.per_client else 503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+    return SynthesisJobResponse(
+        request_id=job.request_id,
+        status=job.status,
+        queue_position=synthesis_job_manager.queue_position(job.request_id),
+        status_url=f"/api/synthesize/{job.request_id}"
+    )
+
+
+async def synthesize_stream_route(request: SynthesisRequest) -> StreamingResponse:
+    """
+    ストリーミング音声合成エンドポイント
+
+    ノート単位で音楽的合成を行い、WAV（16-bit PCM モノラル）をチャンク転送します。
+    ヘッダーは総サンプル数から先に確定させるため、最初のノートが完成した時点で再生を開始できます。
+    最初のノートの生成までにかかった時間を X-Time-To-First-Audio-Ms ヘッダーで返します。
+
+    Args:
+        request: 合成リクエスト
+
+    Returns:
+        StreamingResponse: WAVストリーム
+
+    Raises:
+        HTTPException: 入力が不正な場合、または合成に失敗した場合
+    """
+    start_time = time.perf_counter()
+    try:
+        print(f"[API Route] Streaming synthesis request received:")
+        print(f"  Lyrics: {request.lyrics}")
+        print(f"  Notes: {request.notes}")
+        print(f"  Durations: {request.durations}")
+
+        notes_list, durations_list = parse_synthesis_request(request)
+        japanese_lyrics = await convert_lyrics_to_japanese_phonetics(request.lyrics)
+
+        total_samples = musical_vocals_sample_count(durations_list)
+        segments = iter_musical_vocal_segments(japanese_lyrics, notes_list, durations_list)
+
+        # 最初のノートはヘッダー送信前に生成し、失敗時は通常のエラーレスポンスを返す
+        # （合成はCPU負荷が高いため、イベントループを塞がないようスレッドプールで回す）
+        first_segment = await run_in_threadpool(next, segments, None)
+        if first_segment is None:
+            raise ValueError("No notes to synthesize")
+        time_to_first_audio_ms = (time.perf_counter() - start_time) * 1000
+        print(f"[API Route] First note ready in {time_to_first_audio_ms:.1f} ms")
+
+    except ValueError as e:
+        print(f"[API Route] Input error: {e}")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid input: {str(e)}"
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"[API Route] Streaming synthesis error: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Synthesis failed: {str(e)}"
+        )
+
+    def wav_stream() -> Iterator[bytes]:
+        # 同期ジェネレーターはStarletteがスレッドプールで反復するため、イベントループを塞がない
+        yield create_wav_header(total_samples, SAMPLE_RATE)
+        yield (first_segment * 32767).astype(np.int16).tobytes()
+        for segment in segments:
+            yield (segment * 32767).astype(np.int16).tobytes()
+        total_ms = (time.perf_counter() - start_time) * 1000
+        print(f"[API Route] Streaming synthesis completed in {total_ms:.1f} ms ({len(notes_list)} notes)")
+
+    return StreamingResponse(
+        wav_stream(),
+        media_type="audio/wav",
+        headers={
+            "X-Time-To-First-Audio-Ms": f"{time_to_first_audio_ms:.1f}",
+            "X-Audio-Duration": f"{total_samples / SAMPLE_RATE:.3f}",
+            "X-Sample-Rate": str(SAMPLE_RATE),
+            "Cache-Control": "no-cache"
+        }
+    )
+
+
 async def get_synthesis_status_route(request_id: str):
     """
-    合成ステータス取得（将来の非同期処理用）
+    合成ステータス取得
 
     Args:
-        request_id: リクエストID
+        request_id: submit_synthesis_job_route が返したリクエストID
 
     Returns:
-        dict: 合成ステータス
+        dict: 合成ステータス（status, progress, queue_position, 完了時は audio_path）
+
+    Raises:
+        HTTPException: ジョブが見つからない場合（保持期間切れを含む）
     """
-    return {
-        "request_id": request_id,
-        "status": "completed",
-        "progress": 100,
-        "message": "Enhanced musical synthesis completed",
-        "engine": "Musical Synthesis"
-    }
+    status = synthesis_job_manager.status(request_id)
+    if status is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Synthesis job {request_id} not found"
+        )
+    return status
 
 
 async def serve_generated_audio_route(filename: str):
@@ -215,5 +485,9 @@ def health_route():
         "version": "2.0.0",
         "current_model": config.current_model,
         "edge_tts_available": EDGE_TTS_AVAILABLE,
+        "synthesis_cache": synthesis_cache.stats(),
+        "synthesis_jobs": synthesis_job_manager.stats(),
+        "synthesis_executor": synthesis_executor.stats(),
+        "synthesis_coalescing": synthesis_flights.stats(),
         "timestamp": time.time()
     }
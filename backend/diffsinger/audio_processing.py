@@ -16,7 +16,8 @@ from config import (
     FEMINIZATION_BOOST_RATIO,
     VIBRATO_FREQUENCY_HZ,
     VIBRATO_DEPTH_PERCENT,
-    WAVEFORM_NORMALIZATION_LEVEL
+    WAVEFORM_NORMALIZATION_LEVEL,
+    WAV_WRITE_CHUNK_SAMPLES
 )
 
 # Pydub import for audio format conversion
@@ -80,6 +81,42 @@ def convert_mp3_to_wav(mp3_path: str, wav_path: str) -> bool:
             return False
 
 
+def remap_fft_bins(spectrum: np.ndarray, ratio: float) -> np.ndarray:
+    """
+    FFTビンを比率に従って再配置（ビン j を int(j * ratio) へ移動）
+
+    ビンごとのPythonループと同一の結果を、NumPyのインデックス演算で求めます。
+    比率が1未満の場合は複数のビンが同じ位置に写像されますが、
+    ループ版と同じく最後に書き込まれたビン（最大の j）を残します。
+
+    Args:
+        spectrum: FFTスペクトル（np.fft.fft の出力）
+        ratio: ピッチシフト比率
+
+    Returns:
+        np.ndarray: 再配置後のスペクトル
+    """
+    num_bins = len(spectrum)
+    source = np.arange(num_bins)
+    target = (source * ratio).astype(np.int64)
+
+    valid = (target >= 0) & (target < num_bins)
+    source = source[valid]
+    target = target[valid]
+
+    # target は j に対して単調非減少なので、同じ値が連続する区間の末尾だけを残す
+    if len(target) > 1:
+        is_last = np.empty(len(target), dtype=bool)
+        is_last[:-1] = target[1:] != target[:-1]
+        is_last[-1] = True
+        source = source[is_last]
+        target = target[is_last]
+
+    shifted = np.zeros_like(spectrum)
+    shifted[target] = spectrum[source]
+    return shifted
+
+
 def apply_pitch_time_control(
     input_audio_path: str,
     output_audio_path: str,
@@ -190,14 +227,7 @@ def apply_pitch_time_control(
                 if abs(pitch_shift_ratio - 1.0) > 0.05:  # 5%以上の変更時のみ適用
                     # セグメント用FFTベースのピッチシフト
                     segment_fft = np.fft.fft(segment)
-                    segment_freqs = np.fft.fftfreq(len(segment), 1/frame_rate)
-
-                    # ピッチシフトを適用
-                    shifted_segment_fft = np.zeros_like(segment_fft)
-                    for j, freq in enumerate(segment_freqs):
-                        new_freq_idx = int(j * pitch_shift_ratio)
-                        if 0 <= new_freq_idx < len(shifted_segment_fft):
-                            shifted_segment_fft[new_freq_idx] = segment_fft[j]
+                    shifted_segment_fft = remap_fft_bins(segment_fft, pitch_shift_ratio)
 
                     # 修正されたセグメントを戻す
                     modified_segment = np.real(np.fft.ifft(shifted_segment_fft))
@@ -210,13 +240,7 @@ def apply_pitch_time_control(
 
         # 女性らしさの向上（バランス版）
         fft_data = np.fft.fft(audio_data)
-        freqs = np.fft.fftfreq(len(audio_data), 1/frame_rate)
-
-        shifted_fft = np.zeros_like(fft_data)
-        for i, freq in enumerate(freqs):
-            new_freq_idx = int(i * FEMINIZATION_BOOST_RATIO)
-            if 0 <= new_freq_idx < len(shifted_fft):
-                shifted_fft[new_freq_idx] = fft_data[i]
+        shifted_fft = remap_fft_bins(fft_data, FEMINIZATION_BOOST_RATIO)
 
         audio_data = np.real(np.fft.ifft(shifted_fft))
         print(f"[Note Keep Pipeline] Applied balanced feminization boost: {FEMINIZATION_BOOST_RATIO}x")
@@ -283,10 +307,51 @@ def apply_pitch_time_control(
         return False
 
 
+def create_wav_header(num_samples: int, sample_rate: int = 44100, channels: int = 1, bits_per_sample: int = 16) -> bytes:
+    """
+    PCM WAVヘッダー（44バイト）を生成
+
+    ストリーミング配信のように、データ本体より先にヘッダーを送る場合に使用します。
+
+    Args:
+        num_samples: サンプル数（チャンネルあたり）
+        sample_rate: サンプリングレート
+        channels: チャンネル数
+        bits_per_sample: 量子化ビット数
+
+    Returns:
+        bytes: WAVヘッダー
+    """
+    block_align = channels * bits_per_sample // 8
+    data_size = num_samples * block_align
+
+    header = bytearray()
+    # RIFFヘッダー
+    header += b'RIFF'
+    header += (36 + data_size).to_bytes(4, 'little')
+    header += b'WAVE'
+    # fmtチャンク
+    header += b'fmt '
+    header += (16).to_bytes(4, 'little')
+    header += (1).to_bytes(2, 'little')  # PCM
+    header += channels.to_bytes(2, 'little')
+    header += sample_rate.to_bytes(4, 'little')
+    header += (sample_rate * block_align).to_bytes(4, 'little')
+    header += block_align.to_bytes(2, 'little')
+    header += bits_per_sample.to_bytes(2, 'little')
+    # dataチャンク
+    header += b'data'
+    header += data_size.to_bytes(4, 'little')
+    return bytes(header)
+
+
 def save_musical_audio(waveform: np.ndarray, output_path: str, sample_rate: int = 44100) -> bool:
     """
     音楽的波形をWAVファイルとして保存
 
+    16-bit PCMへの変換は WAV_WRITE_CHUNK_SAMPLES ごとに使い回すバッファ上で行うため、
+    波形全体のコピーは作りません（入力波形も変更しません）。
+
     Args:
         waveform: 音声波形データ（NumPy配列）
         output_path: 出力WAVファイルパス
@@ -296,14 +361,22 @@ def save_musical_audio(waveform: np.ndarray, output_path: str, sample_rate: int
         bool: 保存成功時True、失敗時False
     """
     try:
-        # 16-bit PCM形式で保存
-        waveform_16bit = (waveform * 32767).astype(np.int16)
+        chunk_size = max(1, min(WAV_WRITE_CHUNK_SAMPLES, len(waveform)))
+        scaled = np.empty(chunk_size, dtype=np.float32)
+        waveform_16bit = np.empty(chunk_size, dtype=np.int16)
 
         with wave.open(output_path, 'w') as wav_file:
             wav_file.setnchannels(1)  # モノラル
             wav_file.setsampwidth(2)  # 16-bit
             wav_file.setframerate(sample_rate)
-            wav_file.writeframes(waveform_16bit.tobytes())
+
+            # 16-bit PCM形式で保存（チャンクごとに変換して書き込み）
+            for start in range(0, len(waveform), chunk_size):
+                chunk = waveform[start:start + chunk_size]
+                count = len(chunk)
+                np.multiply(chunk, 32767, out=scaled[:count], casting='unsafe')
+                np.copyto(waveform_16bit[:count], scaled[:count], casting='unsafe')
+                wav_file.writeframesraw(waveform_16bit[:count])
 
         print(f"[Musical] Saved audio: {output_path}")
         return True
@@ -7,7 +7,7 @@ Audio Synthesis Integration Module for DiffSinger
 """
 
 from pathlib import Path
-from typing import List, Tuple
+from typing import Callable, List, Optional, Tuple
 
 from config import SYNTHESIS_MODE
 from edge_tts_handler import (
@@ -16,8 +16,10 @@ from edge_tts_handler import (
 )
 from musical_synthesis import create_musical_vocals, create_mathematical_audio_fallback
 from audio_processing import apply_pitch_time_control
+from phase_vocoder import phase_vocoder_pitch_time_control
 from midi_utils import midi_note_to_frequency
 from ssml_generator import convert_lyrics_to_japanese_phonetics
+from synthesis_executor import synthesis_executor
 
 
 async def synthesize_audio(
@@ -25,24 +27,34 @@ async def synthesize_audio(
     notes_list: List[str],
     durations_list: List[float],
     output_path: str,
-    current_model: str
+    current_model: str,
+    progress_callback: Optional[Callable[[float, str], None]] = None
 ) -> Tuple[bool, str]:
     """
     複数の合成手法を統合した音声合成
 
+    CPU負荷の高い段階（音楽的合成・ピッチ後処理・数学的合成）はプロセスプールで実行し、
+    イベントループを塞がないようにします。
+
     Args:
         lyrics: 歌詞テキスト
         notes_list: MIDIノート名のリスト
         durations_list: デュレーションのリスト（秒）
         output_path: 出力WAVファイルパス
         current_model: 使用するモデル名
+        progress_callback: 進捗通知関数（進捗 0.0〜1.0, メッセージ）
 
     Returns:
         Tuple[bool, str]: (合成成功フラグ, エンジン情報文字列)
     """
+    def report_progress(progress: float, message: str) -> None:
+        if progress_callback is not None:
+            progress_callback(progress, message)
+
     # 歌詞を日本語発音に最適化
     japanese_lyrics = await convert_lyrics_to_japanese_phonetics(lyrics)
     print(f"[Audio Synthesis] Converted lyrics: '{lyrics}' -> '{japanese_lyrics}'")
+    report_progress(0.1, "Lyrics converted")
 
     synthesis_success = False
     engine_info = "Unknown"
@@ -50,9 +62,15 @@ async def synthesize_audio(
 
     print(f"[Audio Synthesis] Synthesis mode: {SYNTHESIS_MODE}")
 
-    # シーケンシャルパイプライン方式（edge_tts_post モード）
-    if SYNTHESIS_MODE == "edge_tts_post" and EDGE_TTS_AVAILABLE and current_model.startswith("edge_tts_"):
-        print(f"[Audio Synthesis] Using Sequential Pipeline: Edge TTS + Post-processing")
+    # シーケンシャルパイプライン方式（edge_tts_post / edge_tts_vocoder モード）
+    if SYNTHESIS_MODE in ("edge_tts_post", "edge_tts_vocoder") and EDGE_TTS_AVAILABLE and current_model.startswith("edge_tts_"):
+        if SYNTHESIS_MODE == "edge_tts_vocoder":
+            post_processor = phase_vocoder_pitch_time_control
+            post_processor_name = "Phase Vocoder"
+        else:
+            post_processor = apply_pitch_time_control
+            post_processor_name = "Post-processing"
+        print(f"[Audio Synthesis] Using Sequential Pipeline: Edge TTS + {post_processor_name}")
         try:
             # Step 1: Edge TTSで基本音声生成
             temp_edge_output = str(output_path).replace(".wav", "_temp_edge.wav")
@@ -66,10 +84,12 @@ async def synthesize_audio(
 
             if edge_success and Path(temp_edge_output).exists():
                 print(f"[Audio Synthesis] Edge TTS step completed, applying post-processing...")
+                report_progress(0.5, "Edge TTS completed, applying post-processing")
 
                 # Step 2: 音階と音長の後処理を適用
                 target_frequencies = [midi_note_to_frequency(note) for note in notes_list]
-                post_success = apply_pitch_time_control(
+                post_success = await synthesis_executor.run(
+                    post_processor,
                     temp_edge_output,
                     str(output_path),
                     target_frequencies,
@@ -78,7 +98,7 @@ async def synthesize_audio(
 
                 if post_success:
                     synthesis_success = True
-                    engine_info = f"Sequential Pipeline (Edge TTS + Post-processing)"
+                    engine_info = f"Sequential Pipeline (Edge TTS + {post_processor_name})"
                     print(f"[Audio Synthesis] Sequential pipeline completed successfully")
 
                 # 一時ファイルを削除
@@ -116,8 +136,10 @@ async def synthesize_audio(
     if not synthesis_success:
         # 優先順位1: 新しい音楽的合成システム（正確な音階・音長制御）
         print(f"[Audio Synthesis] Using Musical Synthesis System for accurate pitch and duration control")
+        report_progress(0.2, "Running musical synthesis")
         try:
-            success = create_musical_vocals(
+            success = await synthesis_executor.run(
+                create_musical_vocals,
                 japanese_lyrics,
                 notes_list,
                 durations_list,
@@ -137,6 +159,7 @@ async def synthesize_audio(
         # 優先順位2: Edge TTS（音楽的合成失敗時のフォールバック）
         if not synthesis_success and EDGE_TTS_AVAILABLE and current_model.startswith("edge_tts_"):
             print(f"[Audio Synthesis] Fallback to Edge TTS: {current_model}")
+            report_progress(0.5, "Musical synthesis failed, falling back to Edge TTS")
             try:
                 success = await generate_edge_tts_with_pitch_control(
                     japanese_lyrics,
@@ -160,7 +183,8 @@ async def synthesize_audio(
     if not synthesis_success:
         print(f"[Audio Synthesis] Using improved musical synthesis system as fallback...")
         try:
-            success = create_musical_vocals(
+            success = await synthesis_executor.run(
+                create_musical_vocals,
                 japanese_lyrics,
                 notes_list,
                 durations_list,
@@ -179,7 +203,8 @@ async def synthesize_audio(
 
     # 最終フォールバック：数学的合成
     if not synthesis_success:
-        create_mathematical_audio_fallback(
+        await synthesis_executor.run(
+            create_mathematical_audio_fallback,
             japanese_lyrics,
             notes_list,
             durations_list,
@@ -190,4 +215,5 @@ async def synthesize_audio(
         print(f"[Audio Synthesis] Mathematical synthesis completed")
 
     print(f"[Audio Synthesis] Output file: {output_path}")
+    report_progress(1.0, f"Synthesis completed using {engine_info}")
     return synthesis_success, engine_info
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ノート波形キャッシュのベンチマーク
+
+繰り返しフレーズを含む曲（かえるのうたを輪唱で3回）の全ノート波形生成について、
+キャッシュなし・キャッシュあり（空の状態から開始）・キャッシュあり（再合成）の時間を比較し、
+同じノートでもノイズによって毎回異なる波形になることを確認します。
+
+使用方法:
+    python benchmark_musical_tone.py
+"""
+import sys
+import io
+import os
+import time
+
+import numpy as np
+
+# Windows環境でUTF-8出力を強制
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from config import NATURAL_NOISE_LEVEL
+from musical_synthesis import iter_musical_vocal_segments, musical_tone_cache
+
+# かえるのうた（繰り返しフレーズが多い曲を3回）
+VERSE_LYRICS = "かえるのうたがきこえてくるよくわくわくわくわけけけけけけけけくわくわくわ"
+VERSE_NOTES = (
+    ["C4", "D4", "E4", "F4", "E4", "D4", "C4"]
+    + ["E4", "F4", "G4", "A4", "G4", "F4", "E4"]
+    + ["C4", "C4", "C4", "C4"] * 2
+    + ["C4", "C4", "D4", "D4", "E4", "E4", "F4", "F4"]
+    + ["E4", "D4", "C4"] * 2
+)
+VERSES = 3
+LYRICS = VERSE_LYRICS * VERSES
+NOTES = VERSE_NOTES * VERSES
+DURATIONS = [0.5] * len(NOTES)
+REPEATS = 3
+
+
+def render_song() -> list:
+    """全ノートの波形を生成（ノートごとのログ出力は抑制）"""
+    real_stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        return list(iter_musical_vocal_segments(LYRICS, NOTES, DURATIONS))
+    finally:
+        sys.stdout = real_stdout
+
+
+def best_time(enabled: bool, warm: bool = False) -> float:
+    """REPEATS回のうち最短時間（warm=Falseならキャッシュは毎回空から開始）"""
+    best = float("inf")
+    musical_tone_cache.enabled = enabled
+    for _ in range(REPEATS):
+        if not warm:
+            musical_tone_cache.clear()
+        start = time.perf_counter()
+        render_song()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark():
+    print("=" * 70)
+    print(f"Musical tone cache benchmark ({len(NOTES)} notes)")
+    print("=" * 70)
+
+    uncached = best_time(enabled=False)
+    cold = best_time(enabled=True)
+    cold_entries = musical_tone_cache.stats()["entries"]
+    warm = best_time(enabled=True, warm=True)
+    print(f"[BENCH] uncached {uncached * 1000:8.1f} ms | "
+          f"cached (cold) {cold * 1000:8.1f} ms ({uncached / cold:4.1f}x) | "
+          f"cached (warm) {warm * 1000:8.1f} ms ({uncached / warm:4.1f}x)")
+    print(f"[BENCH] distinct notes rendered: {cold_entries} | cache stats: {musical_tone_cache.stats()}")
+
+    # 同じノート（先頭の「か」C4 と 最後から3つ目の C4）は同じ波形＋別々のノイズ
+    segments = render_song()
+    first, repeated = segments[0], segments[6]
+    difference = first - repeated
+    print(f"[BENCH] repeated note differs: {not np.array_equal(first, repeated)} | "
+          f"difference std {difference.std():.5f} (noise level {NATURAL_NOISE_LEVEL} x sqrt(2))")
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ノート波形レンダリング（オシレーターバンク）のマイクロベンチマーク
+
+render_musical_tone の旧実装（パーシャルごとにfloat64でnp.sinを全長計算）と、
+float32のブロック型オシレーターバンクを使う現在の実装について、
+1ノートあたりの時間・ピークメモリ・出力の最大誤差を比較します。
+エンベロープは長さごとにメモ化されるため、現在の実装の値はメモ化済みの状態での計測です。
+
+使用方法:
+    python benchmark_oscillator.py
+"""
+import sys
+import io
+import os
+import time
+import tracemalloc
+
+import numpy as np
+
+# Windows環境でUTF-8出力を強制
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from config import (
+    SAMPLE_RATE,
+    PHONEME_HARMONICS,
+    FORMANT_FREQUENCIES,
+    ATTACK_TIME,
+    DECAY_TIME,
+    SUSTAIN_LEVEL,
+    RELEASE_TIME,
+    WAVEFORM_NORMALIZATION_LEVEL
+)
+from musical_synthesis import render_musical_tone
+
+# (周波数, 秒数, 音素)
+NOTES = [(261.63, 0.5, "a"), (440.0, 1.0, "i"), (880.0, 2.0, "o"), (1760.0, 4.0, "e")]
+REPEATS = 5
+
+
+def render_musical_tone_legacy(frequency: float, num_samples: int, phoneme: str = "a") -> np.ndarray:
+    """旧実装（パーシャルごとにfloat64で全長のnp.sinを計算。出力に使われないビブラート計算は除く）"""
+    t = np.arange(num_samples) / SAMPLE_RATE
+    harmonics = PHONEME_HARMONICS.get(phoneme, PHONEME_HARMONICS['a'])
+    formants = FORMANT_FREQUENCIES.get(phoneme, FORMANT_FREQUENCIES['a'])
+
+    waveform = np.zeros_like(t)
+    for i, amplitude in enumerate(harmonics):
+        harmonic_freq = frequency * (i + 1)
+        if harmonic_freq < SAMPLE_RATE / 2:
+            waveform += amplitude * np.sin(2 * np.pi * harmonic_freq * t)
+    for formant_freq in formants:
+        if formant_freq < SAMPLE_RATE / 2:
+            waveform += 0.3 * np.sin(2 * np.pi * formant_freq * t) * np.exp(-t * 2)
+
+    envelope = np.ones_like(t)
+    attack_samples = int(ATTACK_TIME * SAMPLE_RATE)
+    decay_samples = int(DECAY_TIME * SAMPLE_RATE)
+    release_samples = int(RELEASE_TIME * SAMPLE_RATE)
+    if len(envelope) > attack_samples:
+        envelope[:attack_samples] = np.sin(np.linspace(0, np.pi/2, attack_samples))**2
+    if len(envelope) > attack_samples + decay_samples:
+        envelope[attack_samples:attack_samples + decay_samples] = np.linspace(1, SUSTAIN_LEVEL, decay_samples)
+    if len(envelope) > release_samples:
+        envelope[-release_samples:] = SUSTAIN_LEVEL * np.sin(np.linspace(np.pi/2, 0, release_samples))**2
+    envelope *= 1 + 0.02 * np.sin(2 * np.pi * 0.5 * t)
+
+    waveform *= envelope
+    if np.max(np.abs(waveform)) > 0:
+        waveform *= WAVEFORM_NORMALIZATION_LEVEL / np.max(np.abs(waveform))
+    return waveform
+
+
+def best_time(func, *args):
+    """REPEATS回実行した最短時間と最後の結果を返す"""
+    best = float("inf")
+    result = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def peak_memory(func, *args) -> int:
+    """1回の呼び出しで確保されたメモリのピーク（バイト）"""
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def benchmark():
+    """ノートごとに旧実装とオシレーターバンクを比較"""
+    print("=" * 70)
+    print("Note rendering benchmark (float64 per-partial vs float32 oscillator bank)")
+    print("=" * 70)
+
+    for frequency, seconds, phoneme in NOTES:
+        num_samples = int(SAMPLE_RATE * seconds)
+        legacy_time, expected = best_time(render_musical_tone_legacy, frequency, num_samples, phoneme)
+        bank_time, actual = best_time(render_musical_tone, frequency, num_samples, phoneme)
+        legacy_bytes = peak_memory(render_musical_tone_legacy, frequency, num_samples, phoneme)
+        bank_bytes = peak_memory(render_musical_tone, frequency, num_samples, phoneme)
+
+        max_error = float(np.max(np.abs(expected - actual)))
+        print(f"[BENCH] {frequency:7.2f}Hz {seconds:3.1f}s '{phoneme}': "
+              f"legacy {legacy_time * 1000:6.2f} ms / {legacy_bytes / 1024:6.0f} KiB | "
+              f"bank {bank_time * 1000:5.2f} ms / {bank_bytes / 1024:5.0f} KiB | "
+              f"speedup {legacy_time / bank_time:4.1f}x | "
+              f"max error {max_error:.1e}")
+
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    benchmark()
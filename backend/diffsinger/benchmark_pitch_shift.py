@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+FFTビン再配置（ピッチシフト）のマイクロベンチマーク
+
+apply_pitch_time_control で使っていた旧来のPythonループ版と、
+NumPyベクトル化版 remap_fft_bins の速度を比較し、出力が一致することを確認します。
+
+使用方法:
+    python benchmark_pitch_shift.py
+"""
+import sys
+import io
+import os
+import time
+
+import numpy as np
+
+# Windows環境でUTF-8出力を強制
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from config import SAMPLE_RATE, FEMINIZATION_BOOST_RATIO
+from audio_processing import remap_fft_bins
+
+DURATIONS_SEC = [5, 30, 120]
+# 上方向（女性化ブースト）と下方向（低いノート）の両方を計測
+RATIOS = [FEMINIZATION_BOOST_RATIO, 0.75]
+REPEATS = 3
+
+
+def remap_fft_bins_loop(spectrum: np.ndarray, ratio: float) -> np.ndarray:
+    """旧実装（ビンごとのPythonループ）"""
+    shifted = np.zeros_like(spectrum)
+    for j in range(len(spectrum)):
+        new_freq_idx = int(j * ratio)
+        if 0 <= new_freq_idx < len(shifted):
+            shifted[new_freq_idx] = spectrum[j]
+    return shifted
+
+
+def best_time(func, *args):
+    """REPEATS回実行した最短時間と最後の結果を返す（初回のページフォールト等を除外）"""
+    best = float("inf")
+    result = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def benchmark():
+    """各入力長でループ版とベクトル化版を比較"""
+    print("=" * 70)
+    print("FFT bin remap benchmark (loop vs vectorized)")
+    print("=" * 70)
+
+    rng = np.random.default_rng(0)
+
+    for duration in DURATIONS_SEC:
+        audio = rng.standard_normal(SAMPLE_RATE * duration).astype(np.float32)
+        spectrum = np.fft.fft(audio)
+
+        for ratio in RATIOS:
+            loop_time, expected = best_time(remap_fft_bins_loop, spectrum, ratio)
+            vector_time, actual = best_time(remap_fft_bins, spectrum, ratio)
+
+            identical = np.array_equal(expected, actual)
+            print(f"[BENCH] {duration:>4d}s ratio={ratio:.2f}: "
+                  f"loop {loop_time * 1000:9.1f} ms | "
+                  f"vectorized {vector_time * 1000:7.1f} ms | "
+                  f"speedup {loop_time / vector_time:7.1f}x | "
+                  f"identical={identical}")
+
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    benchmark()
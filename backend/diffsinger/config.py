@@ -16,7 +16,12 @@ FEMALE_VOICE_PITCH_BOOST = 12  # +12 semitones for more feminine voice
 
 # === 合成モード設定 ===
 SYNTHESIS_MODE = "musical_first"  # 数学的合成システムに戻す
-# Options: musical_first, edge_tts_post, edge_tts_only
+# Options: musical_first, edge_tts_post, edge_tts_vocoder, edge_tts_only
+# edge_tts_vocoder: edge_tts_post の後処理をフレーム単位のフェーズボコーダーで行う（長い曲でもメモリ一定）
+
+# === フェーズボコーダー設定（edge_tts_vocoder モード） ===
+PHASE_VOCODER_FRAME_SIZE = 2048  # STFT窓長（サンプル）
+PHASE_VOCODER_HOP_SIZE = 512     # 合成ホップ長（サンプル）
 
 # === ピッチ制御設定 ===
 BASE_PITCH_MULTIPLIER = 10  # より明確な音階変化
@@ -38,6 +43,37 @@ RELEASE_TIME = 0.2   # 200ms - 自然な余韻
 WAVEFORM_NORMALIZATION_LEVEL = 0.8  # 少し大きめの音量
 NATURAL_NOISE_LEVEL = 0.001  # 微細なノイズレベル（人間らしさ）
 
+# === WAV書き出し設定 ===
+WAV_WRITE_CHUNK_SAMPLES = 65536  # 16-bit PCMへの変換と書き込みを行うチャンクのサンプル数
+
+# === ノート波形キャッシュ設定 ===
+# 同じ (周波数, 長さ, 音素) のノートはノイズを加える前の波形を再利用する（プロセスごとのLRU）
+MUSICAL_TONE_CACHE_ENABLED = True
+MUSICAL_TONE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 64MB（float32で約6分分のノート）
+MUSICAL_TONE_CACHE_FREQ_QUANTUM_HZ = 0.01        # キーにする周波数の刻み
+
+# === オシレーターバンク設定 ===
+OSCILLATOR_BLOCK_SIZE = 256  # 1ブロックのサンプル数（ブロック内の正弦波テーブル長）
+
+# === 合成結果キャッシュ設定 ===
+SYNTHESIS_CACHE_ENABLED = True
+SYNTHESIS_CACHE_DIR = "outputs"  # /api/generated/ から配信できるよう outputs/ 直下に保存
+SYNTHESIS_CACHE_MAX_BYTES = 512 * 1024 * 1024  # 512MB
+SYNTHESIS_CACHE_MAX_ENTRIES = 256
+# 同一リクエストが同時に来た場合は1回だけ合成し、結果を共有する
+SYNTHESIS_COALESCING_ENABLED = True
+
+# === 非同期合成ジョブ設定 ===
+SYNTHESIS_JOB_WORKERS = 2            # 同時に実行するジョブ数
+SYNTHESIS_JOB_QUEUE_SIZE = 32        # 待機中ジョブの最大数（超過時は503）
+SYNTHESIS_JOB_MAX_PER_CLIENT = 4     # クライアントごとの未完了ジョブの最大数（超過時は429）
+SYNTHESIS_JOB_RETENTION_SEC = 600    # 完了ジョブの状態を保持する秒数
+SYNTHESIS_JOB_RETRY_AFTER_SEC = 5    # 投入拒否時の Retry-After（秒）
+
+# === CPU処理オフロード設定 ===
+# 音楽的合成・ピッチ後処理を実行するプロセス数（同時実行数の上限）。0でプロセスプールを使わずスレッドで実行
+SYNTHESIS_PROCESS_WORKERS = 2
+
 # === CORS設定 ===
 ALLOWED_ORIGINS: List[str] = [
     "http://localhost:5173",
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DiffSinger 推論ランタイムの起動時間・常駐メモリベンチマーク（CPU）
+
+チェックポイントから構築する従来のランタイム（pytorch）と、export_inference_graph.py で書き出したグラフ
+（TorchScript / ONNX Runtime）のランタイムについて、それぞれ新しいプロセスで
+サーバーモジュールの読み込み + エンジン構築の時間、最大常駐メモリ、カエルの歌の推論時間を比較します。
+
+使用方法:
+    python export_inference_graph.py --format torchscript --output exported/acoustic_ts
+    python export_inference_graph.py --format onnx --output exported/acoustic_onnx
+    python benchmark_exported_runtime.py exported/acoustic_ts exported/acoustic_onnx
+"""
+import sys
+import io
+import os
+import argparse
+import json
+import subprocess
+import time
+
+# Windows環境でUTF-8出力を強制
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+SAMPLER = 'dpm-solver++'
+SAMPLER_STEPS = 10
+REPEATS = 3
+KAERU_NO_UTA = {
+    'text': '卡爱鲁诺乌他嘎',
+    'notes': 'C4 | D4 | E4 | F4 | E4 | D4 | C4',
+    'notes_duration': '0.5 | 0.5 | 0.5 | 0.5 | 0.5 | 0.5 | 0.5',
+    'input_type': 'word',
+    'sampler': SAMPLER,
+    'sampler_steps': SAMPLER_STEPS
+}
+
+
+def peak_rss_mb() -> float:
+    """このプロセスの最大常駐メモリ（MB、取得できない環境では -1）"""
+    try:
+        import resource
+    except ImportError:
+        return -1.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def child(target: str) -> dict:
+    """新しいプロセスの中で1つのランタイムを計測"""
+    start = time.perf_counter()
+    if target != 'pytorch':
+        os.environ['DIFFSINGER_RUNTIME'] = 'exported'
+    real_stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        import diffsinger
+        if target == 'pytorch':
+            specs = {spec.model_id: spec for spec in diffsinger.discover_specs()}
+            spec = specs.get(diffsinger.DEFAULT_MODEL_ID) or next(iter(specs.values()))
+        else:
+            from core.exported_engine import discover_exported_specs
+            spec = next(s for s in discover_exported_specs(os.path.dirname(os.path.abspath(target)))
+                        if os.path.abspath(s.work_dir) == os.path.abspath(target))
+        engine = diffsinger.build_engine(spec)
+        startup = time.perf_counter() - start
+        startup_rss = peak_rss_mb()
+
+        latencies = []
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            engine.infer_once(dict(KAERU_NO_UTA))
+            latencies.append(time.perf_counter() - start)
+    finally:
+        sys.stdout = real_stdout
+
+    return {
+        'runtime': 'pytorch' if target == 'pytorch' else f"exported ({engine.format})",
+        'startup_sec': startup,
+        'startup_rss_mb': startup_rss,
+        'peak_rss_mb': peak_rss_mb(),
+        'infer_sec': min(latencies),
+        'torch_loaded': 'torch' in sys.modules
+    }
+
+
+def benchmark(targets: list):
+    print("=" * 70)
+    print(f"DiffSinger runtime benchmark (kaeru_no_uta, {SAMPLER} {SAMPLER_STEPS} steps, best of {REPEATS})")
+    print("=" * 70)
+
+    baseline = None
+    for target in ['pytorch'] + targets:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', target],
+                              capture_output=True, text=True, encoding='utf-8')
+        if proc.returncode != 0:
+            print(f"[BENCH] {target}: failed\n{proc.stderr.strip()}")
+            continue
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        baseline = baseline or result
+        print(f"[BENCH] {result['runtime']:>22s}: "
+              f"startup {result['startup_sec']:5.1f} s ({baseline['startup_sec'] / result['startup_sec']:4.1f}x) | "
+              f"peak RSS startup {result['startup_rss_mb']:6.0f} MB / after infer {result['peak_rss_mb']:6.0f} MB | "
+              f"infer {result['infer_sec'] * 1000:6.0f} ms | "
+              f"torch {'loaded' if result['torch_loaded'] else 'not loaded'}")
+
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare DiffSinger runtimes")
+    parser.add_argument("exports", nargs="*", help="Export directories written by export_inference_graph.py")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(args.child)))
+    else:
+        benchmark(args.exports)
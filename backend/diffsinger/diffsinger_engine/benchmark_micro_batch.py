@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DiffSinger マイクロバッチのスループットベンチマーク（CPU）
+
+カエルの歌（test_kaeru_no_uta.py と同じ入力、およびフレーズ長の異なる変形）を
+CONCURRENCY 並列で投げ、バッチの待ち時間（ウィンドウ）ごとにスループットとレイテンシを比較します。
+ウィンドウ 0 / 最大サイズ1 はバッチ化なし（従来の1リクエストずつの推論）に相当します。
+
+使用方法:
+    python benchmark_micro_batch.py
+"""
+import sys
+import io
+import asyncio
+import statistics
+import time
+
+# Windows環境でUTF-8出力を強制
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+import torch
+
+from diffsinger import build_engine, CHECKPOINT_ROOT, DEFAULT_MODEL_ID
+from core.engine_registry import discover_model_specs
+from core.micro_batcher import MicroBatcher
+
+# (最大バッチサイズ, ウィンドウms)
+SETTINGS = [(1, 0), (8, 5), (8, 10), (8, 20), (8, 50)]
+CONCURRENCY = 8
+REQUESTS_PER_CLIENT = 3
+
+KAERU_NO_UTA = [
+    {
+        'text': '卡爱鲁诺乌他嘎',
+        'notes': 'C4 | D4 | E4 | F4 | E4 | D4 | C4',
+        'notes_duration': '0.5 | 0.5 | 0.5 | 0.5 | 0.5 | 0.5 | 0.5',
+        'input_type': 'word'
+    },
+    {
+        'text': '卡爱鲁诺',
+        'notes': 'C4 | D4 | E4 | F4',
+        'notes_duration': '0.5 | 0.5 | 0.5 | 0.5',
+        'input_type': 'word'
+    },
+    {
+        'text': '乌他嘎卡爱鲁诺乌他嘎',
+        'notes': 'E4 | D4 | C4 | E4 | F4 | G4 | A4 | G4 | F4 | E4',
+        'notes_duration': '0.5 | 0.5 | 1.0 | 0.5 | 0.5 | 0.5 | 0.5 | 0.5 | 0.5 | 1.0',
+        'input_type': 'word'
+    }
+]
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def measure(batcher: MicroBatcher) -> tuple:
+    """CONCURRENCY並列のクライアントが順にリクエストを投げ、(総時間, レイテンシ一覧) を返す"""
+    latencies = []
+
+    async def client(index: int):
+        for n in range(REQUESTS_PER_CLIENT):
+            inp = KAERU_NO_UTA[(index + n) % len(KAERU_NO_UTA)]
+            start = time.perf_counter()
+            await batcher.submit(inp)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(i) for i in range(CONCURRENCY)])
+    return time.perf_counter() - start, latencies
+
+
+async def benchmark():
+    specs = {spec.model_id: spec for spec in discover_model_specs(CHECKPOINT_ROOT)}
+    spec = specs.get(DEFAULT_MODEL_ID) or next(iter(specs.values()))
+
+    # 推論ログを抑制してエンジンを構築
+    real_stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        engine = build_engine(spec)
+        # バッチ推論とバラバラの推論で出力長が一致することを確認
+        single = [engine.infer_once(inp) for inp in KAERU_NO_UTA]
+        batched = engine.infer_batch(KAERU_NO_UTA)
+    finally:
+        sys.stdout = real_stdout
+
+    print("=" * 70)
+    print(f"DiffSinger micro-batch benchmark ({spec.model_id}, {CONCURRENCY} clients x "
+          f"{REQUESTS_PER_CLIENT} requests, {torch.get_num_threads()} CPU threads)")
+    print("=" * 70)
+    print(f"[CHECK] output lengths single={[len(w) for w in single]} batched={[len(w) for w in batched]}")
+
+    for max_batch_size, window_ms in SETTINGS:
+        batcher = MicroBatcher(engine.infer_batch, max_batch_size, window_ms)
+        sys.stdout = io.StringIO()
+        try:
+            elapsed, latencies = await measure(batcher)
+        finally:
+            sys.stdout = real_stdout
+        stats = batcher.stats()
+        print(f"[BENCH] batch<={max_batch_size} window {window_ms:3.0f} ms: "
+              f"{len(latencies) / elapsed:6.2f} req/s | "
+              f"p50 {percentile(latencies, 50):6.2f} s | "
+              f"p99 {percentile(latencies, 99):6.2f} s | "
+              f"mean {statistics.mean(latencies):6.2f} s | "
+              f"avg batch {stats['avg_batch_size']:.1f}")
+
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    asyncio.run(benchmark())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DiffSinger 拡散サンプラーの品質・レイテンシベンチマーク（CPU）
+
+カエルの歌の入力（benchmark_micro_batch.py と同じ）について、音響モデル（fs2 + 拡散）の推論時間と、
+K_stepステップの祖先サンプリング（ddpm）の出力melに対する平均絶対誤差を比較します。
+各サンプラーは同じ乱数シードで始めるため、初期ノイズは共通です。
+
+使用方法:
+    python benchmark_samplers.py
+"""
+import sys
+import io
+import time
+
+# Windows環境でUTF-8出力を強制
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+import torch
+
+from diffsinger import build_engine, CHECKPOINT_ROOT, DEFAULT_MODEL_ID
+from core.engine_registry import discover_model_specs
+from benchmark_micro_batch import KAERU_NO_UTA
+from utils.hparams import hparams_scope
+
+# (サンプラー, ステップ数)。Noneは既定のステップ数
+SAMPLER_SETTINGS = [
+    ('ddpm', None),
+    ('plms', 25),
+    ('ddim', 50), ('ddim', 20), ('ddim', 10),
+    ('dpm-solver++', 20), ('dpm-solver++', 10), ('dpm-solver++', 5)
+]
+SEED = 1234
+REPEATS = 2
+
+
+def run_acoustic_model(engine, item: dict, sampler: str, steps) -> tuple:
+    """音響モデルのみ実行し、(最短時間, mel, 実際のステップ数) を返す"""
+    sample = engine.input_to_batch(item)
+    best, mel, used_steps = float("inf"), None, None
+    for _ in range(REPEATS):
+        torch.manual_seed(SEED)
+        start = time.perf_counter()
+        with torch.no_grad():
+            output = engine.model(sample['txt_tokens'], spk_id=sample.get('spk_ids'), ref_mels=None, infer=True,
+                                  pitch_midi=sample['pitch_midi'], midi_dur=sample['midi_dur'],
+                                  is_slur=sample['is_slur'], sampler=sampler, sampler_steps=steps)
+        best = min(best, time.perf_counter() - start)
+        mel, used_steps = output['mel_out'], output['sampler_steps']
+    return best, mel, used_steps
+
+
+def benchmark():
+    specs = {spec.model_id: spec for spec in discover_model_specs(CHECKPOINT_ROOT)}
+    spec = specs.get(DEFAULT_MODEL_ID) or next(iter(specs.values()))
+
+    real_stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        engine = build_engine(spec)
+        with hparams_scope(engine.hparams):
+            items = [engine.preprocess_input(inp, input_type='word') for inp in KAERU_NO_UTA]
+            results = {}
+            for sampler, steps in SAMPLER_SETTINGS:
+                results[(sampler, steps)] = [run_acoustic_model(engine, item, sampler, steps) for item in items]
+    finally:
+        sys.stdout = real_stdout
+
+    print("=" * 70)
+    print(f"DiffSinger sampler benchmark ({spec.model_id}, K_step={engine.hparams['K_step']}, "
+          f"{len(items)} inputs, {torch.get_num_threads()} CPU threads)")
+    print("=" * 70)
+
+    reference = results[SAMPLER_SETTINGS[0]]
+    reference_time = sum(elapsed for elapsed, _, _ in reference)
+    for (sampler, _), runs in results.items():
+        elapsed = sum(t for t, _, _ in runs)
+        mae = sum((mel - ref_mel).abs().mean().item() for (_, mel, _), (_, ref_mel, _) in zip(runs, reference)) / len(runs)
+        print(f"[BENCH] {sampler:>12s} {runs[0][2]:4d} steps: "
+              f"{elapsed * 1000:8.0f} ms | "
+              f"speedup {reference_time / elapsed:5.1f}x | "
+              f"mel MAE vs ddpm {mae:.4f}")
+
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DiffSinger 拡散サンプリングループのステップ別プロファイル（CPU）
+
+カエルの歌の入力で fs2 の条件（cond）を1回だけ作り、K_step ステップの祖先サンプリング（ddpm）について
+1ステップあたりの時間を比較します。
+- legacy: 旧ループ（tqdm + ステップごとの torch.full + extract による gather）
+- denoiser only: denoise_fn の呼び出しのみ（ネットワーク本体のコスト）
+- current: 前計算した係数・cond射影・ステップ射影を使う現在のループ（inference_mode）
+- diff_compile: torchscript / torch.compile を有効にした現在のループ
+
+使用方法:
+    python benchmark_sampling_loop.py
+"""
+import sys
+import io
+import statistics
+import time
+
+# Windows環境でUTF-8出力を強制
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+import torch
+from tqdm import tqdm
+
+from diffsinger import build_engine, CHECKPOINT_ROOT, DEFAULT_MODEL_ID
+from core.engine_registry import discover_model_specs
+from benchmark_micro_batch import KAERU_NO_UTA
+from utils.hparams import hparams, hparams_scope
+
+COMPILE_MODES = ['torchscript', 'torch.compile']
+
+
+def prepare(engine) -> tuple:
+    """kaeru_no_uta の最初の入力から (初期x, cond) を作る"""
+    item = engine.preprocess_input(KAERU_NO_UTA[0], input_type='word')
+    sample = engine.input_to_batch(item)
+    model = engine.model
+    with torch.no_grad():
+        ret = model.fs2(sample['txt_tokens'], None, sample.get('spk_ids'), None, None, None, None,
+                        skip_decoder=False, infer=True, pitch_midi=sample['pitch_midi'],
+                        midi_dur=sample['midi_dur'], is_slur=sample['is_slur'])
+        cond = ret['decoder_inp'].transpose(1, 2)
+        fs2_mels = model.norm_spec(ret['mel_out']).transpose(1, 2)[:, None, :, :]
+        x = model.q_sample(x_start=fs2_mels, t=torch.tensor([model.K_step - 1]).long())
+    return x, cond
+
+
+def profile_legacy(model, x, cond) -> list:
+    """旧ループのステップごとの時間"""
+    timings = []
+    with torch.no_grad():
+        for i in tqdm(reversed(range(0, model.K_step)), desc='sample time step', total=model.K_step):
+            start = time.perf_counter()
+            x = model.p_sample(x, torch.full((x.shape[0],), i, dtype=torch.long), cond)
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def profile_denoiser_only(model, x, cond) -> list:
+    """denoise_fn 本体のみのステップごとの時間"""
+    timings = []
+    t = torch.full((x.shape[0],), model.K_step - 1, dtype=torch.long)
+    with torch.inference_mode():
+        for _ in range(model.K_step):
+            start = time.perf_counter()
+            model.denoise_fn(x, t, cond=cond)
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def profile_current(model, x, cond) -> list:
+    """現在のループ（usr.diff.sampling.sample_ddpm と同じ更新）のステップごとの時間"""
+    c = model.sampling_coefs
+    timings = []
+    with torch.inference_mode():
+        denoiser = model.make_denoiser(cond)
+        for step in reversed(range(0, model.K_step)):
+            start = time.perf_counter()
+            x0 = model.predict_x0(denoiser, x, step)
+            x_mean = c['posterior_mean_coef1'][step] * x0 + c['posterior_mean_coef2'][step] * x
+            x = x_mean + c['posterior_std'][step] * torch.randn_like(x) if step > 0 else x_mean
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name: str, timings: list, baseline: float = None) -> float:
+    total = sum(timings)
+    line = (f"[BENCH] {name:>14s}: per step mean {statistics.mean(timings) * 1000:7.2f} ms | "
+            f"p50 {statistics.median(timings) * 1000:7.2f} ms | total {total * 1000:8.0f} ms")
+    if baseline:
+        line += f" | speedup {baseline / total:4.2f}x"
+    print(line)
+    return total
+
+
+def benchmark():
+    specs = {spec.model_id: spec for spec in discover_model_specs(CHECKPOINT_ROOT)}
+    spec = specs.get(DEFAULT_MODEL_ID) or next(iter(specs.values()))
+
+    real_stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        engine = build_engine(spec)
+    finally:
+        sys.stdout = real_stdout
+
+    with hparams_scope(engine.hparams):
+        model = engine.model
+        x, cond = prepare(engine)
+
+        print("=" * 70)
+        print(f"DiffSinger sampling loop profile ({spec.model_id}, K_step={model.K_step}, "
+              f"{cond.shape[-1]} frames, {torch.get_num_threads()} CPU threads)")
+        print("=" * 70)
+
+        # 初回のメモリ確保などを除くため、それぞれ1回空回ししてから計測
+        profile_legacy(model, x, cond)
+        legacy = report("legacy", profile_legacy(model, x, cond))
+        profile_denoiser_only(model, x, cond)
+        report("denoiser only", profile_denoiser_only(model, x, cond), legacy)
+        profile_current(model, x, cond)
+        report("current", profile_current(model, x, cond), legacy)
+
+        for mode in COMPILE_MODES:
+            hparams['diff_compile'] = mode
+            sys.stdout = io.StringIO()
+            try:
+                profile_current(model, x, cond)  # コンパイル（初回のみ）
+            finally:
+                sys.stdout = real_stdout
+            compiled = model._compiled_denoiser is not None
+            report(f"{mode}{'' if compiled else ' (eager)'}", profile_current(model, x, cond), legacy)
+        hparams['diff_compile'] = None
+
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,4 +1,23 @@
 """DiffSinger Core Inference Engine"""
-from .inference_engine import DiffSingerEngine
+import importlib
 
-__all__ = ['DiffSingerEngine']
+# 書き出したグラフのランタイム（core.exported_engine）が学習用スタックを読み込まずに済むよう、
+# 各モジュールは属性に最初にアクセスしたときに読み込む
+_EXPORTS = {
+    'DiffSingerEngine': '.inference_engine',
+    'EngineRegistry': '.engine_registry',
+    'ModelSpec': '.engine_registry',
+    'discover_model_specs': '.engine_registry',
+    'MicroBatcher': '.micro_batcher',
+    'ExportedSVSInfer': '.exported_engine',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
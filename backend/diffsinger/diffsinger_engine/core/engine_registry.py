@@ -0,0 +1,328 @@
+"""
+DiffSinger Engine Registry
+
+複数のチェックポイントを推論エンジンとして同じプロセスに常駐させるレジストリ。
+各エンジンは独立したhparamsを持ち（utils.hparams.hparams_scope）、
+常駐メモリの合計がメモリ予算を超えたら、使われていない順にエンジンを解放します。
+アクティブモデルの切り替えは、常駐済みであればポインタの差し替えだけで完了します。
+torch はチェックポイントから構築したエンジンを扱うときだけ読み込みます。
+"""
+import gc
+import glob
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+@dataclass
+class ModelSpec:
+    """登録済みモデル（チェックポイント）の定義"""
+    model_id: str
+    config_path: str
+    work_dir: str
+    pe_ckpt: str
+    vocoder_ckpt: str
+
+
+@dataclass
+class ResidentEngine:
+    """常駐中のエンジン"""
+    engine: Any
+    memory_bytes: int
+    load_time: float
+    last_used: float
+
+
+def discover_model_specs(checkpoint_root: str = 'checkpoints') -> List[ModelSpec]:
+    """
+    チェックポイントディレクトリから音響モデルを列挙
+
+    checkpoints/<model_id>/ に config.yaml と model_ckpt_steps_*.ckpt があるものをモデルとみなす。
+    ピッチ抽出器（pe）とボコーダー（vocoder）は全モデルで共有する。
+
+    Args:
+        checkpoint_root: チェックポイントのルートディレクトリ
+
+    Returns:
+        List[ModelSpec]: モデル定義のリスト（model_id順）
+    """
+    shared_dirs = {'pe', 'vocoder'}
+    specs = []
+    if not os.path.isdir(checkpoint_root):
+        return specs
+
+    for name in sorted(os.listdir(checkpoint_root)):
+        work_dir = os.path.join(checkpoint_root, name)
+        config_path = os.path.join(work_dir, 'config.yaml')
+        if name in shared_dirs or not os.path.isfile(config_path):
+            continue
+        if not glob.glob(os.path.join(work_dir, 'model_ckpt_steps_*.ckpt')):
+            continue
+        specs.append(ModelSpec(
+            model_id=name,
+            config_path=config_path,
+            work_dir=work_dir,
+            pe_ckpt=os.path.join(checkpoint_root, 'pe'),
+            vocoder_ckpt=os.path.join(checkpoint_root, 'vocoder')
+        ))
+    return specs
+
+
+def engine_memory_bytes(engine: Any) -> int:
+    """
+    エンジンが保持するモデル（torch.nn.Module属性）のパラメータ・バッファの合計バイト数
+
+    Args:
+        engine: 推論エンジン
+
+    Returns:
+        int: 推定常駐メモリ（バイト）
+    """
+    import torch
+
+    seen = set()
+    total = 0
+    for value in vars(engine).values():
+        if not isinstance(value, torch.nn.Module):
+            continue
+        for tensor in list(value.parameters()) + list(value.buffers()):
+            key = (tensor.device, tensor.data_ptr())
+            if key in seen:
+                continue
+            seen.add(key)
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class EngineRegistry:
+    """
+    推論エンジンのLRUレジストリ
+
+    Attributes:
+        factory (Callable[[ModelSpec], Any]): モデル定義からエンジンを構築する関数
+        memory_budget_bytes (int): 常駐エンジンの合計メモリ上限（0以下なら無制限）
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[ModelSpec], Any],
+        memory_budget_bytes: int,
+        size_fn: Callable[[Any], int] = engine_memory_bytes
+    ):
+        """
+        初期化
+
+        Args:
+            factory: モデル定義からエンジンを構築する関数（数秒かかる同期処理）
+            memory_budget_bytes: 常駐エンジンの合計メモリ上限（0以下なら無制限）
+            size_fn: エンジンの常駐メモリを見積もる関数
+        """
+        self.factory = factory
+        self.memory_budget_bytes = memory_budget_bytes
+        self.size_fn = size_fn
+
+        self._specs: Dict[str, ModelSpec] = {}
+        self._resident: "OrderedDict[str, ResidentEngine]" = OrderedDict()  # 先頭ほど長く使われていない
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.active_model_id: Optional[str] = None
+
+        self.loads = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def register(self, spec: ModelSpec) -> None:
+        """モデル定義を登録"""
+        with self._lock:
+            self._specs[spec.model_id] = spec
+            self._load_locks.setdefault(spec.model_id, threading.Lock())
+
+    def model_ids(self) -> List[str]:
+        """登録済みモデルIDのリスト"""
+        return list(self._specs)
+
+    def is_resident(self, model_id: str) -> bool:
+        """モデルが常駐済みかどうか"""
+        return model_id in self._resident
+
+    def get(self, model_id: str) -> Any:
+        """
+        エンジンを取得（常駐していなければロードし、必要に応じて他のエンジンを解放）
+
+        Args:
+            model_id: モデルID
+
+        Returns:
+            Any: 推論エンジン
+
+        Raises:
+            KeyError: 未登録のモデルIDの場合
+        """
+        if model_id not in self._specs:
+            raise KeyError(model_id)
+
+        entry = self._touch(model_id)
+        if entry is not None:
+            return entry.engine
+
+        # 同じモデルの並行ロードは1回にまとめる（別モデルのロードは並行可能）
+        with self._load_locks[model_id]:
+            entry = self._touch(model_id)
+            if entry is not None:
+                return entry.engine
+
+            print(f"[Engine Registry] Loading {model_id}...")
+            start = time.perf_counter()
+            engine = self.factory(self._specs[model_id])
+            load_time = time.perf_counter() - start
+            entry = ResidentEngine(
+                engine=engine,
+                memory_bytes=self.size_fn(engine),
+                load_time=load_time,
+                last_used=time.time()
+            )
+
+            with self._lock:
+                self._resident[model_id] = entry
+                self.loads += 1
+                evicted = self._evict_over_budget(keep=model_id)
+            print(f"[Engine Registry] Loaded {model_id} in {load_time:.1f}s "
+                  f"({entry.memory_bytes / 1024 / 1024:.0f} MB)")
+
+        if evicted:
+            self._release_memory()
+        return engine
+
+    def activate(self, model_id: str) -> Tuple[Any, bool]:
+        """
+        アクティブモデルを切り替える（常駐済みならポインタの差し替えのみ）
+
+        Args:
+            model_id: モデルID
+
+        Returns:
+            Tuple[Any, bool]: (推論エンジン, 切り替え前から常駐していたか)
+
+        Raises:
+            KeyError: 未登録のモデルIDの場合
+        """
+        was_resident = self.is_resident(model_id)
+        engine = self.get(model_id)
+        with self._lock:
+            self.active_model_id = model_id
+            # ロード時は切り替え前のアクティブモデルも解放対象外のため、切り替え後に予算を再確認する
+            evicted = self._evict_over_budget(keep=model_id)
+        if evicted:
+            self._release_memory()
+        return engine, was_resident
+
+    @property
+    def active(self) -> Optional[Any]:
+        """アクティブモデルのエンジン（未選択ならNone）"""
+        model_id = self.active_model_id
+        if model_id is None:
+            return None
+        # /health などの参照でヒット数やLRU順を動かさないよう、常駐エンジンを直接読む
+        entry = self._resident.get(model_id)
+        return entry.engine if entry is not None else self.get(model_id)
+
+    def evict(self, model_id: str) -> bool:
+        """
+        エンジンを明示的に解放（アクティブモデルは解放しない）
+
+        Returns:
+            bool: 解放した場合True
+        """
+        with self._lock:
+            if model_id == self.active_model_id or model_id not in self._resident:
+                return False
+            del self._resident[model_id]
+            self.evictions += 1
+        print(f"[Engine Registry] Evicted {model_id}")
+        self._release_memory()
+        return True
+
+    def _touch(self, model_id: str) -> Optional[ResidentEngine]:
+        """常駐エンジンを最近使った扱いにして返す"""
+        with self._lock:
+            entry = self._resident.get(model_id)
+            if entry is None:
+                return None
+            self._resident.move_to_end(model_id)
+            entry.last_used = time.time()
+            self.hits += 1
+            return entry
+
+    def _evict_over_budget(self, keep: str) -> List[str]:
+        """メモリ予算を超えている間、使われていない順に解放（ロック保持中に呼ぶこと）"""
+        evicted = []
+        if self.memory_budget_bytes <= 0:
+            return evicted
+
+        for model_id in list(self._resident):
+            if self._total_bytes() <= self.memory_budget_bytes:
+                break
+            if model_id in (keep, self.active_model_id):
+                continue
+            # 推論中のリクエストは自分の参照を持っているため、レジストリから外しても処理は継続できる
+            del self._resident[model_id]
+            self.evictions += 1
+            evicted.append(model_id)
+            print(f"[Engine Registry] Evicted {model_id} (memory budget "
+                  f"{self.memory_budget_bytes / 1024 / 1024:.0f} MB)")
+        return evicted
+
+    def _total_bytes(self) -> int:
+        return sum(entry.memory_bytes for entry in self._resident.values())
+
+    @staticmethod
+    def _release_memory() -> None:
+        """解放したエンジンのメモリを回収"""
+        gc.collect()
+        # 書き出したグラフのランタイム（ONNX Runtime）では torch を読み込まないため、読み込み済みの場合のみ
+        torch = sys.modules.get('torch')
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def describe(self, model_id: str) -> Dict[str, Any]:
+        """
+        モデルの状態を辞書で取得
+
+        Args:
+            model_id: モデルID
+
+        Returns:
+            Dict[str, Any]: モデルID・常駐状態・メモリ等
+        """
+        entry = self._resident.get(model_id)
+        return {
+            "id": model_id,
+            "active": model_id == self.active_model_id,
+            "resident": entry is not None,
+            "memory_mb": round(entry.memory_bytes / 1024 / 1024, 1) if entry else 0,
+            "load_time_sec": round(entry.load_time, 2) if entry else None,
+            "last_used": entry.last_used if entry else None
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        レジストリ統計を取得
+
+        Returns:
+            Dict[str, Any]: 常駐数・メモリ使用量などの統計
+        """
+        with self._lock:
+            return {
+                "active_model": self.active_model_id,
+                "registered": len(self._specs),
+                "resident": list(self._resident),
+                "resident_memory_mb": round(self._total_bytes() / 1024 / 1024, 1),
+                "memory_budget_mb": round(self.memory_budget_bytes / 1024 / 1024, 1),
+                "loads": self.loads,
+                "hits": self.hits,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,200 @@
+"""
+DiffSinger Exported Engine
+
+export_inference_graph.py が書き出した推論グラフ（TorchScript / ONNX）だけで歌声合成を行う軽量ランタイム。
+学習用スタック（usr.diffsinger_task, tasks, vocoders, matplotlib）もモデルの Python 実装も読み込まず、
+拡散サンプリングは usr.diff.sampling の共通サンプラーを numpy 配列で回します。
+ONNX のグラフは ONNX Runtime（CPU）で実行し、その場合は torch も読み込みません。
+"""
+import json
+import math
+import os
+from typing import Any, Dict, List
+
+import numpy as np
+from scipy.io import wavfile
+
+from inference.svs.svs_frontend import SVSFrontend, PhoneEncoder
+from usr.diff.sampling import resolve_sampler, sample, numpy_clamp, numpy_noise_like
+from core.engine_registry import ModelSpec
+
+MANIFEST_NAME = 'manifest.json'
+STEP_PROJECTIONS_NAME = 'step_projections.npy'
+
+# グラフ名 -> (入力名, 出力名)
+GRAPH_IO = {
+    'acoustic': (['txt_tokens', 'pitch_midi', 'midi_dur', 'is_slur'], ['x_start', 'conditioners', 'mel2ph', 'f0_denorm']),
+    'denoiser': (['spec', 'conditioners', 'step_projection'], ['noise']),
+    'vocoder': (['mel', 'f0', 'nonpadding'], ['wav'])
+}
+
+
+class TorchScriptBackend:
+    """torch.jit で書き出したグラフを実行するバックエンド"""
+
+    def __init__(self, export_dir: str, graphs: Dict[str, dict]):
+        import torch
+
+        self.torch = torch
+        self.modules = {name: torch.jit.load(os.path.join(export_dir, graph['file']), map_location='cpu').eval()
+                        for name, graph in graphs.items()}
+        self.input_names = {name: graph['inputs'] for name, graph in graphs.items()}
+
+    def run(self, name: str, feeds: Dict[str, np.ndarray]) -> List[np.ndarray]:
+        torch = self.torch
+        with torch.inference_mode():
+            outputs = self.modules[name](*[torch.from_numpy(np.ascontiguousarray(feeds[k]))
+                                           for k in self.input_names[name]])
+        if isinstance(outputs, torch.Tensor):
+            outputs = (outputs,)
+        return [output.numpy() for output in outputs]
+
+
+class OnnxRuntimeBackend:
+    """ONNX で書き出したグラフを ONNX Runtime（CPU）で実行するバックエンド"""
+
+    def __init__(self, export_dir: str, graphs: Dict[str, dict]):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError("ONNX graphs require onnxruntime (pip install onnxruntime)")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.sessions = {
+            name: ort.InferenceSession(os.path.join(export_dir, graph['file']), sess_options=options,
+                                       providers=['CPUExecutionProvider'])
+            for name, graph in graphs.items()
+        }
+        # 書き出し時に使われない入力（pe_enable 時の vocoder の f0、use_nsf でない場合の nonpadding など）はグラフから除かれている
+        self.input_names = {name: [i.name for i in session.get_inputs()] for name, session in self.sessions.items()}
+
+    def run(self, name: str, feeds: Dict[str, np.ndarray]) -> List[np.ndarray]:
+        return self.sessions[name].run(None, {k: feeds[k] for k in self.input_names[name]})
+
+
+BACKENDS = {
+    'torchscript': TorchScriptBackend,
+    'onnx': OnnxRuntimeBackend
+}
+
+
+def discover_exported_specs(export_root: str = 'exported') -> List[ModelSpec]:
+    """
+    書き出しディレクトリからモデルを列挙
+
+    exported/<model_id>/ に manifest.json があるものをモデルとみなす。
+    ピッチ抽出器とボコーダーは vocoder グラフに含まれるため、pe_ckpt / vocoder_ckpt は空。
+
+    Args:
+        export_root: 書き出しのルートディレクトリ
+
+    Returns:
+        List[ModelSpec]: モデル定義のリスト（model_id順）
+    """
+    specs = []
+    if not os.path.isdir(export_root):
+        return specs
+
+    for name in sorted(os.listdir(export_root)):
+        work_dir = os.path.join(export_root, name)
+        manifest_path = os.path.join(work_dir, MANIFEST_NAME)
+        if not os.path.isfile(manifest_path):
+            continue
+        specs.append(ModelSpec(model_id=name, config_path=manifest_path, work_dir=work_dir,
+                               pe_ckpt='', vocoder_ckpt=''))
+    return specs
+
+
+def exported_engine_bytes(engine: Any) -> int:
+    """EngineRegistry 用: 書き出したエンジンの推定常駐メモリ（バイト）"""
+    return engine.resident_bytes()
+
+
+def save_wav(wav, path, sr, norm=False):
+    """utils.audio.save_wav と同じ（utils パッケージは torch と matplotlib を読み込むため）"""
+    if norm:
+        wav = wav / np.abs(wav).max()
+    wav *= 32767
+    wavfile.write(path, sr, wav.astype(np.int16))
+
+
+class ExportedSVSInfer(SVSFrontend):
+    """
+    書き出した推論グラフで動く推論エンジン（infer_once / infer_batch は SVSFrontend の共通実装）
+
+    Attributes:
+        hparams (dict): 書き出し時のモデル設定（サンプルレート・hop_size・K_step・サンプラー設定など）
+        format (str): グラフの形式（torchscript / onnx）
+        backend: グラフを実行するバックエンド
+    """
+
+    def __init__(self, export_dir: str):
+        """
+        初期化
+
+        Args:
+            export_dir: export_inference_graph.py の出力ディレクトリ
+        """
+        with open(os.path.join(export_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            manifest = json.load(f)
+        super().__init__(PhoneEncoder(manifest['phone_vocab'], manifest.get('replace_oov')))
+
+        self.export_dir = export_dir
+        self.manifest = manifest
+        self.hparams = dict(manifest['hparams'])
+        self.device = 'cpu'
+        self.format = manifest['format']
+        if self.format not in BACKENDS:
+            raise ValueError(f"Unknown export format '{self.format}'. Available formats: {list(BACKENDS)}")
+
+        print(f'| load exported graphs ({self.format}): ', export_dir)
+        self.backend = BACKENDS[self.format](export_dir, manifest['graphs'])
+        self.step_projections = np.load(os.path.join(export_dir, manifest['step_projections']))  # [K, L, 1, C, 1]
+        self.sampling_coefs = manifest['sampling_coefs']
+        self.spec_min = np.asarray(manifest['spec_min'], dtype=np.float32)
+        self.spec_max = np.asarray(manifest['spec_max'], dtype=np.float32)
+        self.rng = np.random.default_rng()
+
+    def resident_bytes(self) -> int:
+        """グラフファイルと前計算した拡散ステップ射影の合計バイト数（常駐メモリの見積もり）"""
+        graph_bytes = sum(os.path.getsize(os.path.join(self.export_dir, graph['file']))
+                          for graph in self.manifest['graphs'].values())
+        return graph_bytes + self.step_projections.nbytes
+
+    def forward_model_batch(self, items: List[dict]) -> List[np.ndarray]:
+        """
+        acoustic -> denoiser（サンプラーのステップ数だけ）-> vocoder の順にグラフを実行し、入力ごとの波形に分割
+
+        :param items: preprocess_input の出力のリスト（サンプラー設定は揃っていること）
+        :return: 入力と同じ順序の波形のリスト
+        """
+        x_start, conditioners, mel2ph, f0_denorm = self.backend.run('acoustic', self.inputs_to_arrays(items, self.hparams['max_frames']))
+
+        k_step = self.hparams['K_step']
+        sampler, steps = resolve_sampler(items[0]['sampler'], items[0]['sampler_steps'], k_step, self.hparams)
+        noise = self.rng.standard_normal(x_start.shape, dtype=np.float32)
+        if self.hparams.get('gaussian_start'):
+            x = noise
+        else:
+            # q_sample(x_start, K_step - 1)
+            alpha = self.sampling_coefs['alphas_cumprod'][k_step - 1]
+            x = math.sqrt(alpha) * x_start + math.sqrt(1 - alpha) * noise
+
+        def denoiser(x, step):
+            feeds = {'spec': x, 'conditioners': conditioners, 'step_projection': self.step_projections[step]}
+            return self.backend.run('denoiser', feeds)[0]
+
+        x = sample(denoiser, self.sampling_coefs, x, k_step, sampler, steps,
+                   clamp=numpy_clamp, noise_like=numpy_noise_like(self.rng))
+
+        nonpadding = mel2ph > 0
+        mel = x[:, 0].transpose(0, 2, 1)  # [B, T, M]
+        mel = (mel + 1) / 2 * (self.spec_max - self.spec_min) + self.spec_min
+        # パディングフレームは無音（spec_min）で埋める（ピッチ抽出器向けの0埋めは vocoder グラフ内で行う）
+        mel = np.ascontiguousarray(np.where(nonpadding[:, :, None], mel, self.spec_min), dtype=np.float32)
+        feeds = {'mel': mel, 'f0': f0_denorm, 'nonpadding': nonpadding.astype(np.float32)}
+        wav_out = self.backend.run('vocoder', feeds)[0]  # [B, T * hop_size]
+
+        hop_size = self.hparams['hop_size']
+        return [wav_out[i, :mel_len * hop_size] for i, mel_len in enumerate(nonpadding.sum(-1).tolist())]
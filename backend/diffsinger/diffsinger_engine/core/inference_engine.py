@@ -39,25 +39,26 @@ class DiffSingerEngine(BaseSVSInfer):
         if config_path is None:
             config_path = 'checkpoints/acoustic/config.yaml'
 
-        set_hparams(config_path, exp_name='', print_hparams=False)
+        # エンジン固有のhparams（グローバルhparamsは変更しない）
+        engine_hparams = set_hparams(config_path, exp_name='', print_hparams=False, global_hparams=False)
 
         # チェックポイントパス設定
         checkpoint_base = Path('checkpoints')
-        hparams['work_dir'] = str(checkpoint_base / 'acoustic')
-        hparams['pe_ckpt'] = str(checkpoint_base / 'pe')
-        hparams['vocoder_ckpt'] = str(checkpoint_base / 'vocoder')
+        engine_hparams['work_dir'] = str(checkpoint_base / 'acoustic')
+        engine_hparams['pe_ckpt'] = str(checkpoint_base / 'pe')
+        engine_hparams['vocoder_ckpt'] = str(checkpoint_base / 'vocoder')
 
-        # 親クラス初期化
-        super().__init__(hparams)
+        # 親クラス初期化（モデル構築は engine_hparams のスコープ内で行われる）
+        super().__init__(engine_hparams)
 
         # 属性設定
-        self.sample_rate = hparams['audio_sample_rate']
+        self.sample_rate = self.hparams['audio_sample_rate']
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
         print(f"   Device: {self.device}")
         print(f"   Sample Rate: {self.sample_rate} Hz")
-        print(f"   Timesteps: {hparams['timesteps']}")
-        print(f"   K_step: {hparams['K_step']}")
+        print(f"   Timesteps: {self.hparams['timesteps']}")
+        print(f"   K_step: {self.hparams['K_step']}")
 
     def build_model(self):
         """音響モデル構築"""
@@ -103,7 +104,9 @@ class DiffSingerEngine(BaseSVSInfer):
                 infer=True,
                 pitch_midi=sample['pitch_midi'],
                 midi_dur=sample['midi_dur'],
-                is_slur=sample['is_slur']
+                is_slur=sample['is_slur'],
+                sampler=inp.get('sampler'),
+                sampler_steps=inp.get('sampler_steps')
             )
 
             mel_out = output['mel_out']
@@ -129,6 +132,8 @@ class DiffSingerEngine(BaseSVSInfer):
                 - notes: MIDI音名
                 - notes_duration: ノート長さ
                 - input_type: 'word' (デフォルト)
+                - sampler: 拡散サンプラー（'ddpm', 'plms', 'ddim', 'dpm-solver++'、省略時はhparams）
+                - sampler_steps: サンプラーのステップ数（省略時はhparams）
 
         Returns:
             音声波形（numpy array）
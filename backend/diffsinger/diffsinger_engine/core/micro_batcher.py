@@ -0,0 +1,141 @@
+"""
+DiffSinger Micro Batcher
+
+同時に届いた推論リクエストを数ミリ秒だけ待ってまとめ、1回のバッチ推論で処理します。
+CPUでは小さな行列積を何度も回すより、まとめて大きな行列積にしたほうがスループットが上がります。
+
+バッチ推論中に届いたリクエストは次のバッチに溜め、推論が終わり次第すぐに流します。
+常駐ワーカーは持たず、待機中のリクエストがある間だけタスクが動きます（エンジン解放時に参照が残らない）。
+"""
+import asyncio
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+
+class MicroBatcher:
+    """
+    動的マイクロバッチャー
+
+    Attributes:
+        run_batch (Callable[[List[Any]], List[Any]]): 入力リストを受け取り、同じ順序の結果リストを返す同期関数
+            （結果が Exception の場合はそのリクエストに例外として返す）
+        max_batch_size (int): 1バッチの最大リクエスト数
+        window_sec (float): 最初のリクエストから次のリクエストを待つ最大時間（秒）
+    """
+
+    def __init__(self, run_batch: Callable[[List[Any]], List[Any]], max_batch_size: int, window_ms: float):
+        """
+        初期化
+
+        Args:
+            run_batch: バッチ推論関数（スレッドプールで実行される）
+            max_batch_size: 1バッチの最大リクエスト数（1ならバッチ化しない）
+            window_ms: バッチを集める待ち時間（ミリ秒、0なら待たない）
+        """
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.window_sec = max(0.0, window_ms) / 1000
+
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._running = False
+
+        self.batches = 0
+        self.requests = 0
+        self.batched_requests = 0
+        self.max_batch_seen = 0
+        self.total_batch_time = 0.0
+
+    async def submit(self, item: Any) -> Any:
+        """
+        リクエストを投入し、バッチ推論の結果を待つ
+
+        Args:
+            item: 推論入力
+
+        Returns:
+            Any: この入力に対する推論結果
+
+        Raises:
+            Exception: バッチ推論、またはこの入力の処理で発生した例外
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        self.requests += 1
+        self._schedule(loop)
+        return await future
+
+    def _schedule(self, loop: asyncio.AbstractEventLoop) -> None:
+        """待機中リクエストのディスパッチを予約（推論中なら終了後に流す）"""
+        if self._running or not self._pending:
+            return
+        if len(self._pending) >= self.max_batch_size or self.window_sec == 0:
+            self._dispatch(loop)
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_sec, self._dispatch, loop)
+
+    def _dispatch(self, loop: asyncio.AbstractEventLoop) -> None:
+        """待機中リクエストから1バッチを取り出して推論を開始"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._running:
+            return
+
+        # 待っている間にキャンセルされたリクエストは除外
+        self._pending = [(item, future) for item, future in self._pending if not future.done()]
+        if not self._pending:
+            return
+
+        batch = self._pending[:self.max_batch_size]
+        self._pending = self._pending[self.max_batch_size:]
+        self._running = True
+        loop.create_task(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        """バッチ推論をスレッドプールで実行し、結果を各リクエストに配る"""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            results = await loop.run_in_executor(None, self.run_batch, [item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"Batch returned {len(results)} results for {len(batch)} requests")
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.batches += 1
+            self.batched_requests += len(batch)
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+            self.total_batch_time += time.perf_counter() - start
+            self._running = False
+            # 推論中に溜まったリクエストは既に十分待っているので、すぐに次のバッチとして流す
+            if self._pending:
+                self._dispatch(loop)
+
+    def stats(self) -> dict:
+        """
+        バッチ統計を取得
+
+        Returns:
+            dict: バッチ数・平均バッチサイズなどの統計
+        """
+        return {
+            "max_batch_size": self.max_batch_size,
+            "window_ms": self.window_sec * 1000,
+            "requests": self.requests,
+            "batches": self.batches,
+            "avg_batch_size": round(self.batched_requests / self.batches, 2) if self.batches else 0,
+            "max_batch_seen": self.max_batch_seen,
+            "avg_batch_time_sec": round(self.total_batch_time / self.batches, 3) if self.batches else 0,
+            "pending": len(self._pending)
+        }
@@ -7,6 +7,8 @@ DiffSinger FastAPI Server
     python diffsinger.py
 
 APIエンドポイント:
+    GET  /api/models
+    POST /api/models/{model_id}/load
     POST /api/synthesize
     {
         "lyrics": "小酒窝长睫毛",
@@ -17,6 +19,7 @@ APIエンドポイント:
 import sys
 import os
 import io
+import asyncio
 from pathlib import Path
 from typing import Optional
 
@@ -35,9 +38,23 @@ from fastapi.responses import FileResponse
 from pydantic import BaseModel, Field
 import uvicorn
 
-from inference.svs.ds_e2e import DiffSingerE2EInfer
-from utils.audio import save_wav
-from utils.hparams import set_hparams, hparams
+# 推論ランタイム
+#   pytorch: checkpoints/ からモデルを構築（学習用スタックを含めて読み込む）
+#   exported: export_inference_graph.py で書き出したグラフ（exported/<model_id>/）だけを読み込む
+RUNTIME = os.environ.get('DIFFSINGER_RUNTIME', 'pytorch')
+EXPORT_ROOT = os.environ.get('DIFFSINGER_EXPORT_ROOT', 'exported')
+if RUNTIME not in ('pytorch', 'exported'):
+    raise ValueError(f"Unknown DIFFSINGER_RUNTIME '{RUNTIME}'. Available runtimes: ['pytorch', 'exported']")
+
+from core.engine_registry import EngineRegistry, ModelSpec, discover_model_specs, engine_memory_bytes
+from core.micro_batcher import MicroBatcher
+from usr.diff.sampling import SAMPLERS
+if RUNTIME == 'exported':
+    from core.exported_engine import ExportedSVSInfer, discover_exported_specs, exported_engine_bytes, save_wav
+else:
+    from inference.svs.ds_e2e import DiffSingerE2EInfer
+    from utils.audio import save_wav
+    from utils.hparams import set_hparams
 import numpy as np
 
 # FastAPIアプリケーション
@@ -47,8 +64,43 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# グローバル推論エンジン（起動時に初期化）
-engine: Optional[DiffSingerE2EInfer] = None
+# モデルレジストリ設定
+CHECKPOINT_ROOT = 'checkpoints'
+DEFAULT_MODEL_ID = os.environ.get('DIFFSINGER_DEFAULT_MODEL', 'acoustic')
+# 常駐させるエンジンの合計メモリ上限（超えたら使われていないモデルから解放）
+ENGINE_MEMORY_BUDGET_MB = int(os.environ.get('DIFFSINGER_ENGINE_MEMORY_BUDGET_MB', '4096'))
+# 同時リクエストをまとめて推論するマイクロバッチ設定（最大サイズ1でバッチ化しない）
+MICRO_BATCH_MAX_SIZE = int(os.environ.get('DIFFSINGER_MICRO_BATCH_MAX_SIZE', '8'))
+MICRO_BATCH_WINDOW_MS = float(os.environ.get('DIFFSINGER_MICRO_BATCH_WINDOW_MS', '10'))
+
+
+def build_engine(spec: ModelSpec):
+    """モデル定義から推論エンジンを構築（hparamsはエンジンごとに独立）"""
+    if RUNTIME == 'exported':
+        engine = ExportedSVSInfer(spec.work_dir)
+    else:
+        engine_hparams = set_hparams(spec.config_path, exp_name=spec.model_id, print_hparams=False, global_hparams=False)
+        engine_hparams['work_dir'] = spec.work_dir
+        engine_hparams['pe_ckpt'] = spec.pe_ckpt
+        engine_hparams['vocoder_ckpt'] = spec.vocoder_ckpt
+        engine = DiffSingerE2EInfer(engine_hparams)
+    engine.batcher = MicroBatcher(engine.infer_batch, MICRO_BATCH_MAX_SIZE, MICRO_BATCH_WINDOW_MS)
+    return engine
+
+
+def discover_specs() -> list:
+    """ランタイムに応じてモデル定義を列挙"""
+    if RUNTIME == 'exported':
+        return discover_exported_specs(EXPORT_ROOT)
+    return discover_model_specs(CHECKPOINT_ROOT)
+
+
+# グローバル推論エンジンレジストリ（起動時にモデルを登録し、既定モデルをロード）
+engines = EngineRegistry(
+    build_engine,
+    ENGINE_MEMORY_BUDGET_MB * 1024 * 1024,
+    size_fn=exported_engine_bytes if RUNTIME == 'exported' else engine_memory_bytes
+)
 
 
 class SynthesisRequest(BaseModel):
@@ -57,6 +109,8 @@ class SynthesisRequest(BaseModel):
     notes: str = Field(..., description="MIDI音名（|区切り）例: C4 | D4 | E4")
     durations: str = Field(..., description="ノート長さ秒（|区切り）例: 0.5 | 0.5 | 1.0")
     output_path: str = Field(default="outputs/synthesis.wav", description="出力WAVパス")
+    sampler: Optional[str] = Field(default=None, description="拡散サンプラー（ddpm / plms / ddim / dpm-solver++、省略時はモデル設定）")
+    sampler_steps: Optional[int] = Field(default=None, ge=1, le=1000, description="サンプラーのステップ数（ddim・dpm-solver++は5〜20程度）")
 
 
 class SynthesisResponse(BaseModel):
@@ -70,24 +124,26 @@ class SynthesisResponse(BaseModel):
 @app.on_event("startup")
 async def startup_event():
     """サーバー起動時の初期化"""
-    global engine
     print("=" * 70)
     print("DiffSinger Server Starting...")
     print("=" * 70)
 
     try:
-        # 設定ファイル読み込み
-        config_path = 'checkpoints/acoustic/config.yaml'
-        set_hparams(config_path, exp_name='acoustic', print_hparams=False)
-
-        # チェックポイントパス設定
-        hparams['pe_ckpt'] = 'checkpoints/pe'
-        hparams['vocoder_ckpt'] = 'checkpoints/vocoder'
-
-        # 推論エンジン初期化
-        engine = DiffSingerE2EInfer(hparams)
+        # チェックポイントからモデルを登録
+        for spec in discover_specs():
+            engines.register(spec)
+        model_ids = engines.model_ids()
+        if not model_ids:
+            model_root = EXPORT_ROOT if RUNTIME == 'exported' else CHECKPOINT_ROOT
+            raise RuntimeError(f"No acoustic models found in {model_root}/ (runtime: {RUNTIME})")
+        default_model = DEFAULT_MODEL_ID if DEFAULT_MODEL_ID in model_ids else model_ids[0]
+
+        # 既定モデルの推論エンジン初期化
+        engine, _ = engines.activate(default_model)
         print("[OK] DiffSinger Engine initialized successfully")
-        print(f"   Sample Rate: {hparams['audio_sample_rate']} Hz")
+        print(f"   Runtime: {RUNTIME}" + (f" ({engine.format})" if RUNTIME == 'exported' else ""))
+        print(f"   Models: {model_ids} (active: {default_model})")
+        print(f"   Sample Rate: {engine.hparams['audio_sample_rate']} Hz")
         print(f"   Device: {'cuda' if engine.device == 'cuda' else 'cpu'}")
         print("[OK] Server ready at http://localhost:8001")
         print("[OK] API docs at http://localhost:8001/docs")
@@ -115,7 +171,61 @@ async def health_check():
     """ヘルスチェック"""
     return {
         "status": "healthy",
-        "engine": "ready" if engine else "not_initialized"
+        "engine": "ready" if engines.active_model_id else "not_initialized",
+        "runtime": RUNTIME,
+        "engines": engines.stats(),
+        "micro_batch": engines.active.batcher.stats() if engines.active_model_id else None
+    }
+
+
+@app.get("/api/models")
+async def get_models():
+    """登録済みモデル一覧（常駐状態を含む）"""
+    return {
+        "models": [engines.describe(model_id) for model_id in engines.model_ids()],
+        "current": engines.active_model_id,
+        "total": len(engines.model_ids())
+    }
+
+
+@app.post("/api/models/{model_id}/load")
+async def load_model(model_id: str):
+    """
+    アクティブモデルを切り替え（常駐済みならポインタの差し替えのみ）
+
+    Args:
+        model_id: ロードするモデルのID
+
+    Returns:
+        dict: モデルロード結果
+
+    Raises:
+        HTTPException: モデルが見つからない場合、またはロードに失敗した場合
+    """
+    model_ids = engines.model_ids()
+    if model_id not in model_ids:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Model {model_id} not found. Available models: {model_ids}"
+        )
+
+    previous_model = engines.active_model_id
+    try:
+        if engines.is_resident(model_id):
+            _, was_resident = engines.activate(model_id)
+        else:
+            # チェックポイントのロードはイベントループを塞がないようスレッドで実行
+            _, was_resident = await asyncio.get_running_loop().run_in_executor(None, engines.activate, model_id)
+    except Exception as e:
+        print(f"[ERROR] Failed to load model {model_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Model load failed: {str(e)}")
+
+    return {
+        "status": "success",
+        "message": f"Model {model_id} {'activated' if was_resident else 'loaded'} successfully",
+        "previous_model": previous_model,
+        "current_model": model_id,
+        "was_resident": was_resident
     }
 
 
@@ -133,8 +243,14 @@ async def synthesize_voice(request: SynthesisRequest):
     Raises:
         HTTPException: 推論エラー時
     """
+    engine = engines.active
     if not engine:
         raise HTTPException(status_code=503, detail="Engine not initialized")
+    if request.sampler is not None and request.sampler not in SAMPLERS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown sampler {request.sampler}. Available samplers: {list(SAMPLERS)}"
+        )
 
     try:
         print(f"\n[SYNTHESIS] Request:")
@@ -147,12 +263,15 @@ async def synthesize_voice(request: SynthesisRequest):
             'text': request.lyrics,
             'notes': request.notes,
             'notes_duration': request.durations,
-            'input_type': 'word'
+            'input_type': 'word',
+            'sampler': request.sampler,
+            'sampler_steps': request.sampler_steps
         }
 
         # 推論実行
         print("   [INFERENCE] Running...")
-        wav_out = engine.infer_once(inp)
+        # 同時に届いたリクエストとまとめてバッチ推論（推論はスレッドプールで実行）
+        wav_out = await engine.batcher.submit(inp)
 
         # WAV保存
         print(f"   [SAVE] Saving to {request.output_path}...")
@@ -160,7 +279,7 @@ async def synthesize_voice(request: SynthesisRequest):
         output_path.parent.mkdir(parents=True, exist_ok=True)
 
         # 正規化してWAV保存
-        sample_rate = hparams['audio_sample_rate']
+        sample_rate = engine.hparams['audio_sample_rate']
         save_wav(wav_out, str(output_path), sample_rate, norm=True)
 
         # 長さ計算
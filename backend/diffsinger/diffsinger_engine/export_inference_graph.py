@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DiffSinger 推論グラフの書き出し
+
+チェックポイントから構築したモデルのうち、推論で使う部分だけを TorchScript または ONNX のグラフとして書き出します。
+- acoustic: FastSpeech2MIDI（音素・ノート → fs2 mel・拡散の条件）と DiffNet の条件射影
+- denoiser: DiffNet のノイズ予測（拡散ステップの射影は step_projections.npy に前計算）
+- vocoder: HifiGanGenerator（pe_enable ならピッチ抽出器を含む）
+
+書き出したディレクトリは DIFFSINGER_RUNTIME=exported のサーバー（core.exported_engine）が読み込みます。
+--check を付けると、書き出したグラフの出力を元のモデルと比較します。
+
+使用方法:
+    python export_inference_graph.py --format onnx
+    python export_inference_graph.py --model acoustic --format torchscript --check
+"""
+import sys
+import io
+import os
+import argparse
+import json
+import time
+
+# Windows環境でUTF-8出力を強制
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+# 書き出しはチェックポイントから構築したモデルで行う
+os.environ['DIFFSINGER_RUNTIME'] = 'pytorch'
+
+import numpy as np
+import torch
+from torch import nn
+
+from diffsinger import build_engine, CHECKPOINT_ROOT, DEFAULT_MODEL_ID, EXPORT_ROOT
+from core.engine_registry import discover_model_specs
+from core.exported_engine import ExportedSVSInfer, GRAPH_IO, MANIFEST_NAME, STEP_PROJECTIONS_NAME
+from utils.hparams import hparams_scope
+
+EXPORT_FORMATS = {'torchscript': '.pt', 'onnx': '.onnx'}
+ONNX_OPSET = 13
+
+# 可変長の軸（ONNX の dynamic_axes）
+DYNAMIC_AXES = {
+    'acoustic': {
+        'txt_tokens': {0: 'batch', 1: 'tokens'},
+        'pitch_midi': {0: 'batch', 1: 'tokens'},
+        'midi_dur': {0: 'batch', 1: 'tokens'},
+        'is_slur': {0: 'batch', 1: 'tokens'},
+        'x_start': {0: 'batch', 3: 'frames'},
+        'conditioners': {1: 'batch', 3: 'frames'},
+        'mel2ph': {0: 'batch', 1: 'frames'},
+        'f0_denorm': {0: 'batch', 1: 'frames'}
+    },
+    'denoiser': {
+        'spec': {0: 'batch', 3: 'frames'},
+        'conditioners': {1: 'batch', 3: 'frames'},
+        'noise': {0: 'batch', 3: 'frames'}
+    },
+    'vocoder': {
+        'mel': {0: 'batch', 1: 'frames'},
+        'f0': {0: 'batch', 1: 'frames'},
+        'nonpadding': {0: 'batch', 1: 'frames'},
+        'wav': {0: 'batch', 1: 'samples'}
+    }
+}
+
+# トレース用の入力（長さの違う2フレーズをバッチにして、バッチ・長さが固定されないようにする）
+TRACE_INPUTS = [
+    {
+        'text': '卡爱鲁诺乌他嘎',
+        'notes': 'C4 | D4 | E4 | F4 | E4 | D4 | C4',
+        'notes_duration': '0.5 | 0.5 | 0.5 | 0.5 | 0.5 | 0.5 | 0.5',
+        'input_type': 'word'
+    },
+    {
+        'text': '卡爱鲁诺',
+        'notes': 'C4 | D4 | E4 | F4',
+        'notes_duration': '0.5 | 0.5 | 0.5 | 0.5',
+        'input_type': 'word'
+    }
+]
+# 書き出し後の確認用の入力（トレースと異なるバッチサイズ・長さ）
+CHECK_INPUT = {
+    'text': '小酒窝长睫毛',
+    'notes': 'C#4/Db4 | F#4/Gb4 | G#4/Ab4 | A#4/Bb4 F#4/Gb4 | F#4/Gb4 C#4/Db4 | C#4/Db4',
+    'notes_duration': '0.407140 | 0.376190 | 0.242180 | 0.509550 0.183420 | 0.315400 0.235020 | 0.361660',
+    'input_type': 'word'
+}
+
+
+class AcousticGraph(nn.Module):
+    """fs2 の推論と拡散の初期値・条件射影（GaussianDiffusion.forward の拡散ループより前）"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, txt_tokens, pitch_midi, midi_dur, is_slur):
+        model = self.model
+        ret = model.fs2(txt_tokens, None, None, None, None, None, None, skip_decoder=False, infer=True,
+                        pitch_midi=pitch_midi, midi_dur=midi_dur, is_slur=is_slur)
+        cond = ret['decoder_inp'].transpose(1, 2)
+        x_start = model.norm_spec(ret['mel_out']).transpose(1, 2)[:, None, :, :]  # [B, 1, M, T]
+        conditioners = model.denoise_fn.project_conditioner(cond)  # [L, B, 2C, T]
+        f0_denorm = ret.get('f0_denorm')
+        if f0_denorm is None:
+            f0_denorm = torch.zeros_like(ret['mel2ph'], dtype=torch.float32)
+        return x_start, conditioners, ret['mel2ph'], f0_denorm
+
+
+class DenoiserGraph(nn.Module):
+    """拡散1ステップ分のノイズ予測（DiffNet.forward_cached）"""
+
+    def __init__(self, denoise_fn):
+        super().__init__()
+        self.denoise_fn = denoise_fn
+
+    def forward(self, spec, conditioners, step_projection):
+        return self.denoise_fn.forward_cached(spec, conditioners, step_projection)
+
+
+class VocoderGraph(nn.Module):
+    """
+    mel から波形まで（pe_enable ならピッチ抽出器の f0、そうでなければ fs2 の f0 を使う）
+
+    mel のパディングフレームは無音（spec_min）で埋めて渡す。ピッチ抽出器は全ビン0のフレームを
+    パディングとして扱うため、nonpadding（[B, T]、パディングは0）で0にしてから渡す。
+    """
+
+    def __init__(self, vocoder, pe, use_nsf):
+        super().__init__()
+        self.vocoder = vocoder
+        self.pe = pe
+        self.use_nsf = use_nsf
+
+    def forward(self, mel, f0, nonpadding):
+        if self.pe is not None:
+            f0 = self.pe(mel * nonpadding[:, :, None])['f0_denorm_pred']
+        c = mel.transpose(2, 1)  # [B, 80, T]
+        wav = self.vocoder(c, f0 * nonpadding) if self.use_nsf else self.vocoder(c)
+        return wav.reshape(mel.shape[0], -1)  # [B, T * hop_size]
+
+
+def build_graphs(engine) -> dict:
+    """書き出すグラフ（nn.Module）を構築"""
+    model = engine.model
+    if not hasattr(model.denoise_fn, 'forward_cached'):
+        raise ValueError(f"Only the wavenet (DiffNet) denoiser can be exported, got {type(model.denoise_fn).__name__}")
+    pe = engine.pe if engine.hparams.get('pe_enable') else None
+    return {
+        'acoustic': AcousticGraph(model).eval(),
+        'denoiser': DenoiserGraph(model.denoise_fn).eval(),
+        'vocoder': VocoderGraph(engine.vocoder, pe, bool(engine.hparams.get('use_nsf'))).eval()
+    }
+
+
+def example_inputs(engine, graphs: dict, inputs: list) -> dict:
+    """各グラフの入力例（acoustic の出力から denoiser・vocoder の入力を作る）"""
+    items = [engine.preprocess_input(inp, input_type='word') for inp in inputs]
+    batch = engine.inputs_to_batch(items)
+    acoustic_args = tuple(batch[name] for name in GRAPH_IO['acoustic'][0])
+    x_start, conditioners, mel2ph, f0_denorm = graphs['acoustic'](*acoustic_args)
+
+    model = engine.model
+    step_projection = model.denoise_fn.project_step(torch.tensor([model.K_step - 1], device=x_start.device))
+    nonpadding = (mel2ph > 0).float()
+    mel = torch.where(mel2ph[:, :, None] > 0, model.denorm_spec(x_start[:, 0].transpose(1, 2)), model.spec_min)
+    return {
+        'acoustic': acoustic_args,
+        'denoiser': (x_start, conditioners, step_projection),
+        'vocoder': (mel, f0_denorm, nonpadding)
+    }
+
+
+def save_graph(module: nn.Module, name: str, args: tuple, path: str, export_format: str) -> None:
+    """1つのグラフを TorchScript（トレースして freeze）または ONNX で保存"""
+    input_names, output_names = GRAPH_IO[name]
+    if export_format == 'torchscript':
+        traced = torch.jit.trace(module, args, check_trace=False)
+        torch.jit.freeze(traced).save(path)
+    else:
+        torch.onnx.export(module, args, path, input_names=input_names, output_names=output_names,
+                          dynamic_axes=DYNAMIC_AXES[name], opset_version=ONNX_OPSET, do_constant_folding=True)
+
+
+def export(engine, model_id: str, export_format: str, output_dir: str) -> dict:
+    """
+    推論グラフ・拡散ステップ射影・マニフェストを書き出す
+
+    Returns:
+        dict: マニフェスト
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    model = engine.model
+    hp = engine.hparams
+    graphs = build_graphs(engine)
+
+    with hparams_scope(hp), torch.no_grad():
+        args = example_inputs(engine, graphs, TRACE_INPUTS)
+        manifest_graphs = {}
+        for name, module in graphs.items():
+            filename = name + EXPORT_FORMATS[export_format]
+            start = time.perf_counter()
+            save_graph(module, name, args[name], os.path.join(output_dir, filename), export_format)
+            size_mb = os.path.getsize(os.path.join(output_dir, filename)) / 1024 / 1024
+            print(f"[EXPORT] {name}: {filename} ({size_mb:.1f} MB, {time.perf_counter() - start:.1f}s)")
+            manifest_graphs[name] = {'file': filename, 'inputs': GRAPH_IO[name][0], 'outputs': GRAPH_IO[name][1]}
+
+        # 拡散ステップの射影は K_step 通りしかないので、全ステップ分を前計算して保存 [K, L, 1, C, 1]
+        step_projections = model.denoise_fn.project_step(torch.arange(model.K_step))
+        step_projections = step_projections.permute(1, 0, 2, 3).unsqueeze(2).contiguous()
+        np.save(os.path.join(output_dir, STEP_PROJECTIONS_NAME), step_projections.cpu().numpy())
+
+    manifest = {
+        'format': export_format,
+        'model_id': model_id,
+        'graphs': manifest_graphs,
+        'step_projections': STEP_PROJECTIONS_NAME,
+        'sampling_coefs': model.sampling_coefs,
+        'spec_min': model.spec_min.flatten().tolist(),
+        'spec_max': model.spec_max.flatten().tolist(),
+        'phone_vocab': {token: i for i, token in enumerate(engine.ph_encoder.decode_list(
+            range(engine.ph_encoder.vocab_size)))},
+        'replace_oov': ',',
+        'hparams': {
+            'audio_sample_rate': hp['audio_sample_rate'],
+            'hop_size': hp['hop_size'],
+            'max_frames': hp['max_frames'],
+            'audio_num_mel_bins': hp['audio_num_mel_bins'],
+            'timesteps': hp['timesteps'],
+            'K_step': hp['K_step'],
+            'diff_sampler': hp.get('diff_sampler'),
+            'diff_sampler_steps': hp.get('diff_sampler_steps', 20),
+            'pndm_speedup': hp.get('pndm_speedup'),
+            'gaussian_start': hp.get('gaussian_start'),
+            'pe_enable': bool(hp.get('pe_enable')),
+            'use_nsf': bool(hp.get('use_nsf'))
+        }
+    }
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def check(engine, output_dir: str) -> None:
+    """トレース時と異なる入力で、書き出したグラフの出力を元のモデルと比較"""
+    graphs = build_graphs(engine)
+    exported = ExportedSVSInfer(output_dir)
+    with hparams_scope(engine.hparams), torch.no_grad():
+        args = example_inputs(engine, graphs, [CHECK_INPUT])
+        for name, module in graphs.items():
+            expected = module(*args[name])
+            expected = expected if isinstance(expected, tuple) else (expected,)
+            actual = exported.backend.run(name, dict(zip(GRAPH_IO[name][0], (a.cpu().numpy() for a in args[name]))))
+            for output_name, e, a in zip(GRAPH_IO[name][1], expected, actual):
+                e = e.cpu().numpy()
+                if e.shape != a.shape:
+                    print(f"[CHECK] {name}.{output_name}: shape mismatch {a.shape} vs {e.shape}")
+                else:
+                    print(f"[CHECK] {name}.{output_name}: max abs diff {np.abs(a.astype(np.float64) - e).max():.2e}")
+
+    wav = exported.infer_once(dict(CHECK_INPUT, sampler='dpm-solver++', sampler_steps=10))
+    print(f"[CHECK] exported runtime synthesized {len(wav) / exported.hparams['audio_sample_rate']:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export DiffSinger inference graphs")
+    parser.add_argument("--model", default=DEFAULT_MODEL_ID, help="Model ID under checkpoints/")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), default='torchscript', help="Graph format")
+    parser.add_argument("--output", default=None, help="Output directory (default: exported/<model>)")
+    parser.add_argument("--check", action="store_true", help="Compare exported graphs with the original model")
+    args = parser.parse_args()
+
+    specs = {spec.model_id: spec for spec in discover_model_specs(CHECKPOINT_ROOT)}
+    if args.model not in specs:
+        parser.error(f"Model {args.model} not found. Available models: {list(specs)}")
+    output_dir = args.output or os.path.join(EXPORT_ROOT, args.model)
+
+    print("=" * 70)
+    print(f"DiffSinger graph export ({args.model} -> {output_dir}, {args.format})")
+    print("=" * 70)
+    engine = build_engine(specs[args.model])
+    export(engine, args.model, args.format, output_dir)
+    if args.check:
+        check(engine, output_dir)
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+from contextlib import contextmanager
 
 import torch
 import numpy as np
@@ -15,17 +16,11 @@ except ImportError:
     class HifiGAN:
         def __init__(self, *args, **kwargs):
             pass
-# インポートを安全に処理
-try:
-    from inference.svs.opencpop.map import cpop_pinyin2ph_func
-except ImportError:
-    def cpop_pinyin2ph_func(pinyin_list):
-        # フォールバック: 簡易音素変換
-        return [p for p in pinyin_list]
+from inference.svs.svs_frontend import SVSFrontend, PHONE_LIST
 
 try:
     from utils import load_ckpt
-    from utils.hparams import set_hparams, hparams
+    from utils.hparams import set_hparams, hparams, hparams_scope
     from utils.text_encoder import TokenTextEncoder
 except ImportError:
     # フォールバック実装
@@ -40,36 +35,34 @@ except ImportError:
         def get(key, default=None):
             return default
 
+    @contextmanager
+    def hparams_scope(scoped_hparams):
+        yield scoped_hparams
+
     class TokenTextEncoder:
         def __init__(self, *args, **kwargs):
             pass
-from pypinyin import pinyin, lazy_pinyin, Style
-import librosa
 import glob
 import re
 
 
-class BaseSVSInfer:
+class BaseSVSInfer(SVSFrontend):
     def __init__(self, hparams, device=None):
         if device is None:
             device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        self.hparams = hparams
+        # エンジンごとに独立したhparams（複数モデルを同じプロセスに常駐させるため、以降はこのスコープで動かす）
+        self.hparams = dict(hparams)
         self.device = device
 
-        phone_list = ["AP", "SP", "a", "ai", "an", "ang", "ao", "b", "c", "ch", "d", "e", "ei", "en", "eng", "er", "f", "g",
-                  "h", "i", "ia", "ian", "iang", "iao", "ie", "in", "ing", "iong", "iu", "j", "k", "l", "m", "n", "o",
-                  "ong", "ou", "p", "q", "r", "s", "sh", "t", "u", "ua", "uai", "uan", "uang", "ui", "un", "uo", "v",
-                  "van", "ve", "vn", "w", "x", "y", "z", "zh"]
-        self.ph_encoder = TokenTextEncoder(None, vocab_list=phone_list, replace_oov=',')
-        self.pinyin2phs = cpop_pinyin2ph_func()
-        self.spk_map = {'opencpop': 0}
+        super().__init__(TokenTextEncoder(None, vocab_list=PHONE_LIST, replace_oov=','))
 
-        self.model = self.build_model()
-        self.model.eval()
-        self.model.to(self.device)
-        self.vocoder = self.build_vocoder()
-        self.vocoder.eval()
-        self.vocoder.to(self.device)
+        with hparams_scope(self.hparams):
+            self.model = self.build_model()
+            self.model.eval()
+            self.model.to(self.device)
+            self.vocoder = self.build_vocoder()
+            self.vocoder.eval()
+            self.vocoder.to(self.device)
 
     def build_model(self):
         raise NotImplementedError
@@ -114,134 +107,6 @@ class BaseSVSInfer:
             # [T]
         return y[None]
 
-    def preprocess_word_level_input(self, inp):
-        # Pypinyin can't solve polyphonic words
-        text_raw = inp['text'].replace('最长', '最常').replace('长睫毛', '常睫毛') \
-            .replace('那么长', '那么常').replace('多长', '多常') \
-            .replace('很长', '很常')  # We hope someone could provide a better g2p module for us by opening pull requests.
-
-        # lyric
-        pinyins = lazy_pinyin(text_raw, strict=False)
-        ph_per_word_lst = [self.pinyin2phs[pinyin.strip()] for pinyin in pinyins if pinyin.strip() in self.pinyin2phs]
-
-        # Note
-        note_per_word_lst = [x.strip() for x in inp['notes'].split('|') if x.strip() != '']
-        mididur_per_word_lst = [x.strip() for x in inp['notes_duration'].split('|') if x.strip() != '']
-
-        if len(note_per_word_lst) == len(ph_per_word_lst) == len(mididur_per_word_lst):
-            print('Pass word-notes check.')
-        else:
-            print('The number of words does\'t match the number of notes\' windows. ',
-                  'You should split the note(s) for each word by | mark.')
-            print(ph_per_word_lst, note_per_word_lst, mididur_per_word_lst)
-            print(len(ph_per_word_lst), len(note_per_word_lst), len(mididur_per_word_lst))
-            return None
-
-        note_lst = []
-        ph_lst = []
-        midi_dur_lst = []
-        is_slur = []
-        for idx, ph_per_word in enumerate(ph_per_word_lst):
-            # for phs in one word:
-            # single ph like ['ai']  or multiple phs like ['n', 'i']
-            ph_in_this_word = ph_per_word.split()
-
-            # for notes in one word:
-            # single note like ['D4'] or multiple notes like ['D4', 'E4'] which means a 'slur' here.
-            note_in_this_word = note_per_word_lst[idx].split()
-            midi_dur_in_this_word = mididur_per_word_lst[idx].split()
-            # process for the model input
-            # Step 1.
-            #  Deal with note of 'not slur' case or the first note of 'slur' case
-            #  j        ie
-            #  F#4/Gb4  F#4/Gb4
-            #  0        0
-            for ph in ph_in_this_word:
-                ph_lst.append(ph)
-                note_lst.append(note_in_this_word[0])
-                midi_dur_lst.append(midi_dur_in_this_word[0])
-                is_slur.append(0)
-            # step 2.
-            #  Deal with the 2nd, 3rd... notes of 'slur' case
-            #  j        ie         ie
-            #  F#4/Gb4  F#4/Gb4    C#4/Db4
-            #  0        0          1
-            if len(note_in_this_word) > 1:  # is_slur = True, we should repeat the YUNMU to match the 2nd, 3rd... notes.
-                for idx in range(1, len(note_in_this_word)):
-                    ph_lst.append(ph_in_this_word[-1])
-                    note_lst.append(note_in_this_word[idx])
-                    midi_dur_lst.append(midi_dur_in_this_word[idx])
-                    is_slur.append(1)
-        ph_seq = ' '.join(ph_lst)
-
-        if len(ph_lst) == len(note_lst) == len(midi_dur_lst):
-            print(len(ph_lst), len(note_lst), len(midi_dur_lst))
-            print('Pass word-notes check.')
-        else:
-            print('The number of words does\'t match the number of notes\' windows. ',
-                  'You should split the note(s) for each word by | mark.')
-            return None
-        return ph_seq, note_lst, midi_dur_lst, is_slur
-
-    def preprocess_phoneme_level_input(self, inp):
-        ph_seq = inp['ph_seq']
-        note_lst = inp['note_seq'].split()
-        midi_dur_lst = inp['note_dur_seq'].split()
-        is_slur = [float(x) for x in inp['is_slur_seq'].split()]
-        print(len(note_lst), len(ph_seq.split()), len(midi_dur_lst))
-        if len(note_lst) == len(ph_seq.split()) == len(midi_dur_lst):
-            print('Pass word-notes check.')
-        else:
-            print('The number of words does\'t match the number of notes\' windows. ',
-                  'You should split the note(s) for each word by | mark.')
-            return None
-        return ph_seq, note_lst, midi_dur_lst, is_slur
-
-    def preprocess_input(self, inp, input_type='word'):
-        """
-
-        :param inp: {'text': str, 'item_name': (str, optional), 'spk_name': (str, optional)}
-        :return:
-        """
-
-        item_name = inp.get('item_name', '<ITEM_NAME>')
-        spk_name = inp.get('spk_name', 'opencpop')
-
-        # single spk
-        spk_id = self.spk_map[spk_name]
-
-        # get ph seq, note lst, midi dur lst, is slur lst.
-        if input_type == 'word':
-            ret = self.preprocess_word_level_input(inp)
-        elif input_type == 'phoneme':  # like transcriptions.txt in Opencpop dataset.
-            ret = self.preprocess_phoneme_level_input(inp)
-        else:
-            print('Invalid input type.')
-            return None
-
-        if ret:
-            ph_seq, note_lst, midi_dur_lst, is_slur = ret
-        else:
-            print('==========> Preprocess_word_level or phone_level input wrong.')
-            return None
-
-        # convert note lst to midi id; convert note dur lst to midi duration
-        try:
-            midis = [librosa.note_to_midi(x.split("/")[0]) if x != 'rest' else 0
-                     for x in note_lst]
-            midi_dur_lst = [float(x) for x in midi_dur_lst]
-        except Exception as e:
-            print(e)
-            print('Invalid Input Type.')
-            return None
-
-        ph_token = self.ph_encoder.encode(ph_seq)
-        item = {'item_name': item_name, 'text': inp['text'], 'ph': ph_seq, 'spk_id': spk_id,
-                'ph_token': ph_token, 'pitch_midi': np.asarray(midis), 'midi_dur': np.asarray(midi_dur_lst),
-                'is_slur': np.asarray(is_slur), }
-        item['ph_len'] = len(item['ph_token'])
-        return item
-
     def input_to_batch(self, item):
         item_names = [item['item_name']]
         text = [item['text']]
@@ -267,14 +132,35 @@ class BaseSVSInfer:
         }
         return batch
 
-    def postprocess_output(self, output):
-        return output
+    def inputs_to_batch(self, items):
+        """
+        複数の前処理済み入力を1つのバッチにまとめる（パディングは SVSFrontend.inputs_to_arrays）
+
+        :param items: preprocess_input の出力のリスト
+        :return: input_to_batch と同じキーのバッチ（txt_lengths に各入力の実際の長さ）
+        """
+        arrays = self.inputs_to_arrays(items, hparams['max_frames'])
+        batch = {
+            'item_name': [item['item_name'] for item in items],
+            'text': [item['text'] for item in items],
+            'ph': [item['ph'] for item in items],
+            'txt_lengths': torch.LongTensor([len(item['ph_token']) for item in items]).to(self.device),
+            'spk_ids': torch.LongTensor([item['spk_id'] for item in items]).to(self.device)
+        }
+        batch.update({k: torch.from_numpy(v).to(self.device) for k, v in arrays.items()})
+        return batch
+
+    def forward_model_batch(self, items):
+        """
+        複数入力をまとめて推論（サブクラスで実装。未実装なら1件ずつ forward_model を呼ぶ）
+
+        :param items: preprocess_input の出力のリスト
+        :return: 入力と同じ順序の出力のリスト
+        """
+        return [self.forward_model(item) for item in items]
 
-    def infer_once(self, inp):
-        inp = self.preprocess_input(inp, input_type=inp['input_type'] if inp.get('input_type') else 'word')
-        output = self.forward_model(inp)
-        output = self.postprocess_output(output)
-        return output
+    def inference_scope(self):
+        return hparams_scope(self.hparams)
 
     @classmethod
     def example_run(cls, inp):
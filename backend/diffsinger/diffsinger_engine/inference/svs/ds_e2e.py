@@ -36,7 +36,8 @@ class DiffSingerE2EInfer(BaseSVSInfer):
         with torch.no_grad():
             output = self.model(txt_tokens, spk_id=spk_id, ref_mels=None, infer=True,
                                 pitch_midi=sample['pitch_midi'], midi_dur=sample['midi_dur'],
-                                is_slur=sample['is_slur'])
+                                is_slur=sample['is_slur'],
+                                sampler=inp.get('sampler'), sampler_steps=inp.get('sampler_steps'))
             mel_out = output['mel_out']  # [B, T,80]
             if hparams.get('pe_enable') is not None and hparams['pe_enable']:
                 f0_pred = self.pe(mel_out)['f0_denorm_pred']  # pe predict from Pred mel
@@ -46,6 +47,43 @@ class DiffSingerE2EInfer(BaseSVSInfer):
         wav_out = wav_out.cpu().numpy()
         return wav_out[0]
 
+    def forward_model_batch(self, items):
+        """
+        複数入力をパディングして1回のfs2+diffusion+vocoderで推論し、入力ごとの波形に分割
+
+        パディング部分は mel2ph == 0（fs2のマスク）となる。PitchExtractor にはその位置を0にしたmelを、
+        ボコーダーには無音（spec_min）で埋めたmelを渡し、入力ごとのフレーム数 × hop_size で切り出す。
+        """
+        if len(items) == 1:
+            return [self.forward_model(items[0])]
+
+        sample = self.inputs_to_batch(items)
+        # サンプラー設定は呼び出し側（infer_batch）でバッチ内を揃えてある
+        with torch.no_grad():
+            output = self.model(sample['txt_tokens'], spk_id=sample.get('spk_ids'), ref_mels=None, infer=True,
+                                pitch_midi=sample['pitch_midi'], midi_dur=sample['midi_dur'],
+                                is_slur=sample['is_slur'],
+                                sampler=items[0]['sampler'], sampler_steps=items[0]['sampler_steps'])
+            # 推論時は GaussianDiffusion がmelをマスクしないため、パディングフレームをここで埋める
+            nonpadding = (output['mel2ph'] > 0)[:, :, None]  # [B, T, 1]
+            mel_out = output['mel_out']  # [B, T, 80]
+            if hparams.get('pe_enable') is not None and hparams['pe_enable']:
+                # PitchExtractor は全ビン0のフレームをパディングとして扱う
+                f0_pred = self.pe(mel_out * nonpadding.float())['f0_denorm_pred']
+            else:
+                f0_pred = output['f0_denorm']
+            # 対数メルの0は大きな音になり、ボコーダーの受容野を通して短い入力の末尾に漏れるため、
+            # ボコーダーには無音（spec_min）で埋めたmelを渡す
+            c = torch.where(nonpadding, mel_out, self.model.spec_min).transpose(2, 1)  # [B, 80, T]
+            if hparams.get('use_nsf'):
+                wav_out = self.vocoder(c, f0_pred * nonpadding[:, :, 0].float())
+            else:
+                wav_out = self.vocoder(c)
+            wav_out = wav_out.reshape(len(items), -1)  # [B, T * hop_size]
+        mel_lens = (output['mel2ph'] > 0).sum(-1).tolist()
+        wav_out = wav_out.cpu().numpy()
+        return [wav_out[i, :mel_len * hparams['hop_size']] for i, mel_len in enumerate(mel_lens)]
+
 if __name__ == '__main__':
     inp = {
         'text': '小酒窝长睫毛AP是你最美的记号',
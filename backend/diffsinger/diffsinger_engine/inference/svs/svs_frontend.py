@@ -0,0 +1,274 @@
+"""
+DiffSinger SVS Frontend
+
+歌詞・ノート入力を音響モデルの入力（音素ID・MIDIノート・ノート長・スラー）に変換する前処理。
+torch に依存しないため、チェックポイントから構築する BaseSVSInfer と、書き出した推論グラフで動く
+軽量ランタイム（core.exported_engine）で共有する。
+バッチへのまとめ方（infer_once / infer_batch）も共通で、各ランタイムは forward_model_batch だけを実装する。
+"""
+from contextlib import nullcontext
+
+import numpy as np
+from pypinyin import pinyin, lazy_pinyin, Style
+import librosa
+
+# インポートを安全に処理
+try:
+    from inference.svs.opencpop.map import cpop_pinyin2ph_func
+except ImportError:
+    def cpop_pinyin2ph_func(pinyin_list):
+        # フォールバック: 簡易音素変換
+        return [p for p in pinyin_list]
+
+PHONE_LIST = ["AP", "SP", "a", "ai", "an", "ang", "ao", "b", "c", "ch", "d", "e", "ei", "en", "eng", "er", "f", "g",
+              "h", "i", "ia", "ian", "iang", "iao", "ie", "in", "ing", "iong", "iu", "j", "k", "l", "m", "n", "o",
+              "ong", "ou", "p", "q", "r", "s", "sh", "t", "u", "ua", "uai", "uan", "uang", "ui", "un", "uo", "v",
+              "van", "ve", "vn", "w", "x", "y", "z", "zh"]
+
+
+class PhoneEncoder:
+    """
+    音素IDの辞書だけで動く TokenTextEncoder.encode 相当のエンコーダー（utils.text_encoder は torch を読み込むため）
+
+    Attributes:
+        token_to_id (dict): 音素 -> ID（予約トークンを含む）
+        replace_oov (str): 辞書にない音素の置き換え先
+    """
+
+    def __init__(self, token_to_id, replace_oov=None):
+        self.token_to_id = dict(token_to_id)
+        self.replace_oov = replace_oov
+
+    def encode(self, s):
+        """空白区切りの音素列をIDのリストに変換"""
+        tokens = s.strip().split()
+        if self.replace_oov is not None:
+            tokens = [t if t in self.token_to_id else self.replace_oov for t in tokens]
+        return [self.token_to_id[tok] for tok in tokens]
+
+
+class SVSFrontend:
+    """
+    歌詞・ノート入力の前処理
+
+    Attributes:
+        ph_encoder: 音素列をIDに変換するエンコーダー（encode(ph_seq) -> List[int]）
+        pinyin2phs (dict): ピンイン -> 音素列
+        spk_map (dict): 話者名 -> 話者ID
+    """
+
+    def __init__(self, ph_encoder):
+        self.ph_encoder = ph_encoder
+        self.pinyin2phs = cpop_pinyin2ph_func()
+        self.spk_map = {'opencpop': 0}
+
+    def preprocess_word_level_input(self, inp):
+        # Pypinyin can't solve polyphonic words
+        text_raw = inp['text'].replace('最长', '最常').replace('长睫毛', '常睫毛') \
+            .replace('那么长', '那么常').replace('多长', '多常') \
+            .replace('很长', '很常')  # We hope someone could provide a better g2p module for us by opening pull requests.
+
+        # lyric
+        pinyins = lazy_pinyin(text_raw, strict=False)
+        ph_per_word_lst = [self.pinyin2phs[pinyin.strip()] for pinyin in pinyins if pinyin.strip() in self.pinyin2phs]
+
+        # Note
+        note_per_word_lst = [x.strip() for x in inp['notes'].split('|') if x.strip() != '']
+        mididur_per_word_lst = [x.strip() for x in inp['notes_duration'].split('|') if x.strip() != '']
+
+        if len(note_per_word_lst) == len(ph_per_word_lst) == len(mididur_per_word_lst):
+            print('Pass word-notes check.')
+        else:
+            print('The number of words does\'t match the number of notes\' windows. ',
+                  'You should split the note(s) for each word by | mark.')
+            print(ph_per_word_lst, note_per_word_lst, mididur_per_word_lst)
+            print(len(ph_per_word_lst), len(note_per_word_lst), len(mididur_per_word_lst))
+            return None
+
+        note_lst = []
+        ph_lst = []
+        midi_dur_lst = []
+        is_slur = []
+        for idx, ph_per_word in enumerate(ph_per_word_lst):
+            # for phs in one word:
+            # single ph like ['ai']  or multiple phs like ['n', 'i']
+            ph_in_this_word = ph_per_word.split()
+
+            # for notes in one word:
+            # single note like ['D4'] or multiple notes like ['D4', 'E4'] which means a 'slur' here.
+            note_in_this_word = note_per_word_lst[idx].split()
+            midi_dur_in_this_word = mididur_per_word_lst[idx].split()
+            # process for the model input
+            # Step 1.
+            #  Deal with note of 'not slur' case or the first note of 'slur' case
+            #  j        ie
+            #  F#4/Gb4  F#4/Gb4
+            #  0        0
+            for ph in ph_in_this_word:
+                ph_lst.append(ph)
+                note_lst.append(note_in_this_word[0])
+                midi_dur_lst.append(midi_dur_in_this_word[0])
+                is_slur.append(0)
+            # step 2.
+            #  Deal with the 2nd, 3rd... notes of 'slur' case
+            #  j        ie         ie
+            #  F#4/Gb4  F#4/Gb4    C#4/Db4
+            #  0        0          1
+            if len(note_in_this_word) > 1:  # is_slur = True, we should repeat the YUNMU to match the 2nd, 3rd... notes.
+                for idx in range(1, len(note_in_this_word)):
+                    ph_lst.append(ph_in_this_word[-1])
+                    note_lst.append(note_in_this_word[idx])
+                    midi_dur_lst.append(midi_dur_in_this_word[idx])
+                    is_slur.append(1)
+        ph_seq = ' '.join(ph_lst)
+
+        if len(ph_lst) == len(note_lst) == len(midi_dur_lst):
+            print(len(ph_lst), len(note_lst), len(midi_dur_lst))
+            print('Pass word-notes check.')
+        else:
+            print('The number of words does\'t match the number of notes\' windows. ',
+                  'You should split the note(s) for each word by | mark.')
+            return None
+        return ph_seq, note_lst, midi_dur_lst, is_slur
+
+    def preprocess_phoneme_level_input(self, inp):
+        ph_seq = inp['ph_seq']
+        note_lst = inp['note_seq'].split()
+        midi_dur_lst = inp['note_dur_seq'].split()
+        is_slur = [float(x) for x in inp['is_slur_seq'].split()]
+        print(len(note_lst), len(ph_seq.split()), len(midi_dur_lst))
+        if len(note_lst) == len(ph_seq.split()) == len(midi_dur_lst):
+            print('Pass word-notes check.')
+        else:
+            print('The number of words does\'t match the number of notes\' windows. ',
+                  'You should split the note(s) for each word by | mark.')
+            return None
+        return ph_seq, note_lst, midi_dur_lst, is_slur
+
+    def preprocess_input(self, inp, input_type='word'):
+        """
+
+        :param inp: {'text': str, 'item_name': (str, optional), 'spk_name': (str, optional)}
+        :return:
+        """
+
+        item_name = inp.get('item_name', '<ITEM_NAME>')
+        spk_name = inp.get('spk_name', 'opencpop')
+
+        # single spk
+        spk_id = self.spk_map[spk_name]
+
+        # get ph seq, note lst, midi dur lst, is slur lst.
+        if input_type == 'word':
+            ret = self.preprocess_word_level_input(inp)
+        elif input_type == 'phoneme':  # like transcriptions.txt in Opencpop dataset.
+            ret = self.preprocess_phoneme_level_input(inp)
+        else:
+            print('Invalid input type.')
+            return None
+
+        if ret:
+            ph_seq, note_lst, midi_dur_lst, is_slur = ret
+        else:
+            print('==========> Preprocess_word_level or phone_level input wrong.')
+            return None
+
+        # convert note lst to midi id; convert note dur lst to midi duration
+        try:
+            midis = [librosa.note_to_midi(x.split("/")[0]) if x != 'rest' else 0
+                     for x in note_lst]
+            midi_dur_lst = [float(x) for x in midi_dur_lst]
+        except Exception as e:
+            print(e)
+            print('Invalid Input Type.')
+            return None
+
+        ph_token = self.ph_encoder.encode(ph_seq)
+        item = {'item_name': item_name, 'text': inp['text'], 'ph': ph_seq, 'spk_id': spk_id,
+                'ph_token': ph_token, 'pitch_midi': np.asarray(midis), 'midi_dur': np.asarray(midi_dur_lst),
+                'is_slur': np.asarray(is_slur), }
+        item['ph_len'] = len(item['ph_token'])
+        # 拡散サンプラーの指定（Noneなら hparams の設定）
+        item['sampler'] = inp.get('sampler')
+        item['sampler_steps'] = inp.get('sampler_steps')
+        return item
+
+    def inputs_to_arrays(self, items, max_frames):
+        """
+        複数の前処理済み入力を音響モデルの入力配列にまとめる（音素列は0=PADで右詰めパディング）
+
+        :param items: preprocess_input の出力のリスト
+        :param max_frames: hparams['max_frames']
+        :return: 入力名（txt_tokens / pitch_midi / midi_dur / is_slur） -> [B, T_txt] の numpy 配列
+        """
+        max_len = max(len(item['ph_token']) for item in items)
+
+        def pad(values, dtype):
+            padded = np.zeros((len(items), max_len), dtype=dtype)
+            for i, value in enumerate(values):
+                padded[i, :len(value)] = np.asarray(value, dtype=dtype)
+            return padded
+
+        return {
+            'txt_tokens': pad([item['ph_token'] for item in items], np.int64),
+            'pitch_midi': pad([item['pitch_midi'] for item in items], np.int64)[:, :max_frames],
+            'midi_dur': pad([item['midi_dur'] for item in items], np.float32)[:, :max_frames],
+            'is_slur': pad([item['is_slur'] for item in items], np.int64)[:, :max_frames]
+        }
+
+    def inference_scope(self):
+        """推論中に有効にするコンテキスト（BaseSVSInfer はエンジンごとの hparams_scope）"""
+        return nullcontext()
+
+    def forward_model_batch(self, items):
+        """
+        複数入力をまとめて推論（各ランタイムで実装）
+
+        :param items: preprocess_input の出力のリスト（サンプラー設定は揃っていること）
+        :return: 入力と同じ順序の出力のリスト
+        """
+        raise NotImplementedError
+
+    def forward_model(self, item):
+        return self.forward_model_batch([item])[0]
+
+    def postprocess_output(self, output):
+        return output
+
+    def preprocess_request(self, inp):
+        """infer_once / infer_batch の入力を前処理（input_type の既定は word。失敗したら None）"""
+        return self.preprocess_input(inp, input_type=inp['input_type'] if inp.get('input_type') else 'word')
+
+    def infer_once(self, inp):
+        with self.inference_scope():
+            item = self.preprocess_request(inp)
+            if item is None:
+                raise ValueError('Invalid input: lyrics and notes could not be aligned')
+            output = self.forward_model(item)
+            output = self.postprocess_output(output)
+        return output
+
+    def infer_batch(self, inps):
+        """
+        複数入力をまとめて推論（マイクロバッチ用）
+
+        前処理に失敗した入力はバッチから外し、その位置に例外を返す。
+
+        :param inps: infer_once と同じ形式の入力のリスト
+        :return: 入力と同じ順序の出力（失敗した入力は Exception）のリスト
+        """
+        with self.inference_scope():
+            results = [None] * len(inps)
+            groups = {}
+            for i, inp in enumerate(inps):
+                item = self.preprocess_request(inp)
+                if item is None:
+                    results[i] = ValueError('Invalid input: lyrics and notes could not be aligned')
+                else:
+                    # サンプラー設定が同じ入力ごとにまとめて推論
+                    groups.setdefault((item['sampler'], item['sampler_steps']), []).append((item, i))
+            for group in groups.values():
+                outputs = self.forward_model_batch([item for item, _ in group])
+                for (_, i), output in zip(group, outputs):
+                    results[i] = self.postprocess_output(output)
+        return results
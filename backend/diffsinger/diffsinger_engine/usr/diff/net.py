@@ -66,6 +66,10 @@ class ResidualBlock(nn.Module):
     def forward(self, x, conditioner, diffusion_step):
         diffusion_step = self.diffusion_projection(diffusion_step).unsqueeze(-1)
         conditioner = self.conditioner_projection(conditioner)
+        return self.forward_projected(x, conditioner, diffusion_step)
+
+    def forward_projected(self, x, conditioner, diffusion_step):
+        """conditioner・diffusion_step が射影済み（[B, 2C, T]・[B, C, 1]）の場合の forward"""
         y = x + diffusion_step
 
         y = self.dilated_conv(y) + conditioner
@@ -128,3 +132,43 @@ class DiffNet(nn.Module):
         x = F.relu(x)
         x = self.output_projection(x)  # [B, 80, T]
         return x[:, None, :, :]
+
+    # サンプリング中は cond が変わらず、拡散ステップも有限個なので、その射影を前計算して使い回す
+    def project_conditioner(self, cond):
+        """
+        :param cond: [B, M, T]
+        :return: 全残差層の conditioner 射影 [L, B, 2C, T]
+        """
+        return torch.stack([layer.conditioner_projection(cond) for layer in self.residual_layers])
+
+    def project_step(self, diffusion_step):
+        """
+        :param diffusion_step: [B]
+        :return: 全残差層の拡散ステップ射影 [L, B, C, 1]
+        """
+        diffusion_step = self.mlp(self.diffusion_embedding(diffusion_step))
+        return torch.stack([layer.diffusion_projection(diffusion_step).unsqueeze(-1) for layer in self.residual_layers])
+
+    def forward_cached(self, spec, conditioners, step_projections):
+        """
+        project_conditioner・project_step の結果を使う forward（出力は forward と同じ）
+
+        :param spec: [B, 1, M, T]
+        :param conditioners: [L, B, 2C, T]
+        :param step_projections: [L, B or 1, C, 1]
+        :return: [B, 1, M, T]
+        """
+        x = spec[:, 0]
+        x = self.input_projection(x)  # x [B, residual_channel, T]
+
+        x = F.relu(x)
+        skip = []
+        for layer, conditioner, diffusion_step in zip(self.residual_layers, conditioners, step_projections):
+            x, skip_connection = layer.forward_projected(x, conditioner, diffusion_step)
+            skip.append(skip_connection)
+
+        x = torch.sum(torch.stack(skip), dim=0) / sqrt(len(self.residual_layers))
+        x = self.skip_projection(x)
+        x = F.relu(x)
+        x = self.output_projection(x)  # [B, 80, T]
+        return x[:, None, :, :]
@@ -0,0 +1,176 @@
+"""
+配列の型に依存しない拡散サンプラー
+
+GaussianDiffusion（usr.diff.shallow_diffusion_tts、torch）と、書き出した推論グラフで動く軽量ランタイム
+（core.exported_engine、numpy）で共有するサンプラーの唯一の実装。
+更新式は GaussianDiffusion.sampling_coefs と同じキーの係数（Pythonのfloat）と denoiser(x, step) -> ノイズ予測 で計算し、
+配列ごとに異なる操作（x_0 のクリップと乱数）は clamp / noise_like として呼び出し側が渡す。
+"""
+import math
+from collections import deque
+
+import numpy as np
+
+# 推論時のサンプラー（hparams['diff_sampler'] またはリクエストごとに指定）
+# ddpm: 祖先サンプリング（K_stepステップ）、plms: PNDM（pndm_speedup間隔）
+# ddim / dpm-solver++: diff_sampler_steps ステップに間引いた決定的サンプラー
+SAMPLERS = ('ddpm', 'plms', 'ddim', 'dpm-solver++')
+
+
+def sampling_timesteps(k_step, steps):
+    """
+    K_step未満のタイムステップから steps 個を降順に等間隔で選ぶ（先頭は K_step-1、末尾は0）
+    """
+    steps = max(1, min(int(steps), k_step))
+    return np.unique(np.linspace(0, k_step - 1, steps).round().astype(np.int64))[::-1].tolist()
+
+
+def resolve_sampler(sampler, steps, k_step, hp):
+    """
+    使用するサンプラーとステップ数を決める（引数 > hparams > 既定値）
+
+    :param hp: hparams（diff_sampler / diff_sampler_steps / pndm_speedup を参照）
+    :return: (サンプラー名, ステップ数)
+    """
+    if sampler is None:
+        sampler = hp.get('diff_sampler') or ('plms' if hp.get('pndm_speedup') else 'ddpm')
+    if sampler not in SAMPLERS:
+        raise ValueError(f"Unknown diffusion sampler '{sampler}'. Available samplers: {list(SAMPLERS)}")
+    if steps is None:
+        if sampler == 'ddpm':
+            steps = k_step
+        elif sampler == 'plms':
+            steps = k_step // (hp.get('pndm_speedup') or 1)
+        else:
+            steps = hp.get('diff_sampler_steps', 20)
+    return sampler, max(1, min(int(steps), k_step))
+
+
+def numpy_clamp(x):
+    """numpy 用の clamp（x_0 を [-1, 1] にその場でクリップ）"""
+    return np.clip(x, -1., 1., out=x)
+
+
+def numpy_noise_like(rng):
+    """numpy 用の noise_like（x と同じshapeの float32 標準正規乱数）"""
+    return lambda x: rng.standard_normal(x.shape, dtype=np.float32)
+
+
+def predict_x0(denoiser, coefs, x, step, clamp, clip_denoised=True, return_noise=False):
+    """ノイズ予測から x_0 を推定（return_noise ならクリップ後の x_0 に対応するノイズも返す）"""
+    noise_pred = denoiser(x, step)
+    x0 = coefs['sqrt_recip_alphas_cumprod'][step] * x - coefs['sqrt_recipm1_alphas_cumprod'][step] * noise_pred
+    if clip_denoised:
+        x0 = clamp(x0)
+        if return_noise:
+            a_t = coefs['alphas_cumprod'][step]
+            noise_pred = (x - math.sqrt(a_t) * x0) / math.sqrt(1 - a_t)
+    return (x0, noise_pred) if return_noise else x0
+
+
+def sample_ddpm(denoiser, coefs, x, k_step, clamp, noise_like):
+    """祖先サンプリング（GaussianDiffusion.p_sample と同じ更新）で K_step から0までたどる"""
+    for step in reversed(range(0, k_step)):
+        x0 = predict_x0(denoiser, coefs, x, step, clamp)
+        x_mean = coefs['posterior_mean_coef1'][step] * x0 + coefs['posterior_mean_coef2'][step] * x
+        # no noise when t == 0
+        x = x_mean + coefs['posterior_std'][step] * noise_like(x) if step > 0 else x_mean
+    return x
+
+
+def sample_plms(denoiser, coefs, x, k_step, interval):
+    """
+    PLMS（GaussianDiffusion.p_sample_plms と同じ更新）で interval 間隔にたどる
+    [Pseudo Numerical Methods for Diffusion Models on Manifolds](https://arxiv.org/abs/2202.09778)
+    """
+    alphas_cumprod = coefs['alphas_cumprod']
+
+    def get_x_pred(x, noise_t, step):
+        a_t = alphas_cumprod[step]
+        a_prev = 1. if step < interval else alphas_cumprod[max(step - interval, 0)]
+        a_t_sq, a_prev_sq = math.sqrt(a_t), math.sqrt(a_prev)
+        x_coef = (a_prev - a_t) / (a_t_sq * (a_t_sq + a_prev_sq))
+        noise_coef = (a_prev - a_t) / (a_t_sq * (math.sqrt((1 - a_prev) * a_t) + math.sqrt((1 - a_t) * a_prev)))
+        return x + x_coef * x - noise_coef * noise_t
+
+    noise_list = deque(maxlen=4)
+    for step in reversed(range(0, k_step, interval)):
+        noise_pred = denoiser(x, step)
+        if len(noise_list) == 0:
+            x_pred = get_x_pred(x, noise_pred, step)
+            noise_pred_prev = denoiser(x_pred, max(step - interval, 0))
+            noise_pred_prime = (noise_pred + noise_pred_prev) / 2
+        elif len(noise_list) == 1:
+            noise_pred_prime = (3 * noise_pred - noise_list[-1]) / 2
+        elif len(noise_list) == 2:
+            noise_pred_prime = (23 * noise_pred - 16 * noise_list[-1] + 5 * noise_list[-2]) / 12
+        else:
+            noise_pred_prime = (55 * noise_pred - 59 * noise_list[-1] + 37 * noise_list[-2] - 9 * noise_list[-3]) / 24
+        x = get_x_pred(x, noise_pred_prime, step)
+        noise_list.append(noise_pred)
+    return x
+
+
+def sample_ddim(denoiser, coefs, x, timesteps, clamp):
+    """
+    DDIM（eta=0）で timesteps（降順）を順にたどり、最後に x_0 まで戻す
+    [Denoising Diffusion Implicit Models](https://arxiv.org/abs/2010.02502)
+    """
+    alphas_cumprod = coefs['alphas_cumprod']
+    for i, step in enumerate(timesteps):
+        x0, noise_pred = predict_x0(denoiser, coefs, x, step, clamp, return_noise=True)
+        if i + 1 == len(timesteps):
+            return x0
+        a_prev = alphas_cumprod[timesteps[i + 1]]
+        x = math.sqrt(a_prev) * x0 + math.sqrt(1 - a_prev) * noise_pred
+    return x
+
+
+def sample_dpm_solver_pp(denoiser, coefs, x, timesteps, clamp):
+    """
+    DPM-Solver++(2M)（データ予測・マルチステップ2次）で timesteps（降順）をたどり、最後に x_0 まで戻す
+    [DPM-Solver++](https://arxiv.org/abs/2211.01095)
+    """
+    alphas_cumprod = coefs['alphas_cumprod']
+
+    def alpha_sigma_lambda(step):
+        alpha, sigma = math.sqrt(alphas_cumprod[step]), math.sqrt(1 - alphas_cumprod[step])
+        return alpha, sigma, math.log(alpha) - math.log(sigma)
+
+    x0_prev, h_prev = None, None
+    for i, step in enumerate(timesteps):
+        x0 = predict_x0(denoiser, coefs, x, step, clamp)
+        if i + 1 == len(timesteps):
+            # 最終ステップは1次（sigma=0 の x_0 へ）
+            return x0
+        _, sigma_s, lambda_s = alpha_sigma_lambda(step)
+        alpha_t, sigma_t, lambda_t = alpha_sigma_lambda(timesteps[i + 1])
+        h = lambda_t - lambda_s
+        if x0_prev is None:
+            d = x0
+        else:
+            r = h_prev / h
+            d = (1 + 1 / (2 * r)) * x0 - (1 / (2 * r)) * x0_prev
+        x = (sigma_t / sigma_s) * x - alpha_t * math.expm1(-h) * d
+        x0_prev, h_prev = x0, h
+    return x
+
+
+def sample(denoiser, coefs, x, k_step, sampler, steps, clamp, noise_like):
+    """
+    指定したサンプラーで x（K_step時点）から x_0 まで推論
+
+    :param denoiser: denoiser(x, step) -> ノイズ予測（x と同じshape・型の配列）
+    :param coefs: GaussianDiffusion.sampling_coefs と同じキーの係数
+    :param x: [B, 1, M, T]（torch.Tensor または numpy 配列）
+    :param clamp: clamp(x0) -> [-1, 1] にクリップした x0（その場で書き換えてよい）
+    :param noise_like: noise_like(x) -> x と同じshapeの標準正規乱数（ddpm のみ使用）
+    :return: [B, 1, M, T]
+    """
+    if sampler == 'ddim':
+        return sample_ddim(denoiser, coefs, x, sampling_timesteps(k_step, steps), clamp)
+    if sampler == 'dpm-solver++':
+        return sample_dpm_solver_pp(denoiser, coefs, x, sampling_timesteps(k_step, steps), clamp)
+    if sampler == 'plms':
+        return sample_plms(denoiser, coefs, x, k_step, max(1, k_step // steps))
+    return sample_ddpm(denoiser, coefs, x, k_step, clamp, noise_like)
@@ -14,6 +14,7 @@ from einops import rearrange
 from modules.fastspeech.fs2 import FastSpeech2
 from modules.diffsinger_midi.fs2 import FastSpeech2MIDI
 from utils.hparams import hparams
+from usr.diff.sampling import SAMPLERS, resolve_sampler, predict_x0, sample as run_sampler
 
 
 
@@ -41,6 +42,11 @@ def noise_like(shape, device, repeat=False):
     return repeat_noise() if repeat else noise()
 
 
+def clamp_x0(x):
+    """推定した x_0 を [-1, 1] にその場でクリップ（usr.diff.sampling の clamp）"""
+    return x.clamp_(-1., 1.)
+
+
 def linear_beta_schedule(timesteps, max_beta=hparams.get('max_beta', 0.01)):
     """
     linear schedule
@@ -125,6 +131,28 @@ class GaussianDiffusion(nn.Module):
         self.register_buffer('spec_min', torch.FloatTensor(spec_min)[None, None, :hparams['keep_bins']])
         self.register_buffer('spec_max', torch.FloatTensor(spec_max)[None, None, :hparams['keep_bins']])
 
+        # 推論ループ用にステップごとの係数をPythonのfloatで前計算（ステップごとの extract/gather を避ける）
+        self.sampling_coefs = {
+            'alphas_cumprod': alphas_cumprod.tolist(),
+            'sqrt_recip_alphas_cumprod': np.sqrt(1. / alphas_cumprod).tolist(),
+            'sqrt_recipm1_alphas_cumprod': np.sqrt(1. / alphas_cumprod - 1).tolist(),
+            'posterior_mean_coef1': (betas * np.sqrt(alphas_cumprod_prev) / (1. - alphas_cumprod)).tolist(),
+            'posterior_mean_coef2': ((1. - alphas_cumprod_prev) * np.sqrt(alphas) / (1. - alphas_cumprod)).tolist(),
+            'posterior_std': np.exp(0.5 * np.log(np.maximum(posterior_variance, 1e-20))).tolist(),
+        }
+        # 推論時に使い回すテンソル（タイムステップ・拡散ステップ射影）と、コンパイル済みdenoiser
+        self._timestep_cache = {}
+        self._step_projection_cache = {}
+        self._compiled_denoiser = None
+        self._compiled_mode = None
+
+    def train(self, mode=True):
+        # 学習で重みが変わるとステップ射影のキャッシュが古くなるため破棄
+        self._step_projection_cache = {}
+        self._compiled_denoiser = None
+        self._compiled_mode = None
+        return super().train(mode)
+
     def q_mean_variance(self, x_start, t):
         mean = extract(self.sqrt_alphas_cumprod, t, x_start.shape) * x_start
         variance = extract(1. - self.alphas_cumprod, t, x_start.shape)
@@ -203,6 +231,92 @@ class GaussianDiffusion(nn.Module):
 
         return x_prev
 
+    def resolve_sampler(self, sampler=None, steps=None):
+        """
+        使用するサンプラーとステップ数を決める（引数 > hparams > 既定値）
+
+        :return: (サンプラー名, ステップ数)
+        """
+        return resolve_sampler(sampler, steps, self.K_step, hparams)
+
+    def timestep(self, step, b, device):
+        """タイムステップ step のテンソル [B]（使い回し）"""
+        key = (step, b, device)
+        t = self._timestep_cache.get(key)
+        if t is None:
+            if len(self._timestep_cache) >= 4096:
+                self._timestep_cache.clear()
+            t = self._timestep_cache[key] = torch.full((b,), step, device=device, dtype=torch.long)
+        return t
+
+    def step_projection(self, step, device):
+        """拡散ステップ step の全残差層への射影 [L, 1, C, 1]（重みが変わらない限り使い回し）"""
+        key = (step, device)
+        projection = self._step_projection_cache.get(key)
+        if projection is None:
+            projection = self.denoise_fn.project_step(torch.tensor([step], device=device, dtype=torch.long))
+            self._step_projection_cache[key] = projection
+        return projection
+
+    def compiled_forward_cached(self, x, conditioners, step_projections):
+        """
+        hparams['diff_compile'] に応じてコンパイルした denoise_fn.forward_cached
+
+        'torch.compile' は torch.compile（動的shape）、'torchscript' は最初の入力でトレースする。
+        コンパイルに失敗した場合は通常の実行に戻す。
+        """
+        mode = hparams.get('diff_compile')
+        if mode != self._compiled_mode:
+            self._compiled_mode = mode
+            self._compiled_denoiser = None
+            try:
+                if mode == 'torch.compile':
+                    self._compiled_denoiser = torch.compile(self.denoise_fn.forward_cached, dynamic=True)
+                elif mode == 'torchscript':
+                    self._compiled_denoiser = torch.jit.trace_module(
+                        self.denoise_fn, {'forward_cached': (x, conditioners, step_projections)}).forward_cached
+                elif mode:
+                    print(f'| Unknown diff_compile mode: {mode}, using eager denoiser')
+            except Exception as e:
+                print(f'| Failed to compile denoiser with {mode} ({e}), using eager denoiser')
+        if self._compiled_denoiser is None:
+            return self.denoise_fn.forward_cached(x, conditioners, step_projections)
+        return self._compiled_denoiser(x, conditioners, step_projections)
+
+    def make_denoiser(self, cond):
+        """
+        サンプリング1回分の denoiser(x, step) -> ノイズ予測 を作る
+
+        denoise_fn が前計算に対応していれば（DiffNet）、cond の射影はここで1回だけ計算し、
+        拡散ステップの射影はステップごとにキャッシュしたものを使う。
+        """
+        b, device = cond.shape[0], cond.device
+        if not hasattr(self.denoise_fn, 'forward_cached'):
+            return lambda x, step: self.denoise_fn(x, self.timestep(step, b, device), cond=cond)
+
+        conditioners = self.denoise_fn.project_conditioner(cond)
+        return lambda x, step: self.compiled_forward_cached(x, conditioners, self.step_projection(step, device))
+
+    def predict_x0(self, denoiser, x, step, clip_denoised=True, return_noise=False):
+        """ノイズ予測から x_0 を推定（usr.diff.sampling.predict_x0 の torch 版）"""
+        return predict_x0(denoiser, self.sampling_coefs, x, step, clamp_x0,
+                          clip_denoised=clip_denoised, return_noise=return_noise)
+
+    def sample(self, x, cond, k_step, sampler, steps):
+        """
+        指定したサンプラーで x（K_step時点）から x_0 まで推論（推論モードで実行）
+
+        更新式は usr.diff.sampling と共有し（書き出したグラフのランタイムと同じ実装）、
+        denoiser にはこのモデルのキャッシュ付き denoise_fn を渡す。
+
+        :param x: [B, 1, M, T]
+        :param cond: [B, H, T]
+        :return: [B, 1, M, T]
+        """
+        with torch.inference_mode():
+            return run_sampler(self.make_denoiser(cond), self.sampling_coefs, x, k_step, sampler, steps,
+                               clamp=clamp_x0, noise_like=torch.randn_like)
+
     def q_sample(self, x_start, t, noise=None):
         noise = default(noise, lambda: torch.randn_like(x_start))
         return (
@@ -231,7 +345,8 @@ class GaussianDiffusion(nn.Module):
         return loss
 
     def forward(self, txt_tokens, mel2ph=None, spk_embed=None,
-                ref_mels=None, f0=None, uv=None, energy=None, infer=False, **kwargs):
+                ref_mels=None, f0=None, uv=None, energy=None, infer=False, sampler=None, sampler_steps=None,
+                **kwargs):
         b, *_, device = *txt_tokens.shape, txt_tokens.device
         ret = self.fs2(txt_tokens, mel2ph, spk_embed, ref_mels, f0, uv, energy,
                        skip_decoder=(not infer), infer=infer, **kwargs)
@@ -258,16 +373,9 @@ class GaussianDiffusion(nn.Module):
                 shape = (cond.shape[0], 1, self.mel_bins, cond.shape[2])
                 x = torch.randn(shape, device=device)
 
-            if hparams.get('pndm_speedup'):
-                self.noise_list = deque(maxlen=4)
-                iteration_interval = hparams['pndm_speedup']
-                for i in tqdm(reversed(range(0, t, iteration_interval)), desc='sample time step',
-                              total=t // iteration_interval):
-                    x = self.p_sample_plms(x, torch.full((b,), i, device=device, dtype=torch.long), iteration_interval,
-                                           cond)
-            else:
-                for i in tqdm(reversed(range(0, t)), desc='sample time step', total=t):
-                    x = self.p_sample(x, torch.full((b,), i, device=device, dtype=torch.long), cond)
+            sampler, steps = self.resolve_sampler(sampler, sampler_steps)
+            ret['sampler'], ret['sampler_steps'] = sampler, steps
+            x = self.sample(x, cond, t, sampler, steps)
             x = x[:, 0].transpose(1, 2)
             if mel2ph is not None:  # for singing
                 ret['mel_out'] = self.denorm_spec(x) * ((mel2ph > 0).float()[:, :, None])
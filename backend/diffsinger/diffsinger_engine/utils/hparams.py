@@ -1,9 +1,56 @@
 import argparse
+import contextvars
 import os
+from contextlib import contextmanager
 import yaml
 
 global_print_hparams = True
-hparams = {}
+
+# hparams_scope で有効化されたエンジン固有のhparams（スレッド・タスクごと）
+_scoped_hparams = contextvars.ContextVar('scoped_hparams', default=None)
+
+
+def _delegate(name):
+    method = getattr(dict, name)
+
+    def scoped_method(self, *args, **kwargs):
+        scoped = _scoped_hparams.get()
+        return method(self if scoped is None else scoped, *args, **kwargs)
+
+    scoped_method.__name__ = name
+    return scoped_method
+
+
+class HParams(dict):
+    """
+    グローバルhparams
+
+    通常は普通のdictとして振る舞い、hparams_scope の内側ではそのスコープのhparamsへ読み書きを委譲する。
+    これにより `from utils.hparams import hparams` しているモジュールを変更せずに、
+    複数のモデルをそれぞれ独立したhparamsで同じプロセスに常駐させられる。
+    """
+    for _name in ('__getitem__', '__setitem__', '__delitem__', '__contains__', '__iter__', '__len__',
+                  '__repr__', 'get', 'keys', 'items', 'values', 'update', 'clear', 'setdefault', 'pop', 'copy'):
+        locals()[_name] = _delegate(_name)
+    del _name
+
+
+hparams = HParams()
+
+
+@contextmanager
+def hparams_scope(scoped_hparams):
+    """
+    with ブロック内（現在のスレッド・タスク）でグローバルhparamsを scoped_hparams に差し替える
+
+    Args:
+        scoped_hparams: エンジン固有のhparams（dict）
+    """
+    token = _scoped_hparams.set(scoped_hparams)
+    try:
+        yield scoped_hparams
+    finally:
+        _scoped_hparams.reset(token)
 
 
 class Args:
@@ -11,6 +11,9 @@ Microsoft Edge TTSを使用したリアルな日本語音声合成を行うモ
 
 APIエンドポイント:
     POST /api/synthesize
+    POST /api/synthesize/stream
+    POST /api/synthesize/jobs
+    GET /api/synthesize/{request_id}
     GET /health
     GET /api/models
 """
@@ -18,13 +21,16 @@ APIエンドポイント:
 import sys
 import os
 import io
+import asyncio
 
 # Windows環境でUTF-8出力を強制
 if sys.platform == 'win32':
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
-from fastapi import FastAPI
+from typing import Optional
+
+from fastapi import FastAPI, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
@@ -36,16 +42,20 @@ from config import (
     SERVER_VERSION,
     ALLOWED_ORIGINS
 )
-from models import SynthesisRequest, SynthesisResponse
+from models import SynthesisRequest, SynthesisResponse, SynthesisJobResponse
 from api_routes import (
     root_route,
     health_route,
     get_models_route,
     load_model_route,
     synthesize_route,
+    synthesize_stream_route,
+    submit_synthesis_job_route,
     get_synthesis_status_route,
-    serve_generated_audio_route
+    serve_generated_audio_route,
+    synthesis_job_manager
 )
+from synthesis_executor import synthesis_executor
 from edge_tts_handler import EDGE_TTS_AVAILABLE
 
 # FastAPIアプリケーション
@@ -62,6 +72,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["X-Time-To-First-Audio-Ms", "X-Audio-Duration", "X-Sample-Rate"],
 )
 
 
@@ -77,12 +88,22 @@ async def startup_event():
         print("[OK] Real Japanese speech synthesis enabled")
     else:
         print("[WARN] Edge TTS not available - falling back to mathematical synthesis")
+    # プロセスプールの起動（ワーカーのウォームアップ）はブロッキングのためスレッドで行う
+    await asyncio.get_running_loop().run_in_executor(None, synthesis_executor.start)
+    await synthesis_job_manager.start()
     print("[OK] Enhanced Mock DiffSinger Engine initialized successfully")
     print(f"[OK] Server ready at http://{SERVER_HOST}:{SERVER_PORT}")
     print(f"[OK] API docs at http://{SERVER_HOST}:{SERVER_PORT}/docs")
     print("=" * 70)
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """サーバー終了時の後処理"""
+    await synthesis_job_manager.stop()
+    synthesis_executor.shutdown()
+
+
 # === ルート登録 ===
 
 @app.get("/")
@@ -115,9 +136,26 @@ async def synthesize(request: SynthesisRequest):
     return await synthesize_route(request)
 
 
+@app.post("/api/synthesize/stream")
+async def synthesize_stream(request: SynthesisRequest):
+    """ストリーミング音声合成（ノート単位でWAVをチャンク転送）"""
+    return await synthesize_stream_route(request)
+
+
+@app.post("/api/synthesize/jobs", response_model=SynthesisJobResponse, status_code=202)
+async def submit_synthesis_job(
+    request: SynthesisRequest,
+    http_request: Request,
+    x_client_id: Optional[str] = Header(None)
+):
+    """非同期音声合成ジョブ投入（request_idを即時返却）"""
+    client_id = x_client_id or (http_request.client.host if http_request.client else "unknown")
+    return await submit_synthesis_job_route(request, client_id)
+
+
 @app.get("/api/synthesize/{request_id}")
 async def get_synthesis_status(request_id: str):
-    """合成ステータス取得（将来の非同期処理用）"""
+    """合成ステータス取得（進捗・キュー位置・完了時の音声パス）"""
     return await get_synthesis_status_route(request_id)
 
 
@@ -8,13 +8,16 @@ Pydantic Models for DiffSinger API
 
 from pydantic import BaseModel, Field
 
+# 出力WAVパスの既定値
+DEFAULT_OUTPUT_PATH = "outputs/synthesis.wav"
+
 
 class SynthesisRequest(BaseModel):
     """合成リクエストモデル"""
     lyrics: str = Field(..., min_length=1, max_length=1000, description="歌詞（中国語・日本語）")
     notes: str = Field(..., description="MIDI音名（|区切り）例: C4 | D4 | E4")
     durations: str = Field(..., description="ノート長さ秒（|区切り）例: 0.5 | 0.5 | 1.0")
-    output_path: str = Field(default="outputs/synthesis.wav", description="出力WAVパス")
+    output_path: str = Field(default=DEFAULT_OUTPUT_PATH, description="出力WAVパス")
 
 
 class SynthesisResponse(BaseModel):
@@ -31,3 +34,11 @@ class ModelInfo(BaseModel):
     name: str
     language: str
     description: str
+
+
+class SynthesisJobResponse(BaseModel):
+    """非同期合成ジョブ投入レスポンスモデル"""
+    request_id: str
+    status: str
+    queue_position: int
+    status_url: str
@@ -6,78 +6,50 @@ Musical Synthesis Module for DiffSinger
 このモジュールは数学的音声合成機能を提供します。
 """
 
+import functools
 import math
-from typing import List
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 import numpy as np
 
 from config import (
     SAMPLE_RATE,
     MUSICAL_NOTE_DURATION,
-    FEMALE_VOICE_PITCH_BOOST,
     PHONEME_HARMONICS,
     FORMANT_FREQUENCIES,
     PHONEME_MAP,
-    VIBRATO_RATE,
-    VIBRATO_DEPTH,
     ATTACK_TIME,
     DECAY_TIME,
     SUSTAIN_LEVEL,
     RELEASE_TIME,
     WAVEFORM_NORMALIZATION_LEVEL,
-    NATURAL_NOISE_LEVEL
+    NATURAL_NOISE_LEVEL,
+    MUSICAL_TONE_CACHE_ENABLED,
+    MUSICAL_TONE_CACHE_MAX_BYTES,
+    MUSICAL_TONE_CACHE_FREQ_QUANTUM_HZ
 )
 from midi_utils import midi_note_to_frequency
 from audio_processing import save_musical_audio
+from oscillator_bank import oscillator_bank
 
+# フォルマント（共振）成分の振幅と減衰率（1/秒）
+FORMANT_AMPLITUDE = 0.3
+FORMANT_DECAY_RATE = 2.0
 
-def generate_musical_tone(frequency: float, duration: float, phoneme: str = "a") -> np.ndarray:
+
+@functools.lru_cache(maxsize=32)
+def musical_tone_envelope(num_samples: int) -> np.ndarray:
     """
-    指定された周波数と長さで音楽的で自然な女性歌声を生成
+    ノートの音量エンベロープ（アタック・ディケイ・リリース・息継ぎ）。長さごとにメモ化
 
     Args:
-        frequency: 基本周波数（Hz）
-        duration: ノートの長さ（秒）
-        phoneme: 音素（"a", "e", "i", "o", "u"）
+        num_samples: サンプル数
 
     Returns:
-        np.ndarray: 生成された音声波形
+        np.ndarray: 読み取り専用のエンベロープ（float32）
     """
-    num_samples = int(SAMPLE_RATE * duration)
-    t = np.linspace(0, duration, num_samples, endpoint=False)
-
-    # 女性らしい音声特性を強化
-    # 基本周波数をより高く調整（女性らしさ向上）
-    feminine_frequency = frequency * (2 ** (FEMALE_VOICE_PITCH_BOOST / 12.0))
-
-    # より女性らしいビブラート（少し速めで繊細）
-    frequency_modulated = feminine_frequency * (1 + VIBRATO_DEPTH * np.sin(2 * np.pi * VIBRATO_RATE * t))
-
-    # 基本波形（よりリアルな合成）
-    fundamental = np.sin(2 * np.pi * frequency_modulated * t)
-
-    # 人間の音声により近い倍音構成
-    harmonics = PHONEME_HARMONICS.get(phoneme, PHONEME_HARMONICS['a'])
-    formants = FORMANT_FREQUENCIES.get(phoneme, FORMANT_FREQUENCIES['a'])
-
-    # 複雑な波形合成（人間の声道を模擬）
-    waveform = np.zeros_like(fundamental)
-
-    # 基本倍音の追加
-    for i, amplitude in enumerate(harmonics):
-        harmonic_freq = frequency * (i + 1)
-        if harmonic_freq < SAMPLE_RATE / 2:
-            waveform += amplitude * np.sin(2 * np.pi * harmonic_freq * t)
-
-    # フォルマント（共振）の追加
-    for formant_freq in formants:
-        if formant_freq < SAMPLE_RATE / 2:
-            formant_contribution = 0.3 * np.sin(2 * np.pi * formant_freq * t)
-            # フォルマントは時間と共に減衰
-            formant_envelope = np.exp(-t * 2)
-            waveform += formant_contribution * formant_envelope
-
-    # より自然なエンベロープ（人間の歌声パターン）
-    envelope = np.ones_like(t)
+    envelope = np.ones(num_samples, dtype=np.float32)
     attack_samples = int(ATTACK_TIME * SAMPLE_RATE)
     decay_samples = int(DECAY_TIME * SAMPLE_RATE)
     release_samples = int(RELEASE_TIME * SAMPLE_RATE)
@@ -96,59 +68,254 @@ def generate_musical_tone(frequency: float, duration: float, phoneme: str = "a")
         envelope[-release_samples:] = SUSTAIN_LEVEL * release_curve
 
     # 息継ぎ効果（微細な音量変動）
-    breath_pattern = 1 + 0.02 * np.sin(2 * np.pi * 0.5 * t)  # 0.5Hzの緩やかな変動
+    t = np.arange(num_samples, dtype=np.float32) / np.float32(SAMPLE_RATE)
+    breath_pattern = 1 + 0.02 * np.sin(np.float32(2 * np.pi * 0.5) * t)  # 0.5Hzの緩やかな変動
     envelope *= breath_pattern
 
+    envelope.setflags(write=False)
+    return envelope
+
+
+def render_musical_tone(frequency: float, num_samples: int, phoneme: str = "a") -> np.ndarray:
+    """
+    ノイズを加える前の女性歌声波形を生成（同じ引数なら常に同じ波形）
+
+    倍音とフォルマントはオシレーターバンクでfloat32のまま一括合成します。
+
+    Args:
+        frequency: 基本周波数（Hz）
+        num_samples: サンプル数
+        phoneme: 音素（"a", "e", "i", "o", "u"）
+
+    Returns:
+        np.ndarray: 生成された音声波形（float32）
+    """
+    # 人間の音声により近い倍音構成
+    harmonics = PHONEME_HARMONICS.get(phoneme, PHONEME_HARMONICS['a'])
+    formants = FORMANT_FREQUENCIES.get(phoneme, FORMANT_FREQUENCIES['a'])
+
+    frequencies, amplitudes, decay_rates = [], [], []
+
+    # 基本倍音（ナイキスト周波数未満のみ）
+    for i, amplitude in enumerate(harmonics):
+        harmonic_freq = frequency * (i + 1)
+        if harmonic_freq < SAMPLE_RATE / 2:
+            frequencies.append(harmonic_freq)
+            amplitudes.append(amplitude)
+            decay_rates.append(0.0)
+
+    # フォルマント（共振）。時間と共に減衰
+    for formant_freq in formants:
+        if formant_freq < SAMPLE_RATE / 2:
+            frequencies.append(formant_freq)
+            amplitudes.append(FORMANT_AMPLITUDE)
+            decay_rates.append(FORMANT_DECAY_RATE)
+
+    # 複雑な波形合成（人間の声道を模擬）
+    waveform = oscillator_bank.render(frequencies, amplitudes, decay_rates, num_samples)
+
     # エンベロープを適用
-    waveform *= envelope
+    waveform *= musical_tone_envelope(num_samples)
 
     # より自然な正規化（歌声の音量感）
-    if np.max(np.abs(waveform)) > 0:
-        waveform *= WAVEFORM_NORMALIZATION_LEVEL / np.max(np.abs(waveform))
-
-    # 微細なノイズ追加（人間らしさ）
-    natural_noise = np.random.normal(0, NATURAL_NOISE_LEVEL, len(waveform))
-    waveform += natural_noise
+    peak = np.max(np.abs(waveform)) if num_samples else 0
+    if peak > 0:
+        waveform *= np.float32(WAVEFORM_NORMALIZATION_LEVEL / peak)
 
     return waveform
 
 
-def create_musical_vocals(
-    lyrics: str,
-    notes_list: List[str],
-    durations_list: List[float],
-    output_path: str
-) -> bool:
+class MusicalToneCache:
+    """
+    ノート波形（ノイズ付加前）のLRUキャッシュ
+
+    キーは (量子化した周波数, サンプル数, 音素)。曲中で繰り返される同じノートの
+    倍音・フォルマント・エンベロープ計算を省略します。
+
+    Attributes:
+        max_bytes (int): キャッシュする波形の合計サイズ上限（バイト）
+        enabled (bool): Falseの場合は毎回生成する
     """
-    歌詞とノート情報から音楽的な歌声を生成
+
+    def __init__(self, max_bytes: int, enabled: bool = True):
+        """
+        初期化
+
+        Args:
+            max_bytes: キャッシュする波形の合計サイズ上限（バイト）
+            enabled: キャッシュを使うかどうか
+        """
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._entries: "OrderedDict[Tuple[float, int, str], np.ndarray]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()  # スレッド実行時（SYNTHESIS_PROCESS_WORKERS = 0）も安全に使えるように
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, frequency: float, num_samples: int, phoneme: str) -> np.ndarray:
+        """
+        ノイズ付加前のノート波形を取得（なければ生成してキャッシュ）
+
+        Args:
+            frequency: 基本周波数（Hz）
+            num_samples: サンプル数
+            phoneme: 音素
+
+        Returns:
+            np.ndarray: 読み取り専用の音声波形
+        """
+        if not self.enabled:
+            self.misses += 1
+            return render_musical_tone(frequency, num_samples, phoneme)
+
+        # 同じノートが同じ波形になるよう、量子化した周波数で生成する
+        quantized = round(frequency / MUSICAL_TONE_CACHE_FREQ_QUANTUM_HZ) * MUSICAL_TONE_CACHE_FREQ_QUANTUM_HZ
+        key = (round(quantized, 6), num_samples, phoneme)
+        with self._lock:
+            waveform = self._entries.get(key)
+            if waveform is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return waveform
+
+        waveform = render_musical_tone(key[0], num_samples, phoneme)
+        waveform.setflags(write=False)
+        with self._lock:
+            self.misses += 1
+            if waveform.nbytes <= self.max_bytes and key not in self._entries:
+                self._entries[key] = waveform
+                self._total_bytes += waveform.nbytes
+                while self._total_bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._total_bytes -= evicted.nbytes
+        return waveform
+
+    def clear(self) -> None:
+        """キャッシュを空にする"""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        キャッシュ統計を取得
+
+        Returns:
+            Dict[str, Any]: エントリ数・サイズ・ヒット数などの統計
+        """
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "total_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+# ノイズ用の乱数生成器（ワーカープロセスごとにOSのエントロピーで初期化される）
+_noise_rng = np.random.default_rng()
+
+# ノート波形キャッシュ（ワーカープロセスごとに保持）
+musical_tone_cache = MusicalToneCache(MUSICAL_TONE_CACHE_MAX_BYTES, enabled=MUSICAL_TONE_CACHE_ENABLED)
+
+
+def generate_musical_tone(
+    frequency: float,
+    duration: float,
+    phoneme: str = "a",
+    out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    指定された周波数と長さで音楽的で自然な女性歌声を生成
 
     Args:
-        lyrics: 歌詞テキスト
-        notes_list: MIDIノート名のリスト
-        durations_list: デュレーションのリスト（秒）
-        output_path: 出力WAVファイルパス
+        frequency: 基本周波数（Hz）
+        duration: ノートの長さ（秒）
+        phoneme: 音素（"a", "e", "i", "o", "u"）
+        out: 書き込み先（float32、長さ int(SAMPLE_RATE * duration)）。省略時は新たに確保
 
     Returns:
-        bool: 合成成功時True、失敗時False
+        np.ndarray: 生成された音声波形（out を指定した場合は out）
     """
-    print(f"[Musical] Creating vocals for '{lyrics}' with {len(notes_list)} notes")
+    waveform = musical_tone_cache.get_or_render(frequency, int(SAMPLE_RATE * duration), phoneme)
+    if out is None:
+        out = np.empty(len(waveform), dtype=np.float32)
 
+    # 微細なノイズ追加（人間らしさ）。キャッシュした波形は変更せず、ノートごとに別のノイズを加える
+    _noise_rng.standard_normal(dtype=np.float32, out=out)
+    out *= np.float32(NATURAL_NOISE_LEVEL)
+    out += waveform
+    return out
+
+
+def align_lyrics_to_notes(lyrics: str, note_count: int) -> List[str]:
+    """
+    歌詞を文字単位に分割し、ノート数に合わせて調整
+
+    Args:
+        lyrics: 歌詞テキスト
+        note_count: ノート数
+
+    Returns:
+        List[str]: ノートごとの歌詞文字
+    """
     # 歌詞を文字単位で分割
     lyrics_chars = list(lyrics)
 
     # ノート数と歌詞文字数を調整
-    if len(lyrics_chars) != len(notes_list):
-        print(f"[Musical] Adjusting lyrics length: {len(lyrics_chars)} chars to {len(notes_list)} notes")
-        if len(lyrics_chars) < len(notes_list):
+    if len(lyrics_chars) != note_count:
+        print(f"[Musical] Adjusting lyrics length: {len(lyrics_chars)} chars to {note_count} notes")
+        if len(lyrics_chars) < note_count:
             # 歌詞が少ない場合は最後の文字を延長
-            while len(lyrics_chars) < len(notes_list):
+            while len(lyrics_chars) < note_count:
                 lyrics_chars.append(lyrics_chars[-1] if lyrics_chars else 'あ')
         else:
             # 歌詞が多い場合は切り詰め
-            lyrics_chars = lyrics_chars[:len(notes_list)]
+            lyrics_chars = lyrics_chars[:note_count]
 
-    # 音楽的波形を生成
-    vocal_segments = []
+    return lyrics_chars
+
+
+def musical_note_duration(duration: float) -> float:
+    """音楽的な長さに調整（最低 MUSICAL_NOTE_DURATION 秒）"""
+    return max(MUSICAL_NOTE_DURATION, float(duration))
+
+
+def musical_vocals_sample_count(durations_list: List[float]) -> int:
+    """
+    create_musical_vocals が生成する総サンプル数を計算
+
+    Args:
+        durations_list: デュレーションのリスト（秒）
+
+    Returns:
+        int: 総サンプル数
+    """
+    return sum(int(SAMPLE_RATE * musical_note_duration(duration)) for duration in durations_list)
+
+
+def iter_musical_notes(
+    lyrics: str,
+    notes_list: List[str],
+    durations_list: List[float]
+) -> Iterator[Tuple[float, float, str]]:
+    """
+    ノートごとの合成パラメータを順に生成
+
+    Args:
+        lyrics: 歌詞テキスト
+        notes_list: MIDIノート名のリスト
+        durations_list: デュレーションのリスト（秒）
+
+    Yields:
+        Tuple[float, float, str]: (周波数, 音楽的な長さ（秒）, 音素)
+    """
+    lyrics_chars = align_lyrics_to_notes(lyrics, len(notes_list))
 
     for char, note, duration in zip(lyrics_chars, notes_list, durations_list):
         # 周波数を取得
@@ -158,16 +325,66 @@ def create_musical_vocals(
         phoneme = PHONEME_MAP.get(char, 'a')
 
         # 音楽的な長さに調整（最低1秒）
-        musical_duration = max(MUSICAL_NOTE_DURATION, float(duration))
+        musical_duration = musical_note_duration(duration)
+
+        print(f"[Musical] {char} ({phoneme}) → {frequency:.2f} Hz × {musical_duration:.1f}s")
+
+        yield frequency, musical_duration, phoneme
 
+
+def iter_musical_vocal_segments(
+    lyrics: str,
+    notes_list: List[str],
+    durations_list: List[float]
+) -> Iterator[np.ndarray]:
+    """
+    ノートごとに音楽的な歌声波形を順に生成
+
+    Args:
+        lyrics: 歌詞テキスト
+        notes_list: MIDIノート名のリスト
+        durations_list: デュレーションのリスト（秒）
+
+    Yields:
+        np.ndarray: 1ノート分の音声波形
+    """
+    for frequency, duration, phoneme in iter_musical_notes(lyrics, notes_list, durations_list):
         # 音楽的音を生成
-        segment = generate_musical_tone(frequency, musical_duration, phoneme)
-        vocal_segments.append(segment)
+        yield generate_musical_tone(frequency, duration, phoneme)
 
-        print(f"[Musical] {char} ({phoneme}) → {frequency:.2f} Hz × {musical_duration:.1f}s")
 
-    # 全セグメントを結合
-    full_vocal = np.concatenate(vocal_segments)
+def create_musical_vocals(
+    lyrics: str,
+    notes_list: List[str],
+    durations_list: List[float],
+    output_path: str
+) -> bool:
+    """
+    歌詞とノート情報から音楽的な歌声を生成
+
+    総サンプル数のfloat32バッファを1つだけ確保し、各ノートをその区間に直接書き込みます。
+
+    Args:
+        lyrics: 歌詞テキスト
+        notes_list: MIDIノート名のリスト
+        durations_list: デュレーションのリスト（秒）
+        output_path: 出力WAVファイルパス
+
+    Returns:
+        bool: 合成成功時True、失敗時False
+    """
+    print(f"[Musical] Creating vocals for '{lyrics}' with {len(notes_list)} notes")
+
+    # 先に全ノートの長さを確定し、出力バッファを確保
+    musical_notes = list(iter_musical_notes(lyrics, notes_list, durations_list))
+    note_samples = [int(SAMPLE_RATE * duration) for _, duration, _ in musical_notes]
+    full_vocal = np.empty(sum(note_samples), dtype=np.float32)
+
+    # 音楽的波形をバッファの各区間に生成
+    offset = 0
+    for (frequency, duration, phoneme), num_samples in zip(musical_notes, note_samples):
+        generate_musical_tone(frequency, duration, phoneme, out=full_vocal[offset:offset + num_samples])
+        offset += num_samples
 
     print(f"[Musical] Generated {len(full_vocal)} samples ({len(full_vocal)/SAMPLE_RATE:.2f} seconds)")
 
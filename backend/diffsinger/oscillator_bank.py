@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Oscillator Bank for DiffSinger
+
+このモジュールは複数の正弦波パーシャル（倍音・フォルマント）をfloat32で一括合成する
+オシレーターバンクを提供します。
+
+波形をブロック（OSCILLATOR_BLOCK_SIZE サンプル）に分け、加法定理
+    sin(θ_m + φ_k) = sin(θ_m)·cos(φ_k) + cos(θ_m)·sin(φ_k)
+を使って「ブロック先頭の位相 θ_m（ブロックごとに累積）」と「ブロック内の位相 φ_k（1ブロック分の正弦波テーブル）」
+に分解します。全パーシャルの合成は (ブロック数 × 2P) と (2P × ブロック長) の行列積1回になり、
+np.sin は全長ではなくブロック数＋ブロック長の分だけで済みます。
+"""
+
+import math
+from typing import Sequence
+
+import numpy as np
+
+from config import SAMPLE_RATE, OSCILLATOR_BLOCK_SIZE
+
+
+class OscillatorBank:
+    """
+    一定周波数の正弦波パーシャルを一括合成するオシレーターバンク
+
+    Attributes:
+        sample_rate (int): サンプリングレート
+        block_size (int): 1ブロックのサンプル数
+    """
+
+    def __init__(self, sample_rate: int = SAMPLE_RATE, block_size: int = OSCILLATOR_BLOCK_SIZE):
+        """
+        初期化
+
+        Args:
+            sample_rate: サンプリングレート
+            block_size: 1ブロックのサンプル数
+        """
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self._block_offsets = np.arange(block_size, dtype=np.float64)
+
+    def render(
+        self,
+        frequencies: Sequence[float],
+        amplitudes: Sequence[float],
+        decay_rates: Sequence[float],
+        num_samples: int
+    ) -> np.ndarray:
+        """
+        パーシャルの和 Σ amplitude·exp(-decay_rate·t)·sin(2π·frequency·t) を合成
+
+        Args:
+            frequencies: 各パーシャルの周波数（Hz）
+            amplitudes: 各パーシャルの振幅
+            decay_rates: 各パーシャルの指数減衰率（1/秒、0なら減衰なし）
+            num_samples: 出力サンプル数
+
+        Returns:
+            np.ndarray: 合成した波形（float32、長さ num_samples）
+        """
+        num_blocks = max(1, math.ceil(num_samples / self.block_size))
+        if len(frequencies) == 0:
+            return np.zeros(num_samples, dtype=np.float32)
+
+        omega = 2 * np.pi * np.asarray(frequencies, dtype=np.float64)[:, None] / self.sample_rate
+        amplitude = np.asarray(amplitudes, dtype=np.float64)[:, None]
+        decay = np.asarray(decay_rates, dtype=np.float64)[:, None] / self.sample_rate
+
+        # ブロック内の正弦波テーブル（2P × ブロック長）
+        inner_phase = omega * self._block_offsets
+        inner_decay = np.exp(-decay * self._block_offsets)
+        block_table = np.concatenate([
+            np.cos(inner_phase) * inner_decay,
+            np.sin(inner_phase) * inner_decay
+        ]).astype(np.float32)
+
+        # ブロック先頭の位相（1ブロックごとに ω·ブロック長 ずつ累積し、精度を保つため2πで折り返す）
+        block_starts = np.arange(num_blocks, dtype=np.float64) * self.block_size
+        start_phase = np.mod(omega * block_starts, 2 * np.pi)
+        start_gain = amplitude * np.exp(-decay * block_starts)
+        block_weights = np.concatenate([
+            start_gain * np.sin(start_phase),
+            start_gain * np.cos(start_phase)
+        ]).T.astype(np.float32)
+
+        # 全パーシャルを行列積1回で合成（出力バッファは事前に確保して直接書き込む）
+        output = np.empty((num_blocks, self.block_size), dtype=np.float32)
+        np.matmul(block_weights, block_table, out=output)
+        return output.reshape(-1)[:num_samples]
+
+
+# 共有インスタンス（状態を持たないためスレッド間で共有可能）
+oscillator_bank = OscillatorBank()
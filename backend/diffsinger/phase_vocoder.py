@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Phase Vocoder Pitch/Time Engine for DiffSinger
+
+このモジュールはフレーム単位のSTFTフェーズボコーダーによるピッチシフトと
+タイムストレッチを提供します（SYNTHESIS_MODE = "edge_tts_vocoder"）。
+
+apply_pitch_time_control はクリップ全体を1回のFFTで処理しますが、こちらは
+固定長の窓とホップで入力を逐次読み込み、出力も逐次書き出すため、
+曲の長さに関わらずメモリ使用量はほぼ一定です。
+ピッチシフト（ビンの再配置と瞬時周波数のスケーリング）とタイムストレッチ
+（解析ホップと合成ホップの比）は同じフレームループの中で同時に行います。
+"""
+
+import tempfile
+import wave
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+from config import (
+    FEMINIZATION_BOOST_RATIO,
+    VIBRATO_FREQUENCY_HZ,
+    VIBRATO_DEPTH_PERCENT,
+    WAVEFORM_NORMALIZATION_LEVEL,
+    PHASE_VOCODER_FRAME_SIZE,
+    PHASE_VOCODER_HOP_SIZE
+)
+from midi_utils import C4_FREQUENCY
+
+# WAV入出力のチャンクサイズ（サンプル数）
+IO_CHUNK_SAMPLES = 65536
+
+# この比率以内のピッチ変更はノート単位では適用しない（apply_pitch_time_control と同じ基準）
+PITCH_SHIFT_THRESHOLD = 0.05
+
+
+class _WaveSampleReader:
+    """
+    16-bit WAVを逐次読み込み、要求された区間だけをバッファに保持するリーダー
+
+    区間の開始位置は単調増加することを前提に、不要になった先頭部分を破棄します。
+    """
+
+    def __init__(self, wav_file: wave.Wave_read):
+        self._wav = wav_file
+        self._channels = wav_file.getnchannels()
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self._buffer_start = 0
+        self._eof = False
+
+    def _read_chunk(self) -> None:
+        frames = self._wav.readframes(IO_CHUNK_SAMPLES)
+        if not frames:
+            self._eof = True
+            return
+        chunk = np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32768.0
+        if self._channels == 2:
+            chunk = chunk[::2]  # 左チャンネルのみ使用
+        self._buffer = np.concatenate([self._buffer, chunk])
+
+    def _discard_before(self, start: int) -> None:
+        drop = min(start - self._buffer_start, len(self._buffer))
+        if drop > 0:
+            self._buffer = self._buffer[drop:]
+            self._buffer_start += drop
+
+    def get(self, start: int, length: int) -> np.ndarray:
+        """
+        [start, start + length) の区間を取得（終端以降はゼロ埋め）
+
+        Args:
+            start: 開始サンプル位置
+            length: サンプル数
+
+        Returns:
+            np.ndarray: float32 のサンプル列
+        """
+        while not self._eof and self._buffer_start + len(self._buffer) < start + length:
+            self._read_chunk()
+            # 大きく読み飛ばす場合もバッファが膨らまないよう、読み込むたびに破棄
+            self._discard_before(start)
+        self._discard_before(start)
+
+        offset = start - self._buffer_start
+        segment = self._buffer[offset:offset + length] if offset >= 0 else self._buffer[:0]
+        if len(segment) < length:
+            segment = np.concatenate([segment, np.zeros(length - len(segment), dtype=np.float32)])
+        return segment
+
+
+def _note_timeline(target_durations: List[float]) -> Tuple[np.ndarray, np.ndarray]:
+    """各ノートの開始・終了時刻（秒）を返す"""
+    note_ends = np.cumsum(np.asarray(target_durations, dtype=np.float64))
+    note_starts = note_ends - np.asarray(target_durations, dtype=np.float64)
+    return note_starts, note_ends
+
+
+def _note_pitch_ratios(target_frequencies: List[float], target_durations: List[float]) -> np.ndarray:
+    """ノートごとのピッチ比率（女性化ブーストを含む）"""
+    if not target_frequencies or len(target_frequencies) != len(target_durations):
+        return np.full(max(len(target_durations), 1), FEMINIZATION_BOOST_RATIO)
+
+    ratios = np.asarray(target_frequencies, dtype=np.float64) / C4_FREQUENCY
+    ratios = np.where(np.abs(ratios - 1.0) > PITCH_SHIFT_THRESHOLD, ratios, 1.0)
+    return ratios * FEMINIZATION_BOOST_RATIO
+
+
+class PhaseVocoder:
+    """
+    フレーム単位のピッチシフト・タイムストレッチ処理器
+
+    Attributes:
+        frame_size (int): STFT窓長（サンプル）
+        hop_size (int): 合成ホップ長（サンプル）
+    """
+
+    def __init__(self, frame_size: int = PHASE_VOCODER_FRAME_SIZE, hop_size: int = PHASE_VOCODER_HOP_SIZE):
+        """
+        初期化
+
+        Args:
+            frame_size: STFT窓長（サンプル）
+            hop_size: 合成ホップ長（サンプル）
+        """
+        self.frame_size = frame_size
+        self.hop_size = hop_size
+        self.window = np.hanning(frame_size).astype(np.float32)
+        self.num_bins = frame_size // 2 + 1
+        self.bin_omegas = 2 * np.pi * np.arange(self.num_bins) / frame_size
+        # 解析窓・合成窓（ともにHann）の重ね合わせゲインを補正
+        self.ola_gain = float(np.sum(self.window ** 2) / hop_size)
+
+        self._prev_phase: Optional[np.ndarray] = None
+        self._synth_phase = np.zeros(self.num_bins)
+        # ノートごとに同じ比率が続くため、ビン対応表をキャッシュ
+        self._mapping_cache: Dict[float, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def _bin_mapping(self, pitch_ratio: float) -> Tuple[np.ndarray, np.ndarray]:
+        """ピッチ比率に対する (元ビン, 移動先ビン) の対応表"""
+        mapping = self._mapping_cache.get(pitch_ratio)
+        if mapping is None:
+            source = np.arange(self.num_bins)
+            target = np.round(source * pitch_ratio).astype(np.int64)
+            valid = target < self.num_bins
+            mapping = (source[valid], target[valid])
+            self._mapping_cache[pitch_ratio] = mapping
+        return mapping
+
+    def process_frame(self, frame: np.ndarray, analysis_hop: int, pitch_ratio: float) -> np.ndarray:
+        """
+        1フレーム分のピッチシフトを行い、合成フレームを返す
+
+        Args:
+            frame: 入力フレーム（frame_size サンプル）
+            analysis_hop: 直前フレームからの解析ホップ長（サンプル）
+            pitch_ratio: ピッチ比率
+
+        Returns:
+            np.ndarray: 窓掛け済みの合成フレーム（frame_size サンプル）
+        """
+        spectrum = np.fft.rfft(frame * self.window)
+        magnitude = np.abs(spectrum)
+        phase = np.angle(spectrum)
+
+        # 位相差から各ビンの瞬時周波数（rad/sample）を推定
+        if self._prev_phase is None or analysis_hop <= 0:
+            inst_freq = self.bin_omegas
+        else:
+            delta = phase - self._prev_phase - self.bin_omegas * analysis_hop
+            delta = np.mod(delta + np.pi, 2 * np.pi) - np.pi
+            inst_freq = self.bin_omegas + delta / analysis_hop
+        self._prev_phase = phase
+
+        # ピッチシフト: ビン k を round(k * ratio) へ移動し、瞬時周波数もスケーリング
+        source, target = self._bin_mapping(pitch_ratio)
+        shifted_magnitude = np.bincount(target, weights=magnitude[source], minlength=self.num_bins)
+        shifted_freq = np.zeros(self.num_bins)
+        shifted_freq[target] = inst_freq[source] * pitch_ratio
+
+        # 合成ホップで位相を積算（フレーム間の位相連続性を保つ）
+        self._synth_phase = self._synth_phase + shifted_freq * self.hop_size
+        synth_frame = np.fft.irfft(shifted_magnitude * np.exp(1j * self._synth_phase), self.frame_size)
+        return synth_frame.astype(np.float32) * self.window / self.ola_gain
+
+
+def phase_vocoder_pitch_time_control(
+    input_audio_path: str,
+    output_audio_path: str,
+    target_frequencies: List[float],
+    target_durations: List[float]
+) -> bool:
+    """
+    フェーズボコーダーでピッチシフトとタイムストレッチを1パスで適用
+
+    apply_pitch_time_control と同じ引数・戻り値で置き換えて使えます。
+
+    Args:
+        input_audio_path: 入力音声ファイルパス（16-bit WAV）
+        output_audio_path: 出力音声ファイルパス
+        target_frequencies: 目標周波数のリスト（Hz）
+        target_durations: 目標デュレーションのリスト（秒）
+
+    Returns:
+        bool: 処理成功時True、失敗時False
+    """
+    try:
+        print(f"[Phase Vocoder] Processing: {input_audio_path}")
+
+        vocoder = PhaseVocoder()
+        frame_size = vocoder.frame_size
+        hop_size = vocoder.hop_size
+
+        note_starts, note_ends = _note_timeline(target_durations)
+        pitch_ratios = _note_pitch_ratios(target_frequencies, target_durations)
+        long_notes = np.asarray(target_durations, dtype=np.float64) >= 1.0
+        target_total_duration = float(note_ends[-1]) if len(note_ends) else 0.0
+
+        with wave.open(input_audio_path, 'rb') as wav_file:
+            if wav_file.getsampwidth() != 2:
+                print(f"[Phase Vocoder] Warning: Unsupported sample width: {wav_file.getsampwidth()}")
+                return False
+
+            frame_rate = wav_file.getframerate()
+            input_samples = wav_file.getnframes()
+            output_samples = int(target_total_duration * frame_rate)
+            if input_samples == 0 or output_samples == 0:
+                print(f"[Phase Vocoder] Warning: Empty input or target duration")
+                return False
+
+            # タイムストレッチ比率 = 出力長 / 入力長（解析ホップ = 合成ホップ / 比率）
+            stretch_ratio = output_samples / input_samples
+            analysis_hop = hop_size / stretch_ratio
+
+            print(f"[Phase Vocoder] Original duration: {input_samples / frame_rate:.2f}s")
+            print(f"[Phase Vocoder] Target duration: {target_total_duration:.2f}s (stretch: {stretch_ratio:.2f}x)")
+
+            reader = _WaveSampleReader(wav_file)
+            overlap = np.zeros(frame_size, dtype=np.float32)
+            peak = 0.0
+            written = 0
+            prev_position = 0
+            frame_index = 0
+
+            # 正規化のため1パス目はfloat32の一時ファイルへ書き出す（メモリ上に全体を保持しない）
+            with tempfile.TemporaryFile() as raw_file:
+                while written < output_samples:
+                    position = int(round(frame_index * analysis_hop))
+                    output_time = frame_index * hop_size / frame_rate
+                    note_index = min(int(np.searchsorted(note_ends, output_time, side='right')), len(pitch_ratios) - 1)
+
+                    frame = reader.get(position, frame_size)
+                    overlap += vocoder.process_frame(frame, position - prev_position, pitch_ratios[note_index])
+                    prev_position = position
+                    frame_index += 1
+
+                    # 先頭 hop_size サンプルは以降のフレームと重ならないため確定
+                    block = overlap[:hop_size].copy()
+                    overlap[:-hop_size] = overlap[hop_size:]
+                    overlap[-hop_size:] = 0.0
+
+                    block = block[:output_samples - written]
+
+                    # 長い音符（1.0秒以上）にビブラート効果を適用
+                    t = (written + np.arange(len(block))) / frame_rate
+                    block_notes = np.minimum(np.searchsorted(note_ends, t, side='right'), len(note_ends) - 1)
+                    vibrato = 1.0 + VIBRATO_DEPTH_PERCENT * np.sin(
+                        2 * np.pi * VIBRATO_FREQUENCY_HZ * (t - note_starts[block_notes])
+                    )
+                    block *= np.where(long_notes[block_notes], vibrato, 1.0).astype(np.float32)
+
+                    peak = max(peak, float(np.max(np.abs(block))) if len(block) else 0.0)
+                    raw_file.write(block.tobytes())
+                    written += len(block)
+
+                print(f"[Phase Vocoder] Rendered {frame_index} frames ({written} samples)")
+
+                # 2パス目: 音量正規化して16-bit PCMで保存
+                gain = WAVEFORM_NORMALIZATION_LEVEL / peak if peak > 0 else 0.0
+                raw_file.seek(0)
+                with wave.open(output_audio_path, 'wb') as output_wav:
+                    output_wav.setnchannels(1)  # モノラル
+                    output_wav.setsampwidth(2)  # 16-bit
+                    output_wav.setframerate(frame_rate)
+                    while True:
+                        data = raw_file.read(IO_CHUNK_SAMPLES * 4)
+                        if not data:
+                            break
+                        chunk = np.frombuffer(data, dtype=np.float32) * gain
+                        output_wav.writeframes((chunk * 32767).astype(np.int16).tobytes())
+
+        print(f"[Phase Vocoder] Successfully processed and saved: {output_audio_path}")
+        return True
+
+    except Exception as e:
+        print(f"[Phase Vocoder] Error in phase vocoder processing: {e}")
+        return False
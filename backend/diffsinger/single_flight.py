@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Single-flight Request Coalescing for DiffSinger
+
+このモジュールは実行中の同一リクエストをまとめる仕組みを提供します。
+同じキーの処理が実行中であれば新たに処理を始めず、実行中の処理の結果（または例外）を共有します。
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from config import SYNTHESIS_COALESCING_ENABLED
+from synthesis_jobs import ProgressCallback
+
+
+class _Flight:
+    """実行中の1つの処理と、その結果を待つ呼び出し元の進捗通知先"""
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.callbacks: List[ProgressCallback] = []
+        self.waiters = 0
+
+    def report_progress(self, progress: float, message: str) -> None:
+        for callback in self.callbacks:
+            callback(progress, message)
+
+
+class SingleFlight:
+    """
+    同一キーの同時実行をまとめる
+
+    Attributes:
+        enabled (bool): Falseの場合はまとめずに毎回実行する
+    """
+
+    def __init__(self, enabled: bool = True):
+        """
+        初期化
+
+        Args:
+            enabled: 同時実行をまとめるかどうか
+        """
+        self.enabled = enabled
+        self._flights: Dict[str, _Flight] = {}
+
+        self.executions = 0
+        self.coalesced = 0
+
+    async def run(
+        self,
+        key: str,
+        func: Callable[[Optional[ProgressCallback]], Awaitable[Any]],
+        progress_callback: Optional[ProgressCallback] = None
+    ) -> Any:
+        """
+        キーごとに1回だけ func を実行し、同時に来た呼び出し元すべてに結果を返す
+
+        Args:
+            key: リクエストを識別するキー（正規化したリクエストのハッシュ）
+            func: 進捗通知関数を受け取って処理を行うコルーチン関数
+            progress_callback: この呼び出し元への進捗通知関数
+
+        Returns:
+            Any: func の戻り値
+
+        Raises:
+            Exception: func 内で発生した例外（待っていた呼び出し元すべてに送出）
+        """
+        if not self.enabled:
+            self.executions += 1
+            return await func(progress_callback)
+
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            flight.task = asyncio.ensure_future(func(flight.report_progress))
+            flight.task.add_done_callback(lambda _task, key=key, flight=flight: self._finish(key, flight))
+            self._flights[key] = flight
+            self.executions += 1
+        else:
+            self.coalesced += 1
+            print(f"[Single Flight] Joined in-flight request {key[:12]} ({flight.waiters + 1} waiting)")
+
+        if progress_callback is not None:
+            flight.callbacks.append(progress_callback)
+        flight.waiters += 1
+        try:
+            # 1つの呼び出し元が切断・キャンセルされても、他の呼び出し元の処理は続ける
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if progress_callback is not None and progress_callback in flight.callbacks:
+                flight.callbacks.remove(progress_callback)
+
+    def _finish(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # 全員が待つのをやめた後に失敗した場合、未取得の例外として警告されないよう取り出しておく
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        統計を取得
+
+        Returns:
+            Dict[str, Any]: 実行中の件数・実際の実行回数・まとめた件数
+        """
+        requests = self.executions + self.coalesced
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._flights),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "coalesced_rate": round(self.coalesced / requests, 4) if requests else 0.0
+        }
+
+
+# 合成リクエスト用のインスタンス
+synthesis_flights = SingleFlight(enabled=SYNTHESIS_COALESCING_ENABLED)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthesis Result Cache for DiffSinger
+
+このモジュールは合成結果WAVのディスクキャッシュ（コンテンツアドレス方式）を提供します。
+正規化したリクエストとモデルIDのハッシュをキーとし、容量上限付きのLRUで古いエントリを削除します。
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from config import (
+    SYNTHESIS_MODE,
+    SYNTHESIS_CACHE_ENABLED,
+    SYNTHESIS_CACHE_DIR,
+    SYNTHESIS_CACHE_MAX_BYTES,
+    SYNTHESIS_CACHE_MAX_ENTRIES
+)
+
+# キャッシュファイル名の接頭辞（outputs/ 内の通常の出力と区別する）
+CACHE_FILE_PREFIX = "cache_"
+
+# キャッシュに登録する前の合成中ファイルの接頭辞（起動時に残っていれば削除する）
+RENDER_FILE_PREFIX = "render_"
+
+# キー形式のバージョン（合成ロジックを変更した場合に上げて古いキャッシュを無効化）
+CACHE_KEY_VERSION = 1
+
+
+def make_synthesis_cache_key(
+    lyrics: str,
+    notes_list: List[str],
+    durations_list: List[float],
+    model_id: str
+) -> str:
+    """
+    正規化した合成リクエストからキャッシュキーを生成
+
+    Args:
+        lyrics: 歌詞テキスト
+        notes_list: MIDIノート名のリスト
+        durations_list: デュレーションのリスト（秒）
+        model_id: 使用するモデルID
+
+    Returns:
+        str: SHA-256ハッシュ（16進文字列）
+    """
+    normalized = {
+        "version": CACHE_KEY_VERSION,
+        "mode": SYNTHESIS_MODE,
+        "model": model_id,
+        "lyrics": lyrics.strip(),
+        "notes": [note.strip() for note in notes_list],
+        # 浮動小数点の表記揺れ（0.5 と 0.50 など）を吸収
+        "durations": [round(float(duration), 6) for duration in durations_list]
+    }
+    payload = json.dumps(normalized, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SynthesisCache:
+    """
+    合成結果WAVのディスクキャッシュ
+
+    Attributes:
+        cache_dir (Path): キャッシュファイルの保存先
+        max_bytes (int): キャッシュ全体の最大サイズ（バイト）
+        max_entries (int): 最大エントリ数
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, max_entries: int, enabled: bool = True):
+        """
+        初期化
+
+        Args:
+            cache_dir: キャッシュディレクトリ
+            max_bytes: キャッシュ全体の最大サイズ（バイト）
+            max_entries: 最大エントリ数
+            enabled: キャッシュを有効にするか
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.enabled = enabled
+
+        # key -> ファイルサイズ（末尾が最近使用）
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.enabled:
+            self._load_index()
+
+    def _path_for(self, key: str) -> Path:
+        """キーに対応するキャッシュファイルパス"""
+        return self.cache_dir / f"{CACHE_FILE_PREFIX}{key}.wav"
+
+    def _load_index(self) -> None:
+        """既存のキャッシュファイルを最終アクセス時刻順にインデックス化"""
+        if not self.cache_dir.exists():
+            return
+
+        # 前回の合成途中で残ったファイルを削除
+        for path in self.cache_dir.glob(f"{RENDER_FILE_PREFIX}*.wav"):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+        files = []
+        for path in self.cache_dir.glob(f"{CACHE_FILE_PREFIX}*.wav"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, path, stat.st_size))
+
+        for _, path, size in sorted(files):
+            key = path.stem[len(CACHE_FILE_PREFIX):]
+            self._entries[key] = size
+            self._total_bytes += size
+
+        self._evict_locked()
+        print(f"[Synthesis Cache] Indexed {len(self._entries)} entries ({self._total_bytes} bytes)")
+
+    def _evict_locked(self) -> None:
+        """上限を超えている間、最も古いエントリを削除（ロック取得済みで呼ぶこと）"""
+        while self._entries and (
+            self._total_bytes > self.max_bytes or len(self._entries) > self.max_entries
+        ):
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                self._path_for(key).unlink()
+            except OSError:
+                pass
+            print(f"[Synthesis Cache] Evicted {key[:12]}... ({size} bytes)")
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        キャッシュ済みWAVのパスを取得
+
+        Args:
+            key: キャッシュキー
+
+        Returns:
+            Optional[str]: キャッシュヒット時はWAVパス、ミス時はNone
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            if key in self._entries:
+                path = self._path_for(key)
+                if path.exists():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    # 再起動後もLRU順を復元できるよう更新時刻を記録
+                    try:
+                        os.utime(path)
+                    except OSError:
+                        pass
+                    return str(path)
+
+                # ファイルが外部から削除されていた場合はインデックスから除去
+                self._total_bytes -= self._entries.pop(key)
+
+            self.misses += 1
+            return None
+
+    def render_path(self, key: str) -> Optional[str]:
+        """
+        キャッシュに直接登録するための合成先パスを取得
+
+        合成結果をこのパスに書き出して put(key, path, move=True) すると、コピーせずにキャッシュファイルへ移動する。
+
+        Args:
+            key: キャッシュキー
+
+        Returns:
+            Optional[str]: キャッシュディレクトリ内の一時WAVパス（キャッシュ無効時・作成失敗時はNone）
+        """
+        if not self.enabled:
+            return None
+
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        except OSError:
+            return None
+        return str(self.cache_dir / f"{RENDER_FILE_PREFIX}{key[:16]}_{uuid.uuid4().hex[:8]}.wav")
+
+    def put(self, key: str, source_path: str, move: bool = False) -> Optional[str]:
+        """
+        合成結果をキャッシュに登録
+
+        Args:
+            key: キャッシュキー
+            source_path: 合成済みWAVファイルのパス
+            move: コピーせずにキャッシュファイルへ移動する（render_path で取得したパスの場合）
+
+        Returns:
+            Optional[str]: 登録されたキャッシュファイルのパス（失敗時はNone）
+        """
+        if not self.enabled:
+            return None
+
+        cache_path = self._path_for(key)
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            if move:
+                # 同じディレクトリ内の移動のため、途中のファイルが配信されることはない
+                os.replace(source_path, cache_path)
+            elif Path(source_path).resolve() != cache_path.resolve():
+                # 一時ファイル経由で書き込み、途中のファイルを配信しないようにする
+                temp_path = cache_path.with_suffix(".wav.tmp")
+                shutil.copyfile(source_path, temp_path)
+                os.replace(temp_path, cache_path)
+            size = cache_path.stat().st_size
+        except OSError as e:
+            print(f"[Synthesis Cache] Failed to store {key[:12]}...: {e}")
+            return None
+
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict_locked()
+
+        print(f"[Synthesis Cache] Stored {key[:12]}... ({size} bytes)")
+        return str(cache_path)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        キャッシュ統計を取得
+
+        Returns:
+            Dict[str, Any]: ヒット数・ミス数・使用量などの統計
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+# グローバルキャッシュインスタンス
+synthesis_cache = SynthesisCache(
+    SYNTHESIS_CACHE_DIR,
+    SYNTHESIS_CACHE_MAX_BYTES,
+    SYNTHESIS_CACHE_MAX_ENTRIES,
+    enabled=SYNTHESIS_CACHE_ENABLED
+)
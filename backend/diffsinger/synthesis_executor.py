@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CPU-bound Synthesis Executor for DiffSinger
+
+このモジュールは音楽的合成・ピッチ後処理などのCPU負荷の高い処理を
+プロセスプールで実行し、uvicornのイベントループを塞がないようにします。
+ワーカーは起動時に数値処理モジュールを事前インポートし、ウォームアップ済みの状態で待機します。
+"""
+
+import asyncio
+import io
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+from config import SYNTHESIS_PROCESS_WORKERS
+
+
+def _init_worker() -> None:
+    """ワーカープロセスの初期化（数値処理モジュールを事前インポート）"""
+    # Windows（spawn起動）の子プロセスでもUTF-8で出力する
+    if sys.platform == 'win32':
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+    # 初回ジョブでインポートコストを払わないよう、合成系モジュールを読み込んでおく
+    import numpy  # noqa: F401
+    import config  # noqa: F401
+    import musical_synthesis  # noqa: F401
+    import audio_processing  # noqa: F401
+    import phase_vocoder  # noqa: F401
+
+
+def _warmup() -> None:
+    """ウォームアップ用タスク（プロセス起動を促すだけの空処理）"""
+
+
+class SynthesisExecutor:
+    """
+    CPU負荷の高い合成処理を実行するプロセスプール
+
+    Attributes:
+        max_workers (int): 同時に実行するプロセス数（0以下ならプロセスプールを使わずスレッドで実行）
+    """
+
+    def __init__(self, max_workers: int):
+        """
+        初期化
+
+        Args:
+            max_workers: 同時に実行するプロセス数
+        """
+        self.max_workers = max_workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+        self.active = 0
+        self.completed = 0
+        self.restarts = 0
+
+    def _create_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker)
+
+    def start(self) -> None:
+        """プロセスプールを起動し、全ワーカーをウォームアップ"""
+        if self.max_workers <= 0:
+            print(f"[Synthesis Executor] Process pool disabled, running CPU-bound stages in threads")
+            return
+
+        with self._lock:
+            if self._pool is not None:
+                return
+            self._pool = self._create_pool()
+            pool = self._pool
+
+        # ワーカー数分のタスクを投入し、全プロセスの起動と初期化（事前インポート）を済ませる
+        for future in [pool.submit(_warmup) for _ in range(self.max_workers)]:
+            future.result()
+        print(f"[Synthesis Executor] Started process pool with {self.max_workers} workers")
+
+    def shutdown(self) -> None:
+        """プロセスプールを停止"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+            print(f"[Synthesis Executor] Process pool stopped")
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        関数をプロセスプールで実行して結果を待つ
+
+        Args:
+            func: 実行する関数（pickle可能なモジュールレベル関数）
+            *args: 関数の引数（pickle可能であること）
+
+        Returns:
+            Any: 関数の戻り値
+
+        Raises:
+            Exception: 関数内で発生した例外をそのまま再送出
+        """
+        loop = asyncio.get_running_loop()
+
+        if self.max_workers <= 0:
+            pool = None  # デフォルトのスレッドプール
+        else:
+            if self._pool is None:
+                await loop.run_in_executor(None, self.start)
+            pool = self._pool
+
+        self.active += 1
+        try:
+            result = await loop.run_in_executor(pool, func, *args)
+            self.completed += 1
+            return result
+        except BrokenProcessPool:
+            # ワーカーが異常終了した場合は次回のためにプールを作り直す
+            print(f"[Synthesis Executor] Process pool broken while running {func.__name__}, restarting")
+            with self._lock:
+                if self._pool is pool:
+                    self._pool = self._create_pool()
+                    self.restarts += 1
+            pool.shutdown(wait=False)
+            raise
+        finally:
+            self.active -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        プール統計を取得
+
+        Returns:
+            Dict[str, Any]: ワーカー数・実行中タスク数などの統計
+        """
+        return {
+            "mode": "process" if self.max_workers > 0 else "thread",
+            "max_workers": self.max_workers,
+            "running": self._pool is not None,
+            "active_tasks": self.active,
+            "completed_tasks": self.completed,
+            "restarts": self.restarts
+        }
+
+
+# グローバル実行器インスタンス（ワーカーはアプリ起動時に開始）
+synthesis_executor = SynthesisExecutor(SYNTHESIS_PROCESS_WORKERS)
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthesis Job Queue for DiffSinger
+
+このモジュールは非同期合成ジョブのキューとワーカーを提供します。
+ジョブ投入時にはrequest_idだけを即座に返し、上限付きのワーカーが順に処理します。
+キュー全体およびクライアントごとの未完了ジョブ数に上限を設け、超過時は投入を拒否します。
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from models import SynthesisRequest, SynthesisResponse, DEFAULT_OUTPUT_PATH
+
+# ジョブ処理関数: (リクエスト, モデルID, 進捗コールバック) -> 合成結果
+ProgressCallback = Callable[[float, str], None]
+JobHandler = Callable[[SynthesisRequest, str, ProgressCallback], Awaitable[SynthesisResponse]]
+
+
+class JobQueueFullError(Exception):
+    """ジョブキューが満杯、またはクライアントごとの上限に達した場合のエラー"""
+
+    def __init__(self, message: str, per_client: bool, retry_after: int):
+        super().__init__(message)
+        self.per_client = per_client
+        self.retry_after = retry_after
+
+
+@dataclass
+class SynthesisJob:
+    """合成ジョブの状態"""
+    request_id: str
+    client_id: str
+    model_id: str
+    request: SynthesisRequest
+    status: str = "queued"  # queued, running, completed, failed
+    progress: float = 0.0
+    message: str = "Queued"
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[SynthesisResponse] = None
+    error: Optional[str] = None
+    owned_output_path: Optional[str] = None  # ジョブ用に割り当てた出力パス（保持期間が過ぎたら削除）
+
+
+class SynthesisJobManager:
+    """
+    合成ジョブの投入・実行・状態管理
+
+    Attributes:
+        num_workers (int): 同時に実行するジョブ数
+        max_queue_size (int): 待機中ジョブの最大数
+        max_jobs_per_client (int): クライアントごとの未完了ジョブの最大数
+        retention_sec (float): 完了ジョブの状態を保持する秒数
+    """
+
+    def __init__(
+        self,
+        handler: JobHandler,
+        num_workers: int,
+        max_queue_size: int,
+        max_jobs_per_client: int,
+        retention_sec: float,
+        retry_after_sec: int
+    ):
+        """
+        初期化
+
+        Args:
+            handler: ジョブを実際に処理するコルーチン関数
+            num_workers: 同時に実行するジョブ数
+            max_queue_size: 待機中ジョブの最大数
+            max_jobs_per_client: クライアントごとの未完了ジョブの最大数
+            retention_sec: 完了ジョブの状態を保持する秒数
+            retry_after_sec: 投入拒否時に返す再試行までの秒数
+        """
+        self.handler = handler
+        self.num_workers = num_workers
+        self.max_queue_size = max_queue_size
+        self.max_jobs_per_client = max_jobs_per_client
+        self.retention_sec = retention_sec
+        self.retry_after_sec = retry_after_sec
+
+        self._jobs: Dict[str, SynthesisJob] = {}
+        self._pending: Deque[str] = deque()  # 待機順（キュー位置の算出用）
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    async def start(self) -> None:
+        """ワーカーを起動（イベントループ上で呼ぶこと）"""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self.num_workers)
+        ]
+        print(f"[Synthesis Jobs] Started {self.num_workers} workers (queue size: {self.max_queue_size})")
+
+    async def stop(self) -> None:
+        """ワーカーを停止"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        print(f"[Synthesis Jobs] Stopped workers")
+
+    def _active_jobs_for(self, client_id: str) -> int:
+        return sum(
+            1 for job in self._jobs.values()
+            if job.client_id == client_id and job.status in ("queued", "running")
+        )
+
+    def _prune(self) -> None:
+        """保持期間を過ぎた完了ジョブを削除（ジョブ用に割り当てた出力ファイルも削除）"""
+        now = time.time()
+        expired = [
+            request_id for request_id, job in self._jobs.items()
+            if job.finished_at is not None and now - job.finished_at > self.retention_sec
+        ]
+        for request_id in expired:
+            job = self._jobs.pop(request_id)
+            # キャッシュ済みの結果（cache_*.wav）は他のリクエストと共有するためキャッシュ側の上限に任せる
+            if job.owned_output_path is not None:
+                try:
+                    os.remove(job.owned_output_path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"[Synthesis Jobs] Failed to remove {job.owned_output_path}: {e}")
+
+    async def submit(self, request: SynthesisRequest, client_id: str, model_id: str) -> SynthesisJob:
+        """
+        ジョブを投入
+
+        Args:
+            request: 合成リクエスト
+            client_id: クライアント識別子
+            model_id: 使用するモデルID（投入時点のモデルを固定）
+
+        Returns:
+            SynthesisJob: 投入されたジョブ
+
+        Raises:
+            JobQueueFullError: キュー全体またはクライアントの上限に達した場合
+        """
+        if self._queue is None:
+            await self.start()
+        self._prune()
+
+        if len(self._pending) >= self.max_queue_size:
+            self.rejected += 1
+            raise JobQueueFullError(
+                f"Synthesis queue is full ({self.max_queue_size} jobs waiting)",
+                per_client=False,
+                retry_after=self.retry_after_sec
+            )
+        if self._active_jobs_for(client_id) >= self.max_jobs_per_client:
+            self.rejected += 1
+            raise JobQueueFullError(
+                f"Too many active synthesis jobs for this client (max {self.max_jobs_per_client})",
+                per_client=True,
+                retry_after=self.retry_after_sec
+            )
+
+        request_id = uuid.uuid4().hex
+        owned_output_path = None
+        # 既定の出力パスのままだと並行ジョブが同じファイルに書き込むため、ジョブごとに分ける
+        if request.output_path == DEFAULT_OUTPUT_PATH:
+            owned_output_path = f"outputs/synthesis_{request_id}.wav"
+            request = SynthesisRequest(
+                lyrics=request.lyrics,
+                notes=request.notes,
+                durations=request.durations,
+                output_path=owned_output_path
+            )
+
+        job = SynthesisJob(request_id=request_id, client_id=client_id, model_id=model_id, request=request,
+                           owned_output_path=owned_output_path)
+        self._jobs[request_id] = job
+        self._pending.append(request_id)
+        self._queue.put_nowait(request_id)
+        print(f"[Synthesis Jobs] Queued {request_id} for {client_id} (position {len(self._pending)})")
+        return job
+
+    def get(self, request_id: str) -> Optional[SynthesisJob]:
+        """ジョブを取得"""
+        self._prune()
+        return self._jobs.get(request_id)
+
+    def queue_position(self, request_id: str) -> int:
+        """待機中ジョブのキュー位置（1始まり、待機中でなければ0）"""
+        try:
+            return self._pending.index(request_id) + 1
+        except ValueError:
+            return 0
+
+    def status(self, request_id: str) -> Optional[Dict[str, Any]]:
+        """
+        ジョブの状態を辞書で取得
+
+        Args:
+            request_id: リクエストID
+
+        Returns:
+            Optional[Dict[str, Any]]: ジョブ状態（存在しない場合はNone）
+        """
+        job = self.get(request_id)
+        if job is None:
+            return None
+
+        status = {
+            "request_id": job.request_id,
+            "status": job.status,
+            "progress": int(round(job.progress * 100)),
+            "queue_position": self.queue_position(request_id),
+            "message": job.message,
+            "model": job.model_id,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at
+        }
+        if job.result is not None:
+            status["audio_path"] = job.result.audio_path
+            status["duration"] = job.result.duration
+        if job.error is not None:
+            status["error"] = job.error
+        return status
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        キュー統計を取得
+
+        Returns:
+            Dict[str, Any]: 待機数・実行数などの統計
+        """
+        running = sum(1 for job in self._jobs.values() if job.status == "running")
+        return {
+            "workers": self.num_workers,
+            "queued": len(self._pending),
+            "running": running,
+            "max_queue_size": self.max_queue_size,
+            "max_jobs_per_client": self.max_jobs_per_client,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected
+        }
+
+    async def _worker(self, worker_index: int) -> None:
+        """キューからジョブを取り出して処理するワーカー"""
+        while True:
+            request_id = await self._queue.get()
+            job = self._jobs.get(request_id)
+            try:
+                self._pending.remove(request_id)
+            except ValueError:
+                pass
+            if job is None:
+                self._queue.task_done()
+                continue
+
+            job.status = "running"
+            job.message = "Synthesis started"
+            job.started_at = time.time()
+            print(f"[Synthesis Jobs] Worker {worker_index} running {request_id}")
+
+            def report_progress(progress: float, message: str) -> None:
+                job.progress = max(job.progress, min(progress, 1.0))
+                job.message = message
+
+            try:
+                job.result = await self.handler(job.request, job.model_id, report_progress)
+                job.status = "completed"
+                job.progress = 1.0
+                job.message = job.result.message
+                self.completed += 1
+            except asyncio.CancelledError:
+                job.status = "failed"
+                job.error = "Server shutting down"
+                raise
+            except Exception as e:
+                job.status = "failed"
+                job.error = getattr(e, "detail", None) or str(e)
+                job.message = "Synthesis failed"
+                self.failed += 1
+                print(f"[Synthesis Jobs] Job {request_id} failed: {job.error}")
+            finally:
+                job.finished_at = time.time()
+                self._queue.task_done()
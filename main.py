@@ -17,7 +17,7 @@ from pathlib import Path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
 
 # 直接ai_agentのmain.pyからFastAPIアプリをインポート
-from ai_agent.main import app as ai_agent_app
+from ai_agent.main import app as ai_agent_app, http_sessions
 
 # メインのFastAPIアプリケーションを作成
 app = FastAPI(
@@ -43,6 +43,15 @@ if os.path.exists(frontend_build_path):
 # AI Agentのルートをマウント
 app.mount("/ai", ai_agent_app)
 
+# マウントしたサブアプリの起動・終了イベントは呼ばれないため、共有HTTPセッションをここで管理
+@app.on_event("startup")
+async def startup_event():
+    await http_sessions.startup()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await http_sessions.close()
+
 # ヘルスチェックエンドポイント
 @app.get("/health")
 async def health_check():